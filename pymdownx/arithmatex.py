@@ -49,12 +49,9 @@ CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFT
 DEALINGS IN THE SOFTWARE.
 """
 
-import re
-
 from markdown import Extension
 from markdown import util as md_util
 from markdown.blockprocessors import BlockProcessor
-from markdown.inlinepatterns import Pattern
 
 from . import util
 
@@ -64,9 +61,11 @@ RE_DOLLAR_INLINE = (
 RE_BRACKET_INLINE = (
     r"(?:(?<!\\)((?:\\{2})+?)(?=\\\()|(?<!\\)(\\\()((?:\\[^)]|[^\\])+?)(?:\\\)))"
 )
+# Where any of the inline patterns can start.
+RE_INLINE_OPEN = r"(?<!\\)(?:\\+(?=[\$(])|\$)"
 
 
-class InlineArithmatexPattern(Pattern):
+class InlineArithmatexPattern(util.InlineProcessor):
     """Arithmatex inline pattern handler."""
 
     ESCAPED_BSLASH = "{}{}{}".format(md_util.STX, ord("\\"), md_util.ETX)
@@ -76,30 +75,29 @@ class InlineArithmatexPattern(Pattern):
 
         self.script = script
         self.wrap = wrap[0] + "%s" + wrap[1]
-        Pattern.__init__(self, pattern)
-        self.markdown = md
+        util.InlineProcessor.__init__(self, pattern, md, RE_INLINE_OPEN)
 
-    def handleMatch(self, m):
+    def handle_match(self, m, data):
         """Handle notations and switch them to something that will be more detectable in HTML."""
 
         # Handle escapes
-        escapes = m.group(2)
+        escapes = m.group(1)
         if not escapes:
-            escapes = m.group(5)
+            escapes = m.group(4)
         if escapes:
-            return escapes.replace("\\\\", self.ESCAPED_BSLASH)
+            return escapes.replace("\\\\", self.ESCAPED_BSLASH), m.start(0), m.end(0)
 
         # Handle Tex
-        math = m.group(4)
+        math = m.group(3)
         if not math:
-            math = m.group(7)
+            math = m.group(6)
         if self.script:
             el = md_util.etree.Element("script", {"type": "math/tex"})
             el.text = md_util.AtomicString(math)
         else:
             el = md_util.etree.Element("span")
             el.text = md_util.AtomicString(self.wrap % math)
-        return el
+        return el, m.start(0), m.end(0)
 
 
 class BlockArithmatexProcessor(BlockProcessor):
@@ -120,16 +118,23 @@ class BlockArithmatexProcessor(BlockProcessor):
             config.get("block_syntax", ["dollar", "square", "begin"])
         )
         pattern = []
+        triggers = []
         if "dollar" in allowed_patterns:
             pattern.append(self.RE_DOLLAR_BLOCK)
+            triggers.append(("$$", "$$"))
         if "square" in allowed_patterns:
             pattern.append(self.RE_BRACKET_BLOCK)
+            triggers.append(("\\[", "\\]"))
         if "begin" in allowed_patterns:
             pattern.append(self.RE_TEX_BLOCK)
+            triggers.append(("\\begin{", "}"))
+
+        # How a block must start and end for the pattern to have a chance.
+        self.starts = tuple(start for start, end in triggers)
+        self.ends = tuple(end for start, end in triggers)
 
-        self.match = None
         if pattern:
-            self.pattern = re.compile(r"(?s)^(?:%s)[ ]*$" % "|".join(pattern))
+            self.pattern = util.compile_re(r"(?s)^(?:%s)[ ]*$" % "|".join(pattern))
         else:
             self.pattern = None
         self.markdown = md
@@ -139,19 +144,25 @@ class BlockArithmatexProcessor(BlockProcessor):
     def test(self, parent, block):
         """Return 'True' for future Python Markdown block compatibility."""
 
-        self.match = self.pattern.match(block) if self.pattern is not None else None
-        return self.match is not None
+        return (
+            self.pattern is not None
+            and block.startswith(self.starts)
+            and block.rstrip(" \n").endswith(self.ends)
+            and self.pattern.match(block) is not None
+        )
 
     def run(self, parent, blocks):
         """Find and handle block content."""
 
-        blocks.pop(0)
+        # The match is not kept from `test` as the processor is shared by every
+        # document converted with this Markdown instance.
+        m = self.pattern.match(blocks.pop(0))
 
-        math = self.match.group("math")
+        math = m.group("math")
         if not math:
-            math = self.match.group("math2")
+            math = m.group("math2")
         if not math:
-            math = self.match.group("math3")
+            math = m.group("math3")
         if self.script:
             el = md_util.etree.SubElement(
                 parent, "script", {"type": "math/tex; mode=display"}
@@ -54,6 +54,8 @@ RE_TAG_HTML = re.compile(
     """
 )
 
+RE_STASHED_TAG = re.compile(r"<img")
+
 RE_TAG_LINK_ATTR = re.compile(
     r"""(?xus)
     (?P<attr>
@@ -66,8 +68,12 @@ RE_TAG_LINK_ATTR = re.compile(
 )
 
 
-def repl_path(m, base_path):
-    """Replace path with b64 encoded data."""
+def repl_path(m, base_path, budget=None):
+    """
+    Replace path with b64 encoded data.
+
+    Images that don't fit in the document's `budget` are left linked.
+    """
 
     link = m.group(0)
     try:
@@ -91,6 +97,10 @@ def repl_path(m, base_path):
             ext = os.path.splitext(file_name)[1].lower()
             for b64_ext in file_types:
                 if ext in b64_ext:
+                    if budget is not None and not budget.spend(
+                        "b64", "max_b64_bytes", os.path.getsize(file_name), file_name
+                    ):
+                        break
                     with open(file_name, "rb") as f:
                         link = ' src="data:{};base64,{}"'.format(
                             file_types[b64_ext],
@@ -105,7 +115,7 @@ def repl_path(m, base_path):
     return link
 
 
-def repl(m, base_path):
+def repl(m, base_path, budget=None):
     """Replace."""
 
     if m.group("comments"):
@@ -113,7 +123,7 @@ def repl(m, base_path):
     else:
         tag = m.group("open")
         tag += RE_TAG_LINK_ATTR.sub(
-            lambda m2: repl_path(m2, base_path), m.group("attr")
+            lambda m2: repl_path(m2, base_path, budget), m.group("attr")
         )
         tag += m.group("close")
     return tag
@@ -122,11 +132,24 @@ def repl(m, base_path):
 class B64Postprocessor(Postprocessor):
     """Post processor for B64."""
 
+    active = True
+
+    def check(self, root):
+        """Check if the document has any images."""
+
+        return util.has_links(root, ("img",)) or util.has_stashed(
+            self.markdown, RE_STASHED_TAG
+        )
+
     def run(self, text):
         """Find and replace paths with base64 encoded file."""
 
+        if not self.active:
+            return text
+
         basepath = self.config["base_path"]
-        text = RE_TAG_HTML.sub(lambda m: repl(m, basepath), text)
+        budget = util.get_budget(self.markdown)
+        text = RE_TAG_HTML.sub(lambda m: repl(m, basepath, budget), text)
         return text
 
 
@@ -145,13 +168,24 @@ class B64Extension(Extension):
 
         super().__init__(*args, **kwargs)
 
+        self.unconfigured = []
+
     def extendMarkdown(self, md, md_globals):
         """Add B64Treeprocessor to Markdown instance."""
 
         b64 = B64Postprocessor(md)
         b64.config = self.getConfigs()
         md.postprocessors.add("b64", b64, "_end")
+        md.treeprocessors.add("b64", util.ActivityTreeprocessor(md, b64), "_end")
         md.registerExtension(self)
+        self.unconfigured.append(md)
+
+    def reset(self):
+        """Check for images after all other tree processors."""
+
+        unconfigured, self.unconfigured = self.unconfigured, []
+        for md in unconfigured:
+            md.treeprocessors.link("b64", "_end")
 
 
 def makeExtension(*args, **kwargs):
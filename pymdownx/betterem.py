@@ -24,21 +24,48 @@ DEALINGS IN THE SOFTWARE.
 """
 
 from markdown import Extension
-from markdown.inlinepatterns import DoubleTagPattern, SimpleTagPattern
 
-SMART_UNDER_CONTENT = r"((?:[^_]|_(?=\w|\s)|(?<=\s)_+?(?=\s))+?_*?)"
-SMART_STAR_CONTENT = r"((?:[^\*]|\*(?=[^\W_]|\*|\s)|(?<=\s)\*+?(?=\s))+?\**?)"
+from . import util
+
+# Every delimiter the smart content can hold is already allowed one at a time
+# (a run of delimiters is always followed by another delimiter or whitespace),
+# so the content is a plain repetition with one way to match any given text.
+# A delimiter it cannot hold is a barrier: when a search fails, no opener
+# before the barrier can succeed either, so the processor skips straight to it.
+SMART_UNDER_CONTENT = r"((?:[^_]|_(?=\w|\s))+?)"
+SMART_UNDER_BARRIER = r"_(?![\w\s])"
+SMART_STAR_CONTENT = r"((?:[^\*]|\*(?=[^\W_]|\*|\s))+?)"
+SMART_STAR_BARRIER = r"\*(?![^\W_]|\*|\s)"
 SMART_UNDER_MIXED_CONTENT = r"((?:[^_]|_(?=\w)|(?<=\s)_+?(?=\s))+?_*)"
 SMART_STAR_MIXED_CONTENT = r"((?:[^\*]|\*(?=[^\W_]|\*)|(?<=\s)\*+?(?=\s))+?\**)"
+# The mixed content can also hold a run of delimiters between whitespace, which
+# depends on more than the next character, so its barrier is any delimiter not
+# followed by a word: it may stop the skip early, but never too late.
+SMART_UNDER_MIXED_BARRIER = r"_(?!\w)"
+SMART_STAR_MIXED_BARRIER = r"\*(?![^\W_]|\*)"
 UNDER_CONTENT = r"(_|(?:(?<=\s)_|[^_])+?)"
 UNDER_CONTENT2 = r"((?:[^_]|(?<!_)_(?=\w))+?)"
 STAR_CONTENT = r"(\*|(?:(?<=\s)\*|[^\*])+?)"
 STAR_CONTENT2 = r"((?:[^\*]|(?<!\*)\*(?=[^\W_]|\*))+?)"
+UNDER_BARRIER2 = r"(?<=_)_|_(?!\w)"
+STAR_BARRIER2 = r"(?<=\*)\*|\*(?![^\W_]|\*)"
+# What neither content of a match can hold (see `util.InlineProcessor`).
+# The delimiters between the two contents can hold up to two of these.
+UNDER_MIXED_FENCE = r"(?<=_)_|(?<!\s)_(?!\w)"
+STAR_MIXED_FENCE = r"(?<=\*)\*|(?<!\s)\*(?![^\W_]|\*)"
+UNDER_STRONG_EM_FENCE = r"_"
+STAR_STRONG_EM_FENCE = r"\*"
+UNDER_EM_FENCE = r"(?<!\s)_"
+STAR_EM_FENCE = r"(?<!\s)\*"
 
 # ***strong,em***
-STAR_STRONG_EM = r"(\*{3})(?!\s)(\*{1,2}|[^\*]+?)(?<!\s)\2"
+STAR_STRONG_EM_OPEN = r"(\*{3})(?!\s)"
+STAR_STRONG_EM = r"%s(\*{1,2}|[^\*]+?)(?<!\s)\1" % STAR_STRONG_EM_OPEN
 # ___strong,em___
-UNDER_STRONG_EM = r"(_{3})(?!\s)(_{1,2}|[^_]+?)(?<!\s)\2"
+UNDER_STRONG_EM_OPEN = r"(_{3})(?!\s)"
+UNDER_STRONG_EM = r"%s(_{1,2}|[^_]+?)(?<!\s)\1" % UNDER_STRONG_EM_OPEN
+STAR_MIXED_OPEN = r"(\*{3})(?![\s\*])"
+UNDER_MIXED_OPEN = r"(_{3})(?![\s_])"
 # ***strong,em*strong**
 STAR_STRONG_EM2 = r"(\*{{3}})(?![\s\*]){}(?<!\s)\*{}(?<!\s)\*{{2}}".format(
     STAR_CONTENT, STAR_CONTENT2
@@ -56,17 +83,25 @@ UNDER_EM_STRONG = r"(_{{3}})(?![\s_]){}(?<!\s)_{{2}}{}(?<!\s)_".format(
     UNDER_CONTENT2, UNDER_CONTENT
 )
 # **strong**
-STAR_STRONG = r"(\*{2})(?!\s)%s(?<!\s)\2" % STAR_CONTENT2
+STAR_STRONG_OPEN = r"(\*{2})(?!\s)"
+STAR_STRONG = r"%s%s(?<!\s)\1" % (STAR_STRONG_OPEN, STAR_CONTENT2)
 # __strong__
-UNDER_STRONG = r"(_{2})(?!\s)%s(?<!\s)\2" % UNDER_CONTENT2
+UNDER_STRONG_OPEN = r"(_{2})(?!\s)"
+UNDER_STRONG = r"%s%s(?<!\s)\1" % (UNDER_STRONG_OPEN, UNDER_CONTENT2)
 # *emphasis*
-STAR_EM = r"(\*)(?!\s)%s(?<!\s)\2" % STAR_CONTENT
+STAR_EM_OPEN = r"(\*)(?!\s)"
+STAR_EM = r"%s%s(?<!\s)\1" % (STAR_EM_OPEN, STAR_CONTENT)
 # _emphasis_
-UNDER_EM = r"(_)(?!\s)%s(?<!\s)\2" % UNDER_CONTENT
+UNDER_EM_OPEN = r"(_)(?!\s)"
+UNDER_EM = r"%s%s(?<!\s)\1" % (UNDER_EM_OPEN, UNDER_CONTENT)
 
 # Smart rules for when "smart underscore" is enabled
 # SMART: ___strong,em___
-SMART_UNDER_STRONG_EM = r"(?<!\w)(_{3})(?![\s_])%s(?<!\s)\2(?!\w)" % SMART_UNDER_CONTENT
+SMART_UNDER_STRONG_EM_OPEN = r"(?<!\w)(_{3})(?![\s_])"
+SMART_UNDER_STRONG_EM = r"%s%s(?<!\s)\1(?!\w)" % (
+    SMART_UNDER_STRONG_EM_OPEN,
+    SMART_UNDER_CONTENT,
+)
 # ___strong,em_ strong__
 SMART_UNDER_STRONG_EM2 = (
     r"(?<!\w)(_{{3}})(?![\s_]){}(?<!\s)_(?!\w){}(?<!\s)_{{2}}(?!\w)".format(
@@ -80,15 +115,21 @@ SMART_UNDER_EM_STRONG = (
     )
 )
 # __strong__
-SMART_UNDER_STRONG = r"(?<!\w)(_{2})(?![\s_])%s(?<!\s)\2(?!\w)" % SMART_UNDER_CONTENT
+SMART_UNDER_STRONG_OPEN = r"(?<!\w)(_{2})(?![\s_])"
+SMART_UNDER_STRONG = r"%s%s(?<!\s)\1(?!\w)" % (
+    SMART_UNDER_STRONG_OPEN,
+    SMART_UNDER_CONTENT,
+)
 # SMART _em_
-SMART_UNDER_EM = r"(?<!\w)(_)(?![\s_])%s(?<!\s)\2(?!\w)" % SMART_UNDER_CONTENT
+SMART_UNDER_EM_OPEN = r"(?<!\w)(_)(?![\s_])"
+SMART_UNDER_EM = r"%s%s(?<!\s)\1(?!\w)" % (SMART_UNDER_EM_OPEN, SMART_UNDER_CONTENT)
 
 # Smart rules for when "smart asterisk" is enabled
 # SMART: ***strong,em***
-SMART_STAR_STRONG_EM = (
-    r"(?:(?<=_)|(?<![\w\*]))(\*{3})(?![\s\*])%s(?<!\s)\2(?:(?=_)|(?![\w\*]))"
-    % SMART_STAR_CONTENT
+SMART_STAR_STRONG_EM_OPEN = r"(?:(?<=_)|(?<![\w\*]))(\*{3})(?![\s\*])"
+SMART_STAR_STRONG_EM = r"%s%s(?<!\s)\1(?:(?=_)|(?![\w\*]))" % (
+    SMART_STAR_STRONG_EM_OPEN,
+    SMART_STAR_CONTENT,
 )
 # ***strong,em* strong**
 SMART_STAR_STRONG_EM2 = r"(?:(?<=_)|(?<![\w\*]))(\*{{3}})(?![\s\*]){}(?<!\s)\*(?:(?=_)|(?![\w\*])){}(?<!\s)\*{{2}}(?:(?=_)|(?![\w\*]))".format(
@@ -99,14 +140,16 @@ SMART_STAR_EM_STRONG = r"(?:(?<=_)|(?<![\w\*]))(\*{{3}})(?![\s\*]){}(?<!\s)\*{{2
     SMART_STAR_MIXED_CONTENT, SMART_STAR_CONTENT
 )
 # **strong**
-SMART_STAR_STRONG = (
-    r"(?:(?<=_)|(?<![\w\*]))(\*{2})(?![\s\*])%s(?<!\s)\2(?:(?=_)|(?![\w\*]))"
-    % SMART_STAR_CONTENT
+SMART_STAR_STRONG_OPEN = r"(?:(?<=_)|(?<![\w\*]))(\*{2})(?![\s\*])"
+SMART_STAR_STRONG = r"%s%s(?<!\s)\1(?:(?=_)|(?![\w\*]))" % (
+    SMART_STAR_STRONG_OPEN,
+    SMART_STAR_CONTENT,
 )
 # SMART *em*
-SMART_STAR_EM = (
-    r"(?:(?<=_)|(?<![\w\*]))(\*)(?![\s\*])%s(?<!\s)\2(?:(?=_)|(?![\w\*]))"
-    % SMART_STAR_CONTENT
+SMART_STAR_EM_OPEN = r"(?:(?<=_)|(?<![\w\*]))(\*)(?![\s\*])"
+SMART_STAR_EM = r"%s%s(?<!\s)\1(?:(?=_)|(?![\w\*]))" % (
+    SMART_STAR_EM_OPEN,
+    SMART_STAR_CONTENT,
 )
 
 
@@ -149,36 +192,114 @@ class BetterEmExtension(Extension):
 
         star_strong_em = SMART_STAR_STRONG_EM if enable_star else STAR_STRONG_EM
         under_strong_em = SMART_UNDER_STRONG_EM if enable_under else UNDER_STRONG_EM
+        star_strong_em_skip = (
+            (SMART_STAR_STRONG_EM_OPEN, SMART_STAR_BARRIER, SMART_STAR_BARRIER)
+            if enable_star
+            else (STAR_STRONG_EM_OPEN, None, STAR_STRONG_EM_FENCE)
+        )
+        under_strong_em_skip = (
+            (SMART_UNDER_STRONG_EM_OPEN, SMART_UNDER_BARRIER, SMART_UNDER_BARRIER)
+            if enable_under
+            else (UNDER_STRONG_EM_OPEN, None, UNDER_STRONG_EM_FENCE)
+        )
         star_em_strong = SMART_STAR_EM_STRONG if enable_star else STAR_EM_STRONG
         under_em_strong = SMART_UNDER_EM_STRONG if enable_under else UNDER_EM_STRONG
         star_strong_em2 = SMART_STAR_STRONG_EM2 if enable_star else STAR_STRONG_EM2
         under_strong_em2 = SMART_UNDER_STRONG_EM2 if enable_under else UNDER_STRONG_EM2
+        star_mixed_skip = (
+            (
+                SMART_STAR_STRONG_EM_OPEN,
+                SMART_STAR_MIXED_BARRIER,
+                SMART_STAR_BARRIER,
+                1,
+            )
+            if enable_star
+            else (STAR_MIXED_OPEN, None, STAR_MIXED_FENCE, 2)
+        )
+        under_mixed_skip = (
+            (
+                SMART_UNDER_STRONG_EM_OPEN,
+                SMART_UNDER_MIXED_BARRIER,
+                SMART_UNDER_BARRIER,
+                1,
+            )
+            if enable_under
+            else (UNDER_MIXED_OPEN, None, UNDER_MIXED_FENCE, 2)
+        )
         star_strong = SMART_STAR_STRONG if enable_star else STAR_STRONG
         under_strong = SMART_UNDER_STRONG if enable_under else UNDER_STRONG
+        star_strong_skip = (
+            (SMART_STAR_STRONG_OPEN, SMART_STAR_BARRIER, SMART_STAR_BARRIER)
+            if enable_star
+            else (STAR_STRONG_OPEN, STAR_BARRIER2, STAR_BARRIER2)
+        )
+        under_strong_skip = (
+            (SMART_UNDER_STRONG_OPEN, SMART_UNDER_BARRIER, SMART_UNDER_BARRIER)
+            if enable_under
+            else (UNDER_STRONG_OPEN, UNDER_BARRIER2, UNDER_BARRIER2)
+        )
         star_emphasis = SMART_STAR_EM if enable_star else STAR_EM
         under_emphasis = SMART_UNDER_EM if enable_under else UNDER_EM
+        star_emphasis_skip = (
+            (SMART_STAR_EM_OPEN, SMART_STAR_BARRIER, SMART_STAR_BARRIER)
+            if enable_star
+            else (STAR_EM_OPEN, None, STAR_EM_FENCE)
+        )
+        under_emphasis_skip = (
+            (SMART_UNDER_EM_OPEN, SMART_UNDER_BARRIER, SMART_UNDER_BARRIER)
+            if enable_under
+            else (UNDER_EM_OPEN, None, UNDER_EM_FENCE)
+        )
 
-        md.inlinePatterns["strong_em"] = DoubleTagPattern(star_strong_em, "strong,em")
+        md.inlinePatterns["strong_em"] = util.DoubleTagInlineProcessor(
+            star_strong_em, "strong,em", *star_strong_em_skip
+        )
         md.inlinePatterns.add(
-            "strong_em2", DoubleTagPattern(under_strong_em, "strong,em"), ">strong_em"
+            "strong_em2",
+            util.DoubleTagInlineProcessor(
+                under_strong_em, "strong,em", *under_strong_em_skip
+            ),
+            ">strong_em",
         )
         md.inlinePatterns.link("em_strong", ">strong_em2")
-        md.inlinePatterns["em_strong"] = DoubleTagPattern(star_em_strong, "em,strong")
+        md.inlinePatterns["em_strong"] = util.DoubleTagInlineProcessor(
+            star_em_strong, "em,strong", *star_mixed_skip
+        )
         md.inlinePatterns.add(
-            "em_strong2", DoubleTagPattern(under_em_strong, "em,strong"), ">em_strong"
+            "em_strong2",
+            util.DoubleTagInlineProcessor(
+                under_em_strong, "em,strong", *under_mixed_skip
+            ),
+            ">em_strong",
         )
         md.inlinePatterns.add(
-            "strong_em3", DoubleTagPattern(star_strong_em2, "strong,em"), ">em_strong2"
+            "strong_em3",
+            util.DoubleTagInlineProcessor(
+                star_strong_em2, "strong,em", *star_mixed_skip
+            ),
+            ">em_strong2",
         )
         md.inlinePatterns.add(
-            "strong_em4", DoubleTagPattern(under_strong_em2, "strong,em"), ">strong_em3"
+            "strong_em4",
+            util.DoubleTagInlineProcessor(
+                under_strong_em2, "strong,em", *under_mixed_skip
+            ),
+            ">strong_em3",
+        )
+        md.inlinePatterns["strong"] = util.SimpleTagInlineProcessor(
+            star_strong, "strong", *star_strong_skip
         )
-        md.inlinePatterns["strong"] = SimpleTagPattern(star_strong, "strong")
         md.inlinePatterns.add(
-            "strong2", SimpleTagPattern(under_strong, "strong"), ">strong"
+            "strong2",
+            util.SimpleTagInlineProcessor(under_strong, "strong", *under_strong_skip),
+            ">strong",
+        )
+        md.inlinePatterns["emphasis"] = util.SimpleTagInlineProcessor(
+            star_emphasis, "em", *star_emphasis_skip
+        )
+        md.inlinePatterns["emphasis2"] = util.SimpleTagInlineProcessor(
+            under_emphasis, "em", *under_emphasis_skip
         )
-        md.inlinePatterns["emphasis"] = SimpleTagPattern(star_emphasis, "em")
-        md.inlinePatterns["emphasis2"] = SimpleTagPattern(under_emphasis, "em")
 
 
 def makeExtension(*args, **kwargs):
@@ -0,0 +1,81 @@
+"""
+Budget.
+
+pymdownx.budget
+Limit the resources one document can use.
+
+MIT license.
+
+Copyright (c) 2017 Isaac Muse <isaacmuse@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions
+of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED
+TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+from markdown import Extension
+
+from . import util
+
+
+class BudgetExtension(Extension):
+    """Budget extension."""
+
+    def __init__(self, *args, **kwargs):
+        """Initialize."""
+
+        self.config = {
+            "max_fence_bytes": [
+                0,
+                "Fences with more bytes (UTF-8) are not highlighted; 0 for no limit - Default: 0",
+            ],
+            "max_snippet_depth": [
+                0,
+                "How deep snippets can include other snippets; 0 for no limit - Default: 0",
+            ],
+            "max_snippet_bytes": [
+                0,
+                "Bytes of snippets a document can include; 0 for no limit - Default: 0",
+            ],
+            "max_b64_bytes": [
+                0,
+                "Bytes of images a document can inline; 0 for no limit - Default: 0",
+            ],
+            "max_emoji": [
+                0,
+                "Emoji a document can convert; 0 for no limit - Default: 0",
+            ],
+            "max_keys": [
+                0,
+                "Keys a document can convert; 0 for no limit - Default: 0",
+            ],
+            "timeout": [
+                0,
+                "Seconds a document has before extensions fall back to plain output; "
+                "0 for no limit - Default: 0",
+            ],
+        }
+        super().__init__(*args, **kwargs)
+
+    def extendMarkdown(self, md, md_globals):
+        """Add the budget to the Markdown instance."""
+
+        md.budget = util.Budget(self.getConfigs())
+        md.preprocessors.add("budget", util.BudgetPreprocessor(md), "_begin")
+        md.registerExtension(self)
+
+
+def makeExtension(*args, **kwargs):
+    """Return extension."""
+
+    return BudgetExtension(*args, **kwargs)
@@ -27,26 +27,35 @@ DEALINGS IN THE SOFTWARE.
 """
 
 from markdown import Extension
-from markdown.inlinepatterns import (DoubleTagPattern, SimpleTagPattern,
-                                     SimpleTextPattern)
-
 from . import util
 
-RE_SMART_CONTENT = r"((?:[^\^]|\^(?=[^\W_]|\^|\s)|(?<=\s)\^+?(?=\s))+?\^*?)"
+# Each character of the content can only be matched one way, and the content
+# stops at a barrier, so a failed match can't backtrack and later openers
+# before the same barrier can be skipped (see `util.InlineProcessor`).
+RE_SMART_CONTENT = r"((?:[^\^]|\^(?=[^\W_]|\^|\s))+?)"
+RE_SMART_BARRIER = r"\^(?![^\W_]|\^|\s)"
 RE_CONTENT = r"((?:[^\^]|(?<!\^)\^(?=[^\W_]|\^))+?)"
-RE_SMART_INS = (
-    r"(?:(?<=_)|(?<![\w\^]))(\^{2})(?![\s\^])%s(?<!\s)\2(?:(?=_)|(?![\w\^]))"
-    % RE_SMART_CONTENT
+RE_BARRIER = r"(?<=\^)\^|\^(?![^\W_]|\^)"
+RE_SMART_INS_OPEN = r"(?:(?<=_)|(?<![\w\^]))(\^{2})(?![\s\^])"
+RE_SMART_INS = r"%s%s(?<!\s)\1(?:(?=_)|(?![\w\^]))" % (
+    RE_SMART_INS_OPEN,
+    RE_SMART_CONTENT,
 )
-RE_INS = r"(\^{2})(?!\s)%s(?<!\s)\2" % RE_CONTENT
+RE_INS_OPEN = r"(\^{2})(?!\s)"
+RE_INS = r"%s%s(?<!\s)\1" % (RE_INS_OPEN, RE_CONTENT)
 
-RE_SUP_INS = r"(\^{3})(?!\s)([^\^]+?)(?<!\s)\2"
-RE_SMART_SUP_INS = r"(\^{3})(?!\s)%s(?<!\s)\2" % RE_SMART_CONTENT
+RE_SUP_INS = r"(\^{3})(?!\s)([^\^]+?)(?<!\s)\1"
+RE_SMART_SUP_INS = r"(\^{3})(?!\s)%s(?<!\s)\1" % RE_SMART_CONTENT
 RE_SUP_INS2 = r"(\^{3})(?!\s)([^\^]+?)(?<!\s)\^{2}([^\^ ]+?)\^"
+RE_SUP_INS_OPEN = r"(\^{3})(?!\s)"
 RE_SMART_SUP_INS2 = (
     r"(\^{3})(?!\s)%s(?<!\s)\^{2}(?:(?=_)|(?![\w\^]))([^\^ ]+?)\^" % RE_SMART_CONTENT
 )
-RE_SUP = r"(\^)([^\^ ]+?|\^)\2"
+RE_SUP_OPEN = r"\^"
+RE_SUP = r"(\^)([^\^ ]+?|\^)\1"
+# What the content of a match can't hold (see `util.InlineProcessor`).
+RE_SUP_INS_FENCE = r"\^"
+RE_SUP_FENCE = r"[\^ ]"
 
 RE_NOT_CARET = r"((^| )(\^)( |$))"
 
@@ -84,32 +93,60 @@ class InsertSubExtension(Extension):
         util.escape_chars(md, escape_chars)
 
         ins_rule = RE_SMART_INS if smart else RE_INS
+        ins_skip = (
+            (RE_SMART_INS_OPEN, RE_SMART_BARRIER, RE_SMART_BARRIER)
+            if smart
+            else (RE_INS_OPEN, RE_BARRIER, RE_BARRIER)
+        )
         sup_ins_rule = RE_SUP_INS
+        sup_ins_skip = (RE_SUP_INS_OPEN, None, RE_SUP_INS_FENCE)
         sup_ins2_rule = RE_SMART_SUP_INS2 if smart else RE_SUP_INS2
+        sup_ins2_skip = (
+            (RE_SUP_INS_OPEN, RE_SMART_BARRIER, RE_SMART_BARRIER, 1)
+            if smart
+            else (RE_SUP_INS_OPEN, None, RE_SUP_INS_FENCE, 2)
+        )
         sup_rule = RE_SUP
+        sup_skip = (RE_SUP_OPEN, None, RE_SUP_FENCE)
 
         if insert:
             md.inlinePatterns.add(
-                "ins", SimpleTagPattern(ins_rule, "ins"), "<not_strong"
+                "ins",
+                util.SimpleTagInlineProcessor(ins_rule, "ins", *ins_skip),
+                "<not_strong",
+            )
+            md.inlinePatterns.add(
+                "not_caret", util.SimpleTextInlineProcessor(RE_NOT_CARET), "<ins"
             )
-            md.inlinePatterns.add("not_caret", SimpleTextPattern(RE_NOT_CARET), "<ins")
             if superscript:
                 md.inlinePatterns.add(
-                    "sup_ins", DoubleTagPattern(sup_ins_rule, "sup,ins"), "<ins"
+                    "sup_ins",
+                    util.DoubleTagInlineProcessor(
+                        sup_ins_rule, "sup,ins", *sup_ins_skip
+                    ),
+                    "<ins",
                 )
                 md.inlinePatterns.add(
-                    "sup_ins2", DoubleTagPattern(sup_ins2_rule, "sup,ins"), "<ins"
+                    "sup_ins2",
+                    util.DoubleTagInlineProcessor(
+                        sup_ins2_rule, "sup,ins", *sup_ins2_skip
+                    ),
+                    "<ins",
                 )
                 md.inlinePatterns.add(
                     "sup",
-                    SimpleTagPattern(sup_rule, "sup"),
+                    util.SimpleTagInlineProcessor(sup_rule, "sup", *sup_skip),
                     ">ins" if smart else "<ins",
                 )
         elif superscript:
             md.inlinePatterns.add(
-                "sup", SimpleTagPattern(sup_rule, "sup"), "<not_strong"
+                "sup",
+                util.SimpleTagInlineProcessor(sup_rule, "sup", *sup_skip),
+                "<not_strong",
+            )
+            md.inlinePatterns.add(
+                "not_caret", util.SimpleTextInlineProcessor(RE_NOT_CARET), "<sup"
             )
-            md.inlinePatterns.add("not_caret", SimpleTextPattern(RE_NOT_CARET), "<sup")
 
 
 def makeExtension(*args, **kwargs):
@@ -24,11 +24,13 @@ CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFT
 DEALINGS IN THE SOFTWARE.
 """
 
+import itertools
 import re
 
 from markdown import Extension
 from markdown.postprocessors import Postprocessor
-from markdown.preprocessors import Preprocessor
+
+from . import util
 
 STX = "\u0002"
 ETX = "\u0003"
@@ -37,12 +39,11 @@ CRITIC_PLACEHOLDER = CRITIC_KEY % r"[0-9]+"
 SINGLE_CRITIC_PLACEHOLDER = r"{stx}(?P<key>{key}){etx}".format(
     key=CRITIC_PLACEHOLDER, stx=STX, etx=ETX
 )
-CRITIC_PLACEHOLDERS = r"""(?x)
-(?:
-    (?P<block>\<p\>(?P<block_keys>(?:{stx}{key}{etx})+)\</p\>) |
-    {single}
+CRITIC_PLACEHOLDERS = (
+    r"(?P<block><p>(?P<block_keys>(?:{stx}{key}{etx})+)</p>)|{single}".format(
+        key=CRITIC_PLACEHOLDER, single=SINGLE_CRITIC_PLACEHOLDER, stx=STX, etx=ETX
+    )
 )
-""".format(key=CRITIC_PLACEHOLDER, single=SINGLE_CRITIC_PLACEHOLDER, stx=STX, etx=ETX)
 ALL_CRITICS = r"""(?x)
 ((?P<critic>(?P<open>\{)
     (?:
@@ -65,7 +66,7 @@ ALL_CRITICS = r"""(?x)
         )
 
       | (?P<sub_open>\~{2})
-        (?P<sub_del_text>.*?)
+        (?P<sub_del_text>(?:[^~]|~(?!>))*?)
         (?P<sub_mid>\~\>)
         (?P<sub_ins_text>.*?)
         (?P<sub_close>\~{2})
@@ -74,6 +75,7 @@ ALL_CRITICS = r"""(?x)
 """
 
 RE_CRITIC = re.compile(ALL_CRITICS, re.DOTALL)
+RE_CRITIC_OPEN = re.compile(r"\{(\+{2}|-{2}|={2}|>{2}|~{2})")
 RE_CRITIC_PLACEHOLDER = re.compile(CRITIC_PLACEHOLDERS)
 RE_CRITIC_SUB_PLACEHOLDER = re.compile(SINGLE_CRITIC_PLACEHOLDER)
 RE_CRITIC_BLOCK = re.compile(r'((?:ins|del|mark)\s+)(class=([\'"]))(.*?)(\3)')
@@ -172,13 +174,13 @@ class CriticsPostprocessor(Postprocessor):
         return text
 
 
-class CriticViewPreprocessor(Preprocessor):
+class CriticViewPreprocessor(util.LinePreprocessor):
     """Handle viewing critic marks in Markdown content."""
 
-    def __init__(self, critic_stash):
+    def __init__(self, critic_stash, md=None):
         """Initialize."""
 
-        super().__init__()
+        super().__init__(md)
         self.critic_stash = critic_stash
 
     def _ins(self, text):
@@ -268,19 +270,56 @@ class CriticViewPreprocessor(Preprocessor):
         txt = txt.replace("\n", "<br>" if not strip_nl else " ")
         return txt
 
-    def run(self, lines):
+    def iter_lines(self, lines):
         """Process critic marks."""
 
+        # Each document starts with an empty stash.
+        self.critic_stash.clear()
+
+        # Lines before the first mark are passed on as they are.  Marks can
+        # span lines, so everything from the first mark on is searched as one.
+        lines = iter(lines)
+        for line in lines:
+            if RE_CRITIC_OPEN.search(line) is None:
+                yield line
+                continue
+            yield from self.parse("\n".join(itertools.chain((line,), lines)))
+
+    def parse(self, text):
+        """Process the critic marks in the text and return its lines."""
+
         # Determine processor type to use
         if self.config["mode"] == "view":
             processor = self.critic_view
         else:
             processor = self.critic_parse
 
-        # Find and process critic marks
-        text = RE_CRITIC.sub(processor, "\n".join(lines))
-
-        return text.split("\n")
+        # Find and process critic marks.  A mark that can't be closed from one
+        # opener can't be closed from any opener after it, so once a kind fails
+        # it is not tried again; otherwise a long run of unclosed marks would
+        # make each opener scan to the end of the document.
+        result = []
+        failed = set()
+        pos = 0
+        start = 0
+        while True:
+            opener = RE_CRITIC_OPEN.search(text, start)
+            if opener is None:
+                break
+            start = opener.start(0) + 1
+            kind = opener.group(1)
+            if kind in failed:
+                continue
+            m = RE_CRITIC.match(text, opener.start(0))
+            if m is None:
+                failed.add(kind)
+                continue
+            result.append(text[pos : m.start(0)])
+            result.append(processor(m))
+            pos = start = m.end(0)
+        result.append(text[pos:])
+
+        return "".join(result).split("\n")
 
 
 class CriticExtension(Extension):
@@ -302,19 +341,25 @@ class CriticExtension(Extension):
 
         super().__init__(*args, **kwargs)
 
-        self.configured = False
+        self.unconfigured = []
 
     def extendMarkdown(self, md, md_globals):
         """Register the extension."""
 
-        self.md = md
         md.registerExtension(self)
-        self.critic_stash = CriticStash(CRITIC_KEY)
-        post = CriticsPostprocessor(self.critic_stash)
-        critic = CriticViewPreprocessor(self.critic_stash)
+        critic_stash = CriticStash(CRITIC_KEY)
+        post = CriticsPostprocessor(critic_stash)
+        critic = CriticViewPreprocessor(critic_stash, md)
         critic.config = self.getConfigs()
         md.preprocessors.add("critic", critic, ">normalize_whitespace")
-        md.postprocessors.add("critic-post", post, ">raw_html")
+        util.get_placeholders(md).add(
+            "critic",
+            CRITIC_PLACEHOLDERS,
+            post.restore,
+            ">raw_html",
+            active=lambda: critic_stash.count > 0,
+        )
+        self.unconfigured.append(md)
 
     def reset(self):
         """
@@ -323,13 +368,15 @@ class CriticExtension(Extension):
         Wait to until after all extensions have been loaded
         so we can be as sure as we can that this is the first
         thing run after "normalize_whitespace"
+
+        The stash itself is cleared at the start of every conversion,
+        so resetting one Markdown instance never touches another
+        instance that shares this extension.
         """
 
-        if not self.configured:
-            self.configured = True
-            self.md.preprocessors.link("critic", ">normalize_whitespace")
-            self.md.postprocessors.link("critic-post", ">raw_html")
-        self.critic_stash.clear()
+        unconfigured, self.unconfigured = self.unconfigured, []
+        for md in unconfigured:
+            md.preprocessors.link("critic", ">normalize_whitespace")
 
 
 def makeExtension(*args, **kwargs):
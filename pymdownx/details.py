@@ -22,11 +22,100 @@ CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFT
 DEALINGS IN THE SOFTWARE.
 """
 
+import hashlib
 import re
+from collections import OrderedDict
 
 from markdown import Extension
 from markdown.blockprocessors import BlockProcessor
-from markdown.util import etree
+from markdown.postprocessors import Postprocessor
+from markdown.preprocessors import Preprocessor
+from markdown.treeprocessors import Treeprocessor
+from markdown.util import ETX, STX, etree
+
+FRAGMENT_ATTR = "data-details-fragment"
+FRAGMENT_START = STX + "details-fragment:%s" + ETX
+FRAGMENT_END = STX + "/details-fragment:%s" + ETX
+
+# Innermost fragment: one that doesn't contain the start of another.
+RE_FRAGMENT = re.compile(
+    r"(?s){stx}details-fragment:(\w+){etx}((?:(?!{stx}details-fragment:).)*?)"
+    r"{stx}/details-fragment:\1{etx}".format(stx=STX, etx=ETX)
+)
+
+RE_FRAGMENT_ATTR = re.compile(r'%s="(\w+)"' % FRAGMENT_ATTR)
+
+HEADINGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+
+
+class DetailsFragments:
+    """Bodies of collapsed details that are rendered as separate fragments."""
+
+    def __init__(self, size=256):
+        """Initialize."""
+
+        # Rendered fragments by hash of the body and the document state it can
+        # use, kept across conversions.  Least recently used ones are dropped.
+        self.cache = OrderedDict()
+        self.size = size
+        # Fragments of the current conversion and the ones still being rendered.
+        self.fragments = {}
+        self.pending = set()
+        self.volatile = set()
+        self.context = None
+
+    def clear(self):
+        """Start a new conversion."""
+
+        self.fragments = {}
+        self.pending = set()
+        self.volatile = set()
+        self.context = None
+
+    def get_context(self, md):
+        """
+        Hash the document state that a body can use.
+
+        Reference links and abbreviations can be defined outside the body, so a
+        body is only the same as one rendered before if they are too.
+        """
+
+        if self.context is None:
+            state = [sorted(md.references.items())]
+            for name, pattern in md.inlinePatterns.items():
+                if name.startswith("abbr-"):
+                    state.append((name, getattr(pattern, "title", None)))
+            self.context = hashlib.sha1(repr(state).encode("utf-8")).digest()
+        return self.context
+
+    def use(self, key):
+        """Use a cached fragment and the fragments nested in it, if they are all still cached."""
+
+        found = {}
+        keys = [key]
+        while keys:
+            key = keys.pop()
+            if key in found:
+                continue
+            html = self.cache.get(key)
+            if html is None:
+                return False
+            found[key] = html
+            keys.extend(RE_FRAGMENT_ATTR.findall(html))
+        for key in found:
+            self.cache.move_to_end(key)
+        self.fragments.update(found)
+        return True
+
+    def store(self, key, html):
+        """Store a rendered fragment."""
+
+        self.fragments[key] = html
+        if key not in self.volatile:
+            self.cache[key] = html
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.size:
+                self.cache.popitem(last=False)
 
 
 class DetailsProcessor(BlockProcessor):
@@ -34,15 +123,49 @@ class DetailsProcessor(BlockProcessor):
 
     START = re.compile(r'(?:^|\n)\?{3}(\+)? ?([\w\-]+)?(?: +"(.*?)") *(?:\n|$)')
 
+    # Every block we handle either contains this or is indented under a details block.
+    TRIGGER = "???"
+
     def test(self, parent, block):
         """Test block."""
 
-        sibling = self.lastChild(parent)
-        return self.START.search(block) or (
-            block.startswith(" " * self.tab_length)
-            and sibling is not None
-            and sibling.tag.lower() == "details"
-        )
+        if block.startswith(" " * self.tab_length):
+            sibling = self.lastChild(parent)
+            if sibling is not None and sibling.tag.lower() == "details":
+                return True
+        return self.TRIGGER in block and self.START.search(block) is not None
+
+    def __init__(self, parser, fragments=None):
+        """Initialize."""
+
+        BlockProcessor.__init__(self, parser)
+        self.fragments = fragments
+
+    def defer(self, div, block, non_details, blocks):
+        """
+        Render the body of a collapsed details block as a fragment.
+
+        The body continues in the following indented blocks, so gather them
+        all up front to hash the whole body.  Cached bodies aren't parsed at all,
+        so bodies that the rest of the document depends on are never cached.
+        """
+
+        body = [block]
+        while (
+            not non_details and blocks and blocks[0].startswith(" " * self.tab_length)
+        ):
+            block, non_details = self.detab(blocks.pop(0))
+            body.append(block)
+        block = "\n\n".join(body)
+
+        key = hashlib.sha1(
+            self.fragments.get_context(self.parser.markdown) + block.encode("utf-8")
+        ).hexdigest()[:16]
+        div.set(FRAGMENT_ATTR, key)
+        if not self.fragments.use(key):
+            self.fragments.pending.add(key)
+            self.parser.parseChunk(div, block)
+        return non_details
 
     def run(self, parent, blocks):
         """Convert to details/summary block."""
@@ -72,24 +195,168 @@ class DetailsProcessor(BlockProcessor):
                 div.set("class", class_name)
             summary = etree.SubElement(div, "summary")
             summary.text = title
+            if self.fragments is not None and not is_open:
+                non_details = self.defer(div, block, non_details, blocks)
+                block = None
         else:
             div = sibling
 
-        self.parser.parseChunk(div, block)
+        if block is not None:
+            self.parser.parseChunk(div, block)
 
         if non_details:
             # Insert the non-details content back into blocks
             blocks.insert(0, non_details)
 
 
+class DetailsFragmentsPreprocessor(Preprocessor):
+    """Clear the fragments of the last conversion."""
+
+    def __init__(self, fragments, md):
+        """Initialize."""
+
+        Preprocessor.__init__(self, md)
+        self.fragments = fragments
+
+    def run(self, lines):
+        """Clear fragments."""
+
+        self.fragments.clear()
+        self.markdown.details_fragments = self.fragments.fragments
+        return lines
+
+
+class DetailsFragmentsTreeprocessor(Treeprocessor):
+    """Mark where the bodies of deferred details start and end in the output."""
+
+    def __init__(self, fragments, md):
+        """Initialize."""
+
+        Treeprocessor.__init__(self, md)
+        self.fragments = fragments
+
+    @staticmethod
+    def is_volatile(el):
+        """Check if an element of a body depends on the rest of the document."""
+
+        return (
+            el.tag in HEADINGS
+            or "id" in el.attrib
+            or (el.tag == "a" and el.get("class") == "footnote-ref")
+        )
+
+    def run(self, root):
+        """
+        Mark bodies of deferred details.
+
+        References to footnotes are numbered in the order they are found, and
+        headings and ids are part of the table of contents and of the ids made
+        unique across the document, so a body that has any of them is never
+        cached, and each copy of it gets its own key.
+        """
+
+        if self.fragments.pending:
+            seen = set()
+            for div in root.iter("details"):
+                key = div.get(FRAGMENT_ATTR)
+                if key in self.fragments.pending:
+                    if any(self.is_volatile(el) for c in div for el in c.iter()):
+                        self.fragments.volatile.add(key)
+                        if key in seen:
+                            key = hashlib.sha1(
+                                ("%s:%d" % (key, len(seen))).encode("utf-8")
+                            ).hexdigest()[:16]
+                            div.set(FRAGMENT_ATTR, key)
+                            self.fragments.pending.add(key)
+                            self.fragments.volatile.add(key)
+                    seen.add(key)
+                    summary, last = div[0], div[-1]
+                    summary.tail = FRAGMENT_START % key + (summary.tail or "")
+                    last.tail = (last.tail or "") + FRAGMENT_END % key
+        return root
+
+
+class DetailsFragmentsPostprocessor(Postprocessor):
+    """Move the bodies of deferred details out of the document."""
+
+    def __init__(self, fragments, md):
+        """Initialize."""
+
+        Postprocessor.__init__(self, md)
+        self.fragments = fragments
+
+    def store(self, m):
+        """Store the fragment and remove it from the document."""
+
+        self.fragments.store(m.group(1), m.group(2).strip())
+        return ""
+
+    def run(self, text):
+        """Extract fragments, innermost first."""
+
+        if self.fragments.pending:
+            count = 1
+            while count:
+                text, count = RE_FRAGMENT.subn(self.store, text)
+        return text
+
+
 class DetailsExtension(Extension):
     """Add Details extension."""
 
+    def __init__(self, *args, **kwargs):
+        """Initialize."""
+
+        self.config = {
+            "defer_collapsed": [
+                False,
+                "Render the content of collapsed details as separate fragments - Default: False",
+            ],
+            "cache_size": [
+                256,
+                "Number of rendered fragments to keep for later conversions - Default: 256",
+            ],
+        }
+
+        super().__init__(*args, **kwargs)
+        self.unconfigured = []
+
     def extendMarkdown(self, md, md_globals):
         """Add Details to Markdown instance."""
         md.registerExtension(self)
 
-        md.parser.blockprocessors.add("details", DetailsProcessor(md.parser), "_begin")
+        config = self.getConfigs()
+        fragments = None
+        if config["defer_collapsed"]:
+            fragments = DetailsFragments(config["cache_size"])
+            md.details_fragments = fragments.fragments
+            md.preprocessors.add(
+                "details-fragments",
+                DetailsFragmentsPreprocessor(fragments, md),
+                "_begin",
+            )
+            md.treeprocessors.add(
+                "details-fragments",
+                DetailsFragmentsTreeprocessor(fragments, md),
+                "_end",
+            )
+            md.postprocessors.add(
+                "details-fragments",
+                DetailsFragmentsPostprocessor(fragments, md),
+                "_end",
+            )
+            self.unconfigured.append(md)
+
+        md.parser.blockprocessors.add(
+            "details", DetailsProcessor(md.parser, fragments), "_begin"
+        )
+
+    def reset(self):
+        """Extract fragments after all other postprocessors."""
+
+        unconfigured, self.unconfigured = self.unconfigured, []
+        for md in unconfigured:
+            md.postprocessors.link("details-fragments", "_end")
 
 
 def makeExtension(*args, **kwargs):
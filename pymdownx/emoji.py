@@ -23,11 +23,11 @@ CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFT
 DEALINGS IN THE SOFTWARE.
 """
 
+import re
 import warnings
 
 from markdown import Extension
 from markdown import util as md_util
-from markdown.inlinepatterns import Pattern
 
 from . import util
 from .util import PymdownxDeprecationWarning
@@ -35,6 +35,7 @@ from .util import PymdownxDeprecationWarning
 RE_EMOJI = r"(:[+\-\w]+:)"
 SUPPORTED_INDEXES = ("emojione", "gemoji", "twemoji")
 UNICODE_VARIATION_SELECTOR_16 = "fe0f"
+VS16 = "\ufe0f"
 EMOJIONE_SVG_CDN = "https://cdn.jsdelivr.net/emojione/assets/svg/"
 EMOJIONE_PNG_CDN = "https://cdn.jsdelivr.net/emojione/assets/3.0/png/64/"
 TWEMOJI_SVG_CDN = "https://twemoji.maxcdn.com/2/svg/"
@@ -49,6 +50,35 @@ UNICODE_ENTITY = "html_entity"
 UNICODE_ALT = ("unicode", UNICODE_ENTITY)
 LEGACY_ARG_COUNT = 8
 
+# Unicode tries by emoji index.
+UNICODE_TRIES = {}
+
+# Code points that are shown as emoji by default (`Emoji_Presentation` in the
+# Unicode emoji data).  Any other single code point is shown as text unless it
+# is followed by variation selector 16.
+EMOJI_PRESENTATION = (
+    "231A-231B 23E9-23EC 23F0 23F3 25FD-25FE 2614-2615 2648-2653 267F 2693 26A1 "
+    "26AA-26AB 26BD-26BE 26C4-26C5 26CE 26D4 26EA 26F2-26F3 26F5 26FA 26FD 2705 "
+    "270A-270B 2728 274C 274E 2753-2755 2757 2795-2797 27B0 27BF 2B1B-2B1C 2B50 2B55 "
+    "1F004 1F0CF 1F18E 1F191-1F19A 1F1E6-1F1FF 1F201 1F21A 1F22F 1F232-1F236 "
+    "1F238-1F23A 1F250-1F251 1F300-1F320 1F32D-1F335 1F337-1F37C 1F37E-1F393 "
+    "1F3A0-1F3CA 1F3CF-1F3D3 1F3E0-1F3F0 1F3F4 1F3F8-1F43E 1F440 1F442-1F4FC "
+    "1F4FF-1F53D 1F54B-1F54E 1F550-1F567 1F57A 1F595-1F596 1F5A4 1F5FB-1F64F "
+    "1F680-1F6C5 1F6CC 1F6D0-1F6D2 1F6D5-1F6D7 1F6DC-1F6DF 1F6EB-1F6EC 1F6F4-1F6FC "
+    "1F7E0-1F7EB 1F7F0 1F90C-1F93A 1F93C-1F945 1F947-1F9FF 1FA70-1FA7C 1FA80-1FA88 "
+    "1FA90-1FABD 1FABF-1FAC5 1FACE-1FADB 1FAE0-1FAE8 1FAF0-1FAF8"
+)
+
+
+def get_emoji_presentation():
+    """Get the set of code points that are shown as emoji by default."""
+
+    chars = set()
+    for entry in EMOJI_PRESENTATION.split():
+        start, _, end = entry.partition("-")
+        chars.update(range(int(start, 16), int(end or start, 16) + 1))
+    return chars
+
 
 def add_attriubtes(options, attributes):
     """Add aditional attributes from options."""
@@ -217,11 +247,45 @@ def to_alt(index, shortname, alias, uc, alt, title, category, options, md):
     return md.htmlStash.store(alt, safe=True)
 
 
+def get_unicode_trie(index):
+    """
+    Get a trie of the emoji index's Unicode sequences.
+
+    Each node is a dictionary of characters to nodes.  A node that ends a
+    sequence stores the shortname under `None`.  Single characters that are
+    shown as text by default (digits, `#`, `©`, `™`, `❤`) only end a sequence
+    when followed by variation selector 16.
+    """
+
+    emoji = index["emoji"]
+    cached = UNICODE_TRIES.get(id(emoji))
+    if cached is not None and cached[0] is emoji:
+        return cached[1]
+
+    presentation = get_emoji_presentation()
+    trie = {}
+    for shortname, value in emoji.items():
+        for uc in (value.get("unicode"), value.get("unicode_alt")):
+            if not uc:
+                continue
+            chars = "".join([util.get_char(int(c, 16)) for c in uc.split("-")])
+            for seq in (chars, chars.replace(VS16, "")):
+                if len(seq) == 1 and util.get_ord(seq) not in presentation:
+                    seq += VS16
+                node = trie
+                for c in seq:
+                    node = node.setdefault(c, {})
+                node.setdefault(None, shortname)
+
+    UNICODE_TRIES[id(emoji)] = (emoji, trie)
+    return trie
+
+
 ###################
 # Classes
 ###################
-class EmojiPattern(Pattern):
-    """Return element of type `tag` with a text attribute of group(3) of a Pattern."""
+class EmojiPattern(util.InlineProcessor):
+    """Return emoji for shortnames."""
 
     def __init__(self, pattern, config, md):
         """Initialize."""
@@ -237,12 +301,23 @@ class EmojiPattern(Pattern):
         self.title = title if title in VALID_TITLE else NO_TITLE
         self.generator = config["emoji_generator"]
         self.options = config["options"]
-        Pattern.__init__(self, pattern)
+        util.InlineProcessor.__init__(self, pattern, md)
 
     def _set_index(self, index):
         """Set the index."""
 
-        self.emoji_index = index()
+        # The index is only loaded on the first match, as importing
+        # an emoji database is expensive and most documents have no emoji.
+        self._index = index
+        self._emoji_index = None
+
+    @property
+    def emoji_index(self):
+        """Get the index, loading it if needed."""
+
+        if self._emoji_index is None:
+            self._emoji_index = self._index()
+        return self._emoji_index
 
     def _remove_variation_selector(self, value):
         """Remove variation selectors."""
@@ -313,32 +388,100 @@ class EmojiPattern(Pattern):
 
         return emoji.get("category")
 
-    def handleMatch(self, m):
+    def handle_match(self, m, data):
         """Hanlde emoji pattern matches."""
 
-        el = m.group(2)
+        el = m.group(1)
 
         shortname = self.emoji_index["aliases"].get(el, el)
         alias = None if shortname == el else el
         emoji = self.emoji_index["emoji"].get(shortname, None)
-        if emoji:
-            uc, uc_alt = self._get_unicode(emoji)
-            title = self._get_title(el, emoji)
-            alt = self._get_alt(el, uc_alt)
-            category = self._get_category(emoji)
-            el = self.generator(
-                self.emoji_index["name"],
-                shortname,
-                alias,
-                uc,
-                alt,
-                title,
-                category,
-                self.options,
-                self.markdown,
+        if emoji and self.within_budget(el):
+            el = self.create_emoji(el, shortname, alias, emoji)
+
+        # Text that isn't an emoji is still handed back so that other
+        # patterns don't process the inside of the shortname.
+        return el, m.start(0), m.end(0)
+
+    def within_budget(self, text):
+        """Check that the document's budget allows another emoji."""
+
+        budget = util.get_budget(self.markdown)
+        return budget is None or budget.spend("emoji", "max_emoji", 1, text)
+
+    def create_emoji(self, text, shortname, alias, emoji):
+        """Create the emoji with the generator."""
+
+        uc, uc_alt = self._get_unicode(emoji)
+        title = self._get_title(text, emoji)
+        alt = self._get_alt(text, uc_alt)
+        category = self._get_category(emoji)
+        return self.generator(
+            self.emoji_index["name"],
+            shortname,
+            alias,
+            uc,
+            alt,
+            title,
+            category,
+            self.options,
+            self.markdown,
+        )
+
+
+class EmojiUnicodePattern(EmojiPattern):
+    """
+    Return emoji for literal Unicode emoji.
+
+    Sequences are matched longest first with a trie built from the index's
+    Unicode fields.  Candidate starts are found with a regular expression of
+    the characters that can start a sequence, and a trie walk is bounded by
+    the longest sequence, so a text node is scanned in linear time.
+    """
+
+    def __init__(self, config, md):
+        """Initialize."""
+
+        EmojiPattern.__init__(self, None, config, md)
+        self.trie = None
+        self.first = None
+
+    def search(self, data, pos):
+        """Find the next Unicode emoji."""
+
+        if self.trie is None:
+            self.trie = get_unicode_trie(self.emoji_index)
+            self.first = util.compile_re(
+                "[%s]" % "".join([re.escape(c) for c in sorted(self.trie)])
             )
 
-        return el
+        m = self.first.search(data, pos)
+        while m is not None:
+            start = m.start(0)
+            node = self.trie
+            shortname = None
+            index = start
+            end = len(data)
+            while index < end:
+                node = node.get(data[index])
+                if node is None:
+                    break
+                index += 1
+                if None in node:
+                    shortname = node[None]
+                    pos = index
+
+            if shortname is not None:
+                # Don't leave a dangling variation selector behind.
+                if data[pos : pos + 1] == VS16:
+                    pos += 1
+                if not self.within_budget(shortname):
+                    return None
+                emoji = self.emoji_index["emoji"][shortname]
+                return self.create_emoji(shortname, shortname, None, emoji), start, pos
+
+            m = self.first.search(data, start + 1)
+        return None
 
 
 class EmojiExtension(Extension):
@@ -376,6 +519,10 @@ class EmojiExtension(Extension):
                 {},
                 "Emoji options see documentation for options for github and emojione.",
             ],
+            "parse_unicode": [
+                False,
+                "Convert literal Unicode emoji with the emoji generator. - Default: False",
+            ],
         }
         super().__init__(*args, **kwargs)
 
@@ -411,9 +558,14 @@ class EmojiExtension(Extension):
             )
 
         util.escape_chars(md, [":"])
+        util.get_placeholders(md)
 
         emj = EmojiPattern(RE_EMOJI, config, md)
         md.inlinePatterns.add("emoji", emj, "<not_strong")
+        if config["parse_unicode"]:
+            md.inlinePatterns.add(
+                "emoji-unicode", EmojiUnicodePattern(config, md), ">emoji"
+            )
 
 
 ###################
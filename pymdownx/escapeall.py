@@ -27,7 +27,6 @@ import re
 
 from markdown import Extension
 from markdown import util as md_util
-from markdown.inlinepatterns import Pattern, SubstituteTagPattern
 from markdown.postprocessors import Postprocessor
 
 from . import util
@@ -38,29 +37,32 @@ ETX = "\u0003"
 ESCAPE_RE = r"\\(.)"
 ESCAPE_NO_NL_RE = r"\\([^\n])"
 HARDBREAK_RE = r"\\\n"
-UNESCAPE_PATTERN = re.compile(fr"{md_util.STX}(\d+){md_util.ETX}")
+UNESCAPE_PATTERN = re.compile(rf"{md_util.STX}(\d+){md_util.ETX}")
 
 
-class EscapeAllPattern(Pattern):
+class EscapeAllPattern(util.InlineProcessor):
     """Return an escaped character."""
 
-    def __init__(self, pattern, nbsp):
+    def __init__(self, pattern, nbsp, placeholders=None):
         """Initialize."""
 
         self.nbsp = nbsp
-        Pattern.__init__(self, pattern)
+        self.placeholders = placeholders
+        util.InlineProcessor.__init__(self, pattern)
 
-    def handleMatch(self, m):
+    def handle_match(self, m, data):
         """Convert the char to an escaped character."""
 
-        char = m.group(2)
+        char = m.group(1)
         if self.nbsp and char == " ":
             escape = md_util.AMP_SUBSTITUTE + "nbsp;"
         elif char in (STX, ETX):
             escape = char
         else:
             escape = f"{md_util.STX}{util.get_ord(char)}{md_util.ETX}"
-        return escape
+            if self.placeholders is not None:
+                self.placeholders.use("unescape")
+        return escape, m.start(0), m.end(0)
 
 
 class EscapeAllPostprocessor(Postprocessor):
@@ -101,18 +103,27 @@ class EscapeAllExtension(Extension):
         self.md = md
         config = self.getConfigs()
         hardbreak = config["hardbreak"]
+        placeholders = util.get_placeholders(md)
         md.inlinePatterns["escape"] = EscapeAllPattern(
-            ESCAPE_NO_NL_RE if hardbreak else ESCAPE_RE, config["nbsp"]
+            ESCAPE_NO_NL_RE if hardbreak else ESCAPE_RE, config["nbsp"], placeholders
+        )
+        placeholders.add(
+            "unescape",
+            UNESCAPE_PATTERN.pattern,
+            EscapeAllPostprocessor(md).unescape,
         )
-        md.postprocessors["unescape"] = EscapeAllPostprocessor(md)
         if config["hardbreak"]:
             try:
                 md.inlinePatterns.add(
-                    "hardbreak", SubstituteTagPattern(HARDBREAK_RE, "br"), "<nl"
+                    "hardbreak",
+                    util.SubstituteTagInlineProcessor(HARDBREAK_RE, "br"),
+                    "<nl",
                 )
             except Exception:
                 md.inlinePatterns.add(
-                    "hardbreak", SubstituteTagPattern(HARDBREAK_RE, "br"), "_end"
+                    "hardbreak",
+                    util.SubstituteTagInlineProcessor(HARDBREAK_RE, "br"),
+                    "_end",
                 )
 
 
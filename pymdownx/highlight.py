@@ -23,28 +23,34 @@ License: [BSD](http://www.opensource.org/licenses/bsd-license.php)
 """
 
 import copy
+import json
+import re
+import sys
 from collections import OrderedDict
+from importlib import import_module
+from importlib.util import find_spec
 
 from markdown import Extension
 from markdown import util as md_util
 from markdown.treeprocessors import Treeprocessor
 
-try:
-    from pygments import highlight
-    from pygments.formatters import find_formatter_class
-    from pygments.lexers import get_lexer_by_name, guess_lexer
+from . import util
 
-    HtmlFormatter = find_formatter_class("html")
-    pygments = True
-except ImportError:  # pragma: no cover
-    pygments = False
-try:
-    from markdown.extensions.codehilite import CodeHiliteExtension
-except Exception:  # pragma: no cover
-    CodeHiliteExtension = None
+# Pygments is only imported when the first block is highlighted.
+# Importing it (and its lexers and formatters) is by far the most expensive
+# part of loading this module, and many documents never highlight anything.
+pygments = find_spec("pygments") is not None
+PYGMENTS_API = ("highlight", "get_lexer_by_name", "guess_lexer", "HtmlFormatter", "InlineHtmlFormatter")
+_pygments_api = {}
+_compact_types = {}
+_lexer_snapshots = {}
 
 CODE_WRAP = "<pre%s><code%s>%s</code></pre>"
 CLASS_ATTR = ' class="%s"'
+# `#!/usr/bin/env python`, `#!/bin/bash`, etc.
+RE_SHEBANG = re.compile(r"^#!\s*(?:\S*/)?(?:env[ \t]+)?([\w.+-]+)")
+# Identifiers of code that isn't lexed by Pygments.
+RE_IDENTIFIER = re.compile(r"[^\W\d]\w*")
 DEFAULT_CONFIG = {
     "use_pygments": [
         True,
@@ -67,25 +73,164 @@ DEFAULT_CONFIG = {
         [],
         "Extend pygments language with special language entry - Default: {}",
     ],
+    "max_size": [
+        0,
+        "Indented code blocks with more characters are not highlighted; 0 for no limit - Default: 0",
+    ],
+    "compact": [
+        False,
+        "Merge tokens that look the same and only wrap styled text in spans - Default: False",
+    ],
+    "lexer_snapshot": [
+        "",
+        "Path of a lexer alias snapshot made with 'build_lexer_snapshot' - Default: ''",
+    ],
 }
 
-if pygments:
 
-    class InlineHtmlFormatter(HtmlFormatter):
-        """Format the code blocks."""
+def load_pygments():
+    """Import Pygments and return the parts we use."""
+
+    if not _pygments_api:
+        from pygments import format as format_tokens
+        from pygments import highlight
+        from pygments.formatters import find_formatter_class
+        from pygments.lexers import get_lexer_by_name, guess_lexer
+        from pygments.styles import get_style_by_name
+        from pygments.token import STANDARD_TYPES, Name, Text
+
+        HtmlFormatter = find_formatter_class("html")
+
+        class InlineHtmlFormatter(HtmlFormatter):
+            """Format the code blocks."""
+
+            def wrap(self, source, outfile):
+                """Overload wrap."""
+
+                return self._wrap_code(source)
+
+            def _wrap_code(self, source):
+                """Return source, but do not wrap in inline <code> block."""
+
+                yield 0, ""
+                for i, t in source:
+                    yield i, t.strip()
+                yield 0, ""
+
+        _pygments_api.update(
+            format=format_tokens,
+            highlight=highlight,
+            get_lexer_by_name=get_lexer_by_name,
+            guess_lexer=guess_lexer,
+            HtmlFormatter=HtmlFormatter,
+            InlineHtmlFormatter=InlineHtmlFormatter,
+            get_style_by_name=get_style_by_name,
+            Name=Name,
+            Text=Text,
+            STANDARD_TYPES=STANDARD_TYPES,
+        )
+    return _pygments_api
+
+
+def build_lexer_snapshot(path=None):
+    """
+    Map every lexer alias Pygments knows, plugins included, to the module and class of its lexer.
+
+    If `path` is given, the snapshot is also saved there as JSON for the `lexer_snapshot` option.
+    """
+
+    from pygments.lexers._mapping import LEXERS
+    from pygments.plugin import find_plugin_lexers
+
+    snapshot = {}
+    # Pygments prefers built-in lexers over plugins, and the first built-in lexer with an alias.
+    for name, (module, _, aliases, _, _) in LEXERS.items():
+        for alias in aliases:
+            snapshot.setdefault(alias.lower(), [module, name])
+    for cls in find_plugin_lexers():
+        for alias in cls.aliases:
+            snapshot.setdefault(alias.lower(), [cls.__module__, cls.__name__])
+
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, sort_keys=True)
+    return snapshot
+
+
+def load_lexer_snapshot(path):
+    """Load a lexer alias snapshot, reading each file only once."""
+
+    snapshot = _lexer_snapshots.get(path)
+    if snapshot is None:
+        with open(path, encoding="utf-8") as f:
+            snapshot = json.load(f)
+        _lexer_snapshots[path] = snapshot
+    return snapshot
+
+
+def warm_up(languages, lexer_snapshot="", extend_pygments_lang=None):
+    """
+    Import Pygments and the lexers of `languages` before the first document is converted.
+
+    Call it when a worker starts so the first document doesn't pay for the imports.
+    """
+
+    if pygments:
+        highlighter = Highlight(
+            guess_lang=False,
+            extend_pygments_lang=extend_pygments_lang,
+            lexer_snapshot=lexer_snapshot,
+        )
+        for language in languages:
+            highlighter.get_lexer("", language)
+
+
+def get_compact_types(pygments_style):
+    """
+    Map each token type of a style to the first type with the same look.
+
+    Types that are not styled at all map to plain text so they are not wrapped in spans.
+    """
+
+    types = _compact_types.get(pygments_style)
+    if types is None:
+        api = load_pygments()
+        style = api["get_style_by_name"](pygments_style)
+        canonical = {}
+        types = {}
+        for ttype, _ in style:
+            key = tuple(sorted(style.style_for_token(ttype).items()))
+            if not any(value for _, value in key):
+                types[ttype] = api["Text"]
+            else:
+                types[ttype] = canonical.setdefault(key, ttype)
+        _compact_types[pygments_style] = types
+    return types
+
+
+def get_token_class(ttype, standard_types):
+    """
+    Get the class Pygments gives a token type.
+
+    It is the short name of the nearest standard type followed by the rest of the type's name,
+    each part after a dash.
+    """
 
-        def wrap(self, source, outfile):
-            """Overload wrap."""
+    name = standard_types.get(ttype)
+    suffix = ""
+    while name is None:
+        suffix = "-" + ttype[-1] + suffix
+        ttype = ttype.parent
+        name = standard_types.get(ttype)
+    return name + suffix
 
-            return self._wrap_code(source)
 
-        def _wrap_code(self, source):
-            """Return source, but do not wrap in inline <code> block."""
+def __getattr__(name):
+    """Provide the Pygments objects that used to be imported at module level."""
 
-            yield 0, ""
-            for i, t in source:
-                yield i, t.strip()
-            yield 0, ""
+    if pygments and name in PYGMENTS_API:
+        return load_pygments()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class Highlight:
@@ -99,6 +244,8 @@ class Highlight:
         noclasses=False,
         extend_pygments_lang=None,
         linenums=False,
+        compact=False,
+        lexer_snapshot="",
     ):
         """Initialize."""
 
@@ -108,6 +255,8 @@ class Highlight:
         self.noclasses = noclasses
         self.linenums = linenums
         self.linenums_style = "table"
+        self.compact = compact
+        self.lexer_snapshot = lexer_snapshot
 
         if extend_pygments_lang is None:
             extend_pygments_lang = []
@@ -134,17 +283,30 @@ class Highlight:
         else:
             lexer_options = {}
 
+        api = load_pygments()
+
         # Try and get lexer by the name given.
         try:
-            lexer = get_lexer_by_name(language, **lexer_options)
+            if self.lexer_snapshot:
+                # Only import the lexer's module, and don't search plugins for unknown names.
+                entry = load_lexer_snapshot(self.lexer_snapshot).get(
+                    (language or "").lower()
+                )
+                lexer = (
+                    getattr(import_module(entry[0]), entry[1])(**lexer_options)
+                    if entry
+                    else None
+                )
+            else:
+                lexer = api["get_lexer_by_name"](language, **lexer_options)
         except Exception:
             lexer = None
 
         if lexer is None:
             if self.guess_lang:
-                lexer = guess_lexer(src)
+                lexer = api["guess_lexer"](src)
             else:
-                lexer = get_lexer_by_name("text")
+                lexer = api["get_lexer_by_name"]("text")
         return lexer
 
     def escape(self, txt):
@@ -156,6 +318,67 @@ class Highlight:
         txt = txt.replace('"', "&quot;")
         return txt
 
+    def compact_tokens(self, tokens):
+        """
+        Merge neighbouring tokens that are rendered the same.
+
+        Whitespace is emitted as plain text so it is never wrapped in a span. With `noclasses`,
+        tokens are mapped to one type per distinct look, so tokens with the same inline style merge.
+        """
+
+        api = load_pygments()
+        text = api["Text"]
+        standard_types = api["STANDARD_TYPES"]
+        types = get_compact_types(self.pygments_style) if self.noclasses else None
+        last_type = last_class = None
+        values = []
+        for ttype, value in tokens:
+            if not value.strip():
+                ttype = text
+            elif types is not None:
+                while ttype not in types:
+                    ttype = ttype.parent
+                ttype = types[ttype]
+            css_class = get_token_class(ttype, standard_types)
+            if css_class != last_class and values:
+                yield last_type, "".join(values)
+                values = []
+            if not values:
+                last_type, last_class = ttype, css_class
+            values.append(value)
+        if values:
+            yield last_type, "".join(values)
+
+    def index_tokens(self, tokens, language):
+        """Get the plain text and the identifier names of lexed code."""
+
+        name = load_pygments()["Name"]
+        text = []
+        identifiers = OrderedDict()
+        for ttype, value in tokens:
+            text.append(value)
+            if ttype in name and value.strip():
+                identifiers[value.strip()] = None
+        return {
+            "language": language,
+            "text": "".join(text),
+            "identifiers": list(identifiers),
+        }
+
+    def get_index(self, src, language):
+        """
+        Get the plain text and the identifier names of code without highlighting it.
+
+        Without Pygments, every word that isn't a number is taken as an identifier.
+        """
+
+        if pygments and self.use_pygments:
+            return self.index_tokens(
+                self.get_lexer(src, language).get_tokens(src), language
+            )
+        identifiers = OrderedDict.fromkeys(RE_IDENTIFIER.findall(src))
+        return {"language": language, "text": src, "identifiers": list(identifiers)}
+
     def highlight(
         self,
         src,
@@ -166,8 +389,17 @@ class Highlight:
         linestep=-1,
         linespecial=-1,
         inline=False,
+        index=None,
     ):
-        """Highlight code."""
+        """
+        Highlight code.
+
+        If `index` is a list, the result of `get_index` is appended to it, taken
+        from the same tokens that the HTML is built from.
+        """
+
+        if index is not None and not (pygments and self.use_pygments):
+            index.append(self.get_index(src, language))
 
         # Convert with Pygments.
         if pygments and self.use_pygments:
@@ -190,7 +422,8 @@ class Highlight:
                 hl_lines = []
 
             # Setup formatter
-            html_formatter = InlineHtmlFormatter if inline else HtmlFormatter
+            api = load_pygments()
+            html_formatter = api["InlineHtmlFormatter" if inline else "HtmlFormatter"]
             formatter = html_formatter(
                 cssclass=css_class,
                 linenos=linenums,
@@ -203,7 +436,13 @@ class Highlight:
             )
 
             # Convert
-            code = highlight(src, lexer, formatter)
+            tokens = lexer.get_tokens(src)
+            if index is not None:
+                tokens = list(tokens)
+                index.append(self.index_tokens(tokens, language))
+            if self.compact:
+                tokens = self.compact_tokens(tokens)
+            code = api["format"](tokens, formatter)
             if inline:
                 class_str = css_class
         elif inline:
@@ -252,9 +491,11 @@ def get_hl_settings(md):
             target = ext.getConfigs()
             break
 
-    if target is None:
+    # CodeHilite imports Pygments, so only look for it if someone already loaded it.
+    codehilite = sys.modules.get("markdown.extensions.codehilite")
+    if target is None and codehilite is not None:
         for ext in md.registeredExtensions:
-            if isinstance(ext, CodeHiliteExtension):
+            if isinstance(ext, codehilite.CodeHiliteExtension):
                 target = ext.getConfigs()
                 break
 
@@ -269,22 +510,45 @@ def get_hl_settings(md):
 class HighlightTreeprocessor(Treeprocessor):
     """Highlight source code in code blocks."""
 
+    def get_language(self, code, src):
+        """Get the language from a `language-*` class or a shebang so we don't have to guess."""
+
+        for name in code.get("class", "").split():
+            if name.startswith("language-"):
+                return name[9:]
+        m = RE_SHEBANG.match(src)
+        return m.group(1) if m else ""
+
     def run(self, root):
         """Find code blocks and store in htmlStash."""
 
+        highlighter = None
+        max_size = self.config.get("max_size", 0)
+        budget = util.get_budget(self.markdown)
         blocks = root.iter("pre")
         for block in blocks:
             if len(block) == 1 and block[0].tag == "code":
-                code = Highlight(
-                    guess_lang=self.config["guess_lang"],
-                    pygments_style=self.config["pygments_style"],
-                    use_pygments=self.config["use_pygments"],
-                    noclasses=self.config["noclasses"],
-                    linenums=self.config["linenums"],
-                    extend_pygments_lang=self.config["extend_pygments_lang"],
-                )
+                src = block[0].text or ""
+                if max_size and len(src) > max_size:
+                    continue
+                if budget is not None and not budget.within("highlight"):
+                    continue
+
+                if highlighter is None:
+                    highlighter = Highlight(
+                        guess_lang=self.config["guess_lang"],
+                        pygments_style=self.config["pygments_style"],
+                        use_pygments=self.config["use_pygments"],
+                        noclasses=self.config["noclasses"],
+                        linenums=self.config["linenums"],
+                        extend_pygments_lang=self.config["extend_pygments_lang"],
+                        compact=self.config.get("compact", False),
+                        lexer_snapshot=self.config.get("lexer_snapshot", ""),
+                    )
                 placeholder = self.markdown.htmlStash.store(
-                    code.highlight(block[0].text, "", self.config["css_class"]),
+                    highlighter.highlight(
+                        src, self.get_language(block[0], src), self.config["css_class"]
+                    ),
                     safe=True,
                 )
 
@@ -311,6 +575,7 @@ class HighlightExtension(Extension):
         ht = HighlightTreeprocessor(md)
         ht.config = self.getConfigs()
         md.treeprocessors.add("indent-highlight", ht, "<inline")
+        util.get_placeholders(md)
         md.registerExtension(self)
 
 
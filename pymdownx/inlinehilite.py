@@ -17,9 +17,9 @@ import warnings
 
 from markdown import Extension
 from markdown import util as md_util
-from markdown.inlinepatterns import Pattern
 
 from . import highlight as hl
+from . import util
 from .util import PymdownxDeprecationWarning
 
 ESCAPED_BSLASH = "{}{}{}".format(md_util.STX, ord("\\"), md_util.ETX)
@@ -33,6 +33,8 @@ BACKTICK_CODE_RE = r"""(?x)
 (?<!`)(?P=tic)(?!`)                     # Closing
 )
 """
+# Where code or the escapes before it can start.
+BACKTICK_CODE_OPEN = r"(?<!\\)(?:\\+(?=`)|`)"
 
 
 def _escape(txt):
@@ -45,14 +47,13 @@ def _escape(txt):
     return txt
 
 
-class InlineHilitePattern(Pattern):
+class InlineHilitePattern(util.InlineProcessor):
     """Handle the inline code patterns."""
 
     def __init__(self, pattern, md):
         """Initialize."""
 
-        Pattern.__init__(self, pattern)
-        self.markdown = md
+        util.InlineProcessor.__init__(self, pattern, md, BACKTICK_CODE_OPEN)
         self.get_hl_settings = False
 
     def get_settings(self):
@@ -71,6 +72,8 @@ class InlineHilitePattern(Pattern):
             self.pygments_style = config["pygments_style"]
             self.use_pygments = config["use_pygments"]
             self.noclasses = config["noclasses"]
+            self.compact = config.get("compact", False)
+            self.lexer_snapshot = config.get("lexer_snapshot", "")
 
     def highlight_code(self, language, src):
         """Syntax highlite the inline code block."""
@@ -84,6 +87,8 @@ class InlineHilitePattern(Pattern):
                 use_pygments=self.use_pygments,
                 noclasses=self.noclasses,
                 extend_pygments_lang=self.extend_pygments_lang,
+                compact=self.compact,
+                lexer_snapshot=self.lexer_snapshot,
             ).highlight(src, language, self.css_class, inline=True)
             el.text = self.markdown.htmlStash.store(el.text, safe=True)
         else:
@@ -91,16 +96,17 @@ class InlineHilitePattern(Pattern):
             el.text = self.markdown.htmlStash.store(_escape(src), safe=True)
         return el
 
-    def handleMatch(self, m):
+    def handle_match(self, m, data):
         """Handle the pattern match."""
 
         if m.group("escapes"):
-            return m.group("escapes").replace(DOUBLE_BSLASH, ESCAPED_BSLASH)
+            el = m.group("escapes").replace(DOUBLE_BSLASH, ESCAPED_BSLASH)
         else:
             lang = m.group("lang") if m.group("lang") else ""
             src = m.group("code").strip()
             self.get_settings()
-            return self.highlight_code(lang, src)
+            el = self.highlight_code(lang, src)
+        return el, m.start(0), m.end(0)
 
 
 class InlineHiliteExtension(Extension):
@@ -148,6 +154,7 @@ class InlineHiliteExtension(Extension):
         inline_hilite = InlineHilitePattern(BACKTICK_CODE_RE, md)
         inline_hilite.config = config
         md.inlinePatterns["backtick"] = inline_hilite
+        util.get_placeholders(md)
 
 
 def makeExtension(*args, **kwargs):
@@ -87,7 +87,6 @@ import re
 
 from markdown import Extension
 from markdown import util as md_util
-from markdown.inlinepatterns import Pattern
 
 from . import keymap_db as keymap
 from . import util
@@ -106,13 +105,16 @@ RE_KBD = r"""(?x)
 )
 """
 
+# Where keys or the escapes before them can start.
+RE_KBD_OPEN = r"(?<!\\)(?:\\+(?=\+)|\+{2})"
+
 ESCAPE_RE = re.compile(r"""(?<!\\)(?:\\\\)*\\(.)""")
 UNESCAPED_PLUS = re.compile(r"""(?<!\\)(?:\\\\)*(\+)""")
 ESCAPED_BSLASH = "{}{}{}".format(md_util.STX, ord("\\"), md_util.ETX)
 DOUBLE_BSLASH = "\\\\"
 
 
-class KeysPattern(Pattern):
+class KeysPattern(util.InlineProcessor):
     """Return kbd tag."""
 
     def __init__(self, pattern, config, md):
@@ -126,7 +128,7 @@ class KeysPattern(Pattern):
         self.map = self.merge(keymap.keymap, config["key_map"])
         self.aliases = keymap.aliases
         self.camel = config["camel_case"]
-        super().__init__(pattern)
+        super().__init__(pattern, md, RE_KBD_OPEN)
 
     def merge(self, x, y):
         """Given two dicts, merge them into a new dict."""
@@ -169,19 +171,27 @@ class KeysPattern(Pattern):
             value = (canonical_key, name) if name else None
         return value
 
-    def handleMatch(self, m):
+    def handle_match(self, m, data):
         """Handle kbd pattern matches."""
 
-        if m.group(2):
-            return m.group("escapes").replace(DOUBLE_BSLASH, ESCAPED_BSLASH)
+        if m.group(1):
+            return (
+                m.group("escapes").replace(DOUBLE_BSLASH, ESCAPED_BSLASH),
+                m.start(0),
+                m.end(0),
+            )
         content = [
             self.process_key(key)
-            for key in UNESCAPED_PLUS.split(m.group(3))
+            for key in UNESCAPED_PLUS.split(m.group(2))
             if key != "+"
         ]
 
         if None in content:
-            return
+            return None, None, None
+
+        budget = util.get_budget(self.markdown)
+        if budget is not None and not budget.spend("keys", "max_keys", 1, m.group(0)):
+            return None, None, None
 
         el = md_util.etree.Element(
             ("kbd" if self.strict else "span"),
@@ -203,7 +213,7 @@ class KeysPattern(Pattern):
             kbd.text = md_util.AtomicString(item_name)
             last = kbd
 
-        return el
+        return el, m.start(0), m.end(0)
 
 
 class KeysExtension(Extension):
@@ -28,9 +28,10 @@ import re
 
 from markdown import Extension
 from markdown import util as md_util
-from markdown.inlinepatterns import LinkPattern, Pattern
 from markdown.treeprocessors import Treeprocessor
 
+from . import util
+
 RE_MAIL = r"""(?xi)
 (
     (?<![-/\+@a-z\d_])(?:[-+a-z\d_]([-a-z\d_+]|\.(?!\.))*)  # Local part
@@ -53,6 +54,21 @@ RE_LINK = r"""(?xi)
 
 RE_AUTOLINK = r"(?i)<((?:ht|f)tps?://[^>]*)>"
 
+# Every URL or email contains one of these, so the expensive expressions
+# above are only tried around them.
+RE_ANCHOR = r"(?i)://|w{3}\.|@"
+
+# Anything that can appear in the local part of an email.
+RE_MAIL_CHAR = r"(?i)[-+a-z\d_.]"
+
+# Cheap check for links that `RE_REPO_LINK` could match, in lower case.
+REPO_LINK_PREFIXES = tuple(
+    "https://%s%s/" % (www, host)
+    for host in ("github.com", "bitbucket.org", "gitlab.com")
+    for www in ("", "www.")
+)
+REPO_LINK_PREFIX_LENGTH = max(len(prefix) for prefix in REPO_LINK_PREFIXES)
+
 RE_REPO_LINK = re.compile(
     r"""(?xi)
     (?:
@@ -75,6 +91,27 @@ RE_REPO_LINK = re.compile(
 )
 
 
+def is_repo_link_prefix(url):
+    """Check if the URL starts like a repository link; the scheme and host are not case sensitive."""
+
+    return url[:REPO_LINK_PREFIX_LENGTH].lower().startswith(REPO_LINK_PREFIXES)
+
+
+def get_repo_link(url):
+    """Return `(provider, user_repo, link_type, value)` if the URL is a repository link."""
+
+    m = RE_REPO_LINK.match(url) if is_repo_link_prefix(url) else None
+    if m is not None:
+        for provider in ("github", "bitbucket", "gitlab"):
+            if m.group(provider):
+                for link_type in ("commit", "pull", "issue"):
+                    value = m.group(provider + "_" + link_type)
+                    if value is not None:
+                        user_repo = m.group(provider + "_user_repo")
+                        return provider, user_repo, link_type, value
+    return None
+
+
 class MagicShortenerTreeprocessor(Treeprocessor):
     """Treeprocessor that finds repo issue and commit links and shortens them."""
 
@@ -91,17 +128,9 @@ class MagicShortenerTreeprocessor(Treeprocessor):
             text = "" if my_repo else user_repo + "@"
             link.text = md_util.AtomicString(text)
 
-            # Need a root with an element for things to get processed.
-            # Send the `value` through and retreive it from the p element.
-            # Pop it off and add it to the link.
-            el = md_util.etree.Element("div")
-            p = md_util.etree.SubElement(el, "p")
-            p.text = "`%s`" % value[0:hash_size]
-            el = self.markdown.treeprocessors["inline"].run(el)
-            p = list(el)[0]
-            for child in list(p):
-                link.append(child)
-                p.remove(child)
+            # A hash is plain hex, so there is nothing for inline processing to do.
+            code = md_util.etree.SubElement(link, "code")
+            code.text = md_util.AtomicString(value[0:hash_size])
         else:
             # user/repo#(issue|pull)
             link.text = ("#" + value) if my_repo else (user_repo + "#" + value)
@@ -151,18 +180,17 @@ class MagicShortenerTreeprocessor(Treeprocessor):
         self.base = self.config.get("base_repo_url", "").rstrip("/")
         self.hide_protocol = self.config["hide_protocol"]
 
-        links = root.iter("a")
-        for link in links:
-            has_child = len(list(link))
-            is_magic = link.attrib.get("magiclink")
+        for link in root.iter("a"):
+            is_magic = link.attrib.pop("magiclink", None)
             href = link.attrib.get("href", "")
             text = link.text
 
-            if is_magic:
-                del link.attrib["magiclink"]
+            # Only links to a known provider can be shortened.
+            if not text or not is_repo_link_prefix(href):
+                continue
 
             # We want a normal link.  No subelements embedded in it, just a normal string.
-            if has_child or not text:  # pragma: no cover
+            if len(link):  # pragma: no cover
                 continue
 
             # Make sure the text matches the href.  If needed, add back protocol to be sure.
@@ -189,57 +217,122 @@ class MagicShortenerTreeprocessor(Treeprocessor):
         return root
 
 
-class MagiclinkPattern(LinkPattern):
-    """Convert html, ftp links to clickable links."""
+class MagiclinkPattern(util.LinkInlineProcessor):
+    """Convert html, ftp links and emails to clickable links."""
+
+    def __init__(self, config, md):
+        """Initialize."""
 
-    def handleMatch(self, m):
+        util.LinkInlineProcessor.__init__(self, None, md)
+        self.config = config
+        self.re_link = util.compile_re(RE_LINK, re.DOTALL | re.UNICODE)
+        self.re_mail = util.compile_re(RE_MAIL, re.DOTALL | re.UNICODE)
+        self.re_mail_char = util.compile_re(RE_MAIL_CHAR, re.UNICODE)
+        self.re_anchor = util.compile_re(RE_ANCHOR, re.UNICODE)
+
+    def match_link(self, data, index, anchor):
+        """Match a URL around the anchor at `index`."""
+
+        # A scheme is at most 5 characters before `://`, `www.` starts the link.
+        starts = range(index - 5, index - 2) if anchor == "://" else (index,)
+        for start in starts:
+            if start >= 0:
+                m = self.re_link.match(data, start)
+                if m is not None and m.end(0) > index:
+                    return m
+        return None
+
+    def match_mail(self, data, index, end=None):
+        """Match an email around the `@` at `index` that ends by `end`."""
+
+        if end is None:
+            end = len(data)
+
+        # Walk back over everything that could be part of the local part,
+        # then take the leftmost start that makes a valid address.
+        start = index
+        while start > 0 and self.re_mail_char.match(data, start - 1):
+            start -= 1
+        for start in range(start, index):
+            m = self.re_mail.match(data, start, end)
+            if m is not None:
+                return m
+        return None
+
+    def search(self, data, pos):
+        """Find the next URL or email by only matching around `@`, `://` and `www.`."""
+
+        while True:
+            anchor = self.re_anchor.search(data, pos)
+            if anchor is None:
+                return None
+            index = anchor.start(0)
+            if anchor.group(0) == "@":
+                m = self.match_mail(data, index)
+                if m is not None:
+                    # URLs take precedence over emails they overlap,
+                    # so the email can only run up to where the URL starts.
+                    link = self.search_link(data, m.start(0), m.end(0))
+                    if link is None:
+                        return self.handle_mail(m)
+                    if link.start(0) > index:
+                        m = self.match_mail(data, index, link.start(0))
+                    if m is None or m.end(0) > link.start(0):
+                        return self.handle_link(link)
+                    return self.handle_mail(m)
+            else:
+                m = self.match_link(data, index, anchor.group(0))
+                if m is not None:
+                    return self.handle_link(m)
+            pos = index + 1
+
+    def search_link(self, data, pos, end):
+        """Search for a URL that starts between `pos` and `end`."""
+
+        # Leave room for an anchor that starts before `end` but finishes after it.
+        limit = end + 8
+        while True:
+            anchor = self.re_anchor.search(data, pos, limit)
+            if anchor is None:
+                return None
+            index = anchor.start(0)
+            if anchor.group(0) != "@":
+                m = self.match_link(data, index, anchor.group(0))
+                if m is not None:
+                    return m if m.start(0) < end else None
+            pos = index + 1
+
+    def handle_link(self, m):
         """Handle URL matches."""
 
         shorten = self.config.get("repo_url_shortener", False)
         el = md_util.etree.Element("a")
-        el.text = md_util.AtomicString(m.group(2))
+        el.text = md_util.AtomicString(m.group(1))
         if m.group("www"):
-            href = "http://%s" % m.group(2)
+            href = "http://%s" % m.group(1)
         else:
-            href = m.group(2)
+            href = m.group(1)
             if self.config["hide_protocol"]:
                 el.text = md_util.AtomicString(el.text[el.text.find("://") + 3 :])
 
         if shorten:
             el.set("magiclink", "1")
         el.set("href", self.sanitize_url(self.unescape(href.strip())))
-        return el
-
-
-class MagiclinkAutoPattern(Pattern):
-    """Return a link Element given an autolink `<http://example/com>`."""
-
-    def handleMatch(self, m):
-        """Return link optionally without protocol."""
-
-        shorten = self.config.get("repo_url_shortener", False)
-        el = md_util.etree.Element("a")
-        el.set("href", self.unescape(m.group(2)))
-        el.text = md_util.AtomicString(m.group(2))
-        if self.config["hide_protocol"]:
-            el.text = md_util.AtomicString(el.text[el.text.find("://") + 3 :])
-        if shorten:
-            el.attrib["magiclink"] = "1"
-        return el
-
-
-class MagicMailPattern(LinkPattern):
-    """Convert emails to clickable email links."""
+        if self.config["link_inventory"]:
+            self.markdown.link_inventory.add(
+                el.get("href"), "magiclink", repo=get_repo_link(el.get("href"))
+            )
+        return el, m.start(0), m.end(0)
 
     def email_encode(self, code):
         """Return entity definition by code, or the code if not defined."""
         return "%s#%d;" % (md_util.AMP_SUBSTITUTE, code)
 
-    def handleMatch(self, m):
+    def handle_mail(self, m):
         """Handle email link patterns."""
 
         el = md_util.etree.Element("a")
-        email = self.unescape(m.group(2))
+        email = self.unescape(m.group(1))
         href = "mailto:%s" % email
         el.text = md_util.AtomicString(
             "".join([self.email_encode(ord(c)) for c in email])
@@ -247,7 +340,30 @@ class MagicMailPattern(LinkPattern):
         el.set(
             "href", "".join([md_util.AMP_SUBSTITUTE + "#%d;" % ord(c) for c in href])
         )
-        return el
+        if self.config["link_inventory"]:
+            self.markdown.link_inventory.add(href, "magiclink")
+        return el, m.start(0), m.end(0)
+
+
+class MagiclinkAutoPattern(util.InlineProcessor):
+    """Return a link Element given an autolink `<http://example/com>`."""
+
+    def handle_match(self, m, data):
+        """Return link optionally without protocol."""
+
+        shorten = self.config.get("repo_url_shortener", False)
+        el = md_util.etree.Element("a")
+        el.set("href", self.unescape(m.group(1)))
+        el.text = md_util.AtomicString(m.group(1))
+        if self.config["hide_protocol"]:
+            el.text = md_util.AtomicString(el.text[el.text.find("://") + 3 :])
+        if shorten:
+            el.attrib["magiclink"] = "1"
+        if self.config["link_inventory"]:
+            self.markdown.link_inventory.add(
+                el.get("href"), "magiclink", repo=get_repo_link(el.get("href"))
+            )
+        return el, m.start(0), m.end(0)
 
 
 class MagiclinkExtension(Extension):
@@ -267,6 +383,10 @@ class MagiclinkExtension(Extension):
                 "If 'True' repo commit and issue links are shortened - Default: False",
             ],
             "base_repo_url": ["", 'The base repo url to use - Default: ""'],
+            "link_inventory": [
+                False,
+                "If 'True', links are recorded in 'Markdown.link_inventory' - Default: False",
+            ],
         }
         super().__init__(*args, **kwargs)
 
@@ -274,13 +394,12 @@ class MagiclinkExtension(Extension):
         """Add support for turning html links and emails to link tags."""
 
         config = self.getConfigs()
+        if config["link_inventory"]:
+            util.get_link_inventory(md)
         auto_link_pattern = MagiclinkAutoPattern(RE_AUTOLINK, md)
         auto_link_pattern.config = config
-        link_pattern = MagiclinkPattern(RE_LINK, md)
-        link_pattern.config = config
         md.inlinePatterns["autolink"] = auto_link_pattern
-        md.inlinePatterns.add("magic-link", link_pattern, "<entity")
-        md.inlinePatterns.add("magic-mail", MagicMailPattern(RE_MAIL, md), "<entity")
+        md.inlinePatterns.add("magic-link", MagiclinkPattern(config, md), "<entity")
         if config.get("repo_url_shortener", False):
             shortener = MagicShortenerTreeprocessor(md)
             shortener.config = config
@@ -25,15 +25,23 @@ DEALINGS IN THE SOFTWARE.
 """
 
 from markdown import Extension
-from markdown.inlinepatterns import SimpleTagPattern, SimpleTextPattern
 
 from . import util
 
-RE_SMART_CONTENT = r"((?:[^\=]|\=(?=[^\W_]|\=|\s)|(?<=\s)\=+?(?=\s))+?\=*?)"
+# Each character of the content can only be matched one way, and the content
+# stops at a barrier, so a failed match can't backtrack and later openers
+# before the same barrier can be skipped (see `util.InlineProcessor`).
+RE_SMART_CONTENT = r"((?:[^\=]|\=(?=[^\W_]|\=|\s))+?)"
+RE_SMART_BARRIER = r"\=(?![^\W_]|\=|\s)"
 RE_DUMB_CONTENT = r"((?:[^\=]|(?<!\=)\=(?=[^\W_]|\=))+?)"
-RE_SMART_MARK_BASE = r"(\={2})(?![\s\=])%s(?<!\s)\={2}" % RE_SMART_CONTENT
-RE_SMART_MARK = r"(?:(?<=_)|(?<![\w\=]))%s(?:(?=_)|(?![\w\=]))" % RE_SMART_MARK_BASE
-RE_MARK_BASE = r"(\={2})(?!\s)%s(?<!\s)\={2}" % RE_DUMB_CONTENT
+RE_DUMB_BARRIER = r"(?<=\=)\=|\=(?![^\W_]|\=)"
+RE_SMART_MARK_OPEN = r"(?:(?<=_)|(?<![\w\=]))(\={2})(?![\s\=])"
+RE_SMART_MARK = r"%s%s(?<!\s)\={2}(?:(?=_)|(?![\w\=]))" % (
+    RE_SMART_MARK_OPEN,
+    RE_SMART_CONTENT,
+)
+RE_MARK_OPEN = r"(\={2})(?!\s)"
+RE_MARK_BASE = r"%s%s(?<!\s)\={2}" % (RE_MARK_OPEN, RE_DUMB_CONTENT)
 RE_NOT_MARK = r"((^| )(\=)( |$))"
 RE_MARK = RE_MARK_BASE
 
@@ -61,13 +69,27 @@ class MarkExtension(Extension):
 
         if config.get("smart_mark", True):
             md.inlinePatterns.add(
-                "mark", SimpleTagPattern(RE_SMART_MARK, "mark"), "<not_strong"
+                "mark",
+                util.SimpleTagInlineProcessor(
+                    RE_SMART_MARK,
+                    "mark",
+                    RE_SMART_MARK_OPEN,
+                    RE_SMART_BARRIER,
+                    RE_SMART_BARRIER,
+                ),
+                "<not_strong",
             )
         else:
             md.inlinePatterns.add(
-                "mark", SimpleTagPattern(RE_MARK, "mark"), "<not_strong"
+                "mark",
+                util.SimpleTagInlineProcessor(
+                    RE_MARK, "mark", RE_MARK_OPEN, RE_DUMB_BARRIER, RE_DUMB_BARRIER
+                ),
+                "<not_strong",
             )
-        md.inlinePatterns.add("not_mark", SimpleTextPattern(RE_NOT_MARK), "<mark")
+        md.inlinePatterns.add(
+            "not_mark", util.SimpleTextInlineProcessor(RE_NOT_MARK), "<mark"
+        )
 
 
 def makeExtension(*args, **kwargs):
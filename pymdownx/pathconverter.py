@@ -51,6 +51,8 @@ RE_TAG_HTML = r"""(?xus)
     )
     """
 
+RE_STASHED_TAG = r"<(?:%s)"
+
 RE_TAG_LINK_ATTR = re.compile(
     r"""(?xus)
     (?P<attr>
@@ -63,7 +65,7 @@ RE_TAG_LINK_ATTR = re.compile(
 )
 
 
-def repl_relative(m, base_path, relative_path):
+def repl_relative(m, base_path, relative_path, inventory=None):
     """Replace path with relative path."""
 
     link = m.group(0)
@@ -86,10 +88,10 @@ def repl_relative(m, base_path, relative_path):
                 path = util.pathname2url(
                     os.path.relpath(abs_path, relative_path).replace("\\", "/")
                 )
-                link = '{}"{}"'.format(
-                    m.group("name"),
-                    util.urlunparse((scheme, netloc, path, params, query, fragment)),
-                )
+                url = util.urlunparse((scheme, netloc, path, params, query, fragment))
+                link = '{}"{}"'.format(m.group("name"), url)
+                if inventory is not None:
+                    inventory.add(url, "pathconverter", m.group("path")[1:-1])
     except Exception:  # pragma: no cover
         # Parsing crashed and burned; no need to continue.
         pass
@@ -97,7 +99,7 @@ def repl_relative(m, base_path, relative_path):
     return link
 
 
-def repl_absolute(m, base_path):
+def repl_absolute(m, base_path, inventory=None):
     """Replace path with absolute path."""
 
     link = m.group(0)
@@ -110,10 +112,10 @@ def repl_absolute(m, base_path):
             path = util.url2pathname(path)
             temp = os.path.normpath(os.path.join(base_path, path))
             path = util.pathname2url(temp.replace("\\", "/"))
-            link = '{}"{}"'.format(
-                m.group("name"),
-                util.urlunparse((scheme, netloc, path, params, query, fragment)),
-            )
+            url = util.urlunparse((scheme, netloc, path, params, query, fragment))
+            link = '{}"{}"'.format(m.group("name"), url)
+            if inventory is not None:
+                inventory.add(url, "pathconverter", m.group("path")[1:-1])
     except Exception:  # pragma: no cover
         # Parsing crashed and burned; no need to continue.
         pass
@@ -121,7 +123,7 @@ def repl_absolute(m, base_path):
     return link
 
 
-def repl(m, base_path, rel_path=None):
+def repl(m, base_path, rel_path=None, inventory=None):
     """Replace."""
 
     if m.group("comments"):
@@ -130,11 +132,12 @@ def repl(m, base_path, rel_path=None):
         tag = m.group("open")
         if rel_path is None:
             tag += RE_TAG_LINK_ATTR.sub(
-                lambda m2: repl_absolute(m2, base_path), m.group("attr")
+                lambda m2: repl_absolute(m2, base_path, inventory), m.group("attr")
             )
         else:
             tag += RE_TAG_LINK_ATTR.sub(
-                lambda m2: repl_relative(m2, base_path, rel_path), m.group("attr")
+                lambda m2: repl_relative(m2, base_path, rel_path, inventory),
+                m.group("attr"),
             )
         tag += m.group("close")
     return tag
@@ -143,17 +146,33 @@ def repl(m, base_path, rel_path=None):
 class PathConverterPostprocessor(Postprocessor):
     """Post process to find tag lings to convert."""
 
+    active = True
+
+    def check(self, root):
+        """Check if the document has any of the tags to convert."""
+
+        tags = self.config["tags"].split()
+        return util.has_links(root, tags) or util.has_stashed(
+            self.markdown, util.compile_re(RE_STASHED_TAG % "|".join(tags))
+        )
+
     def run(self, text):
         """Find and convert paths."""
 
+        if not self.active:
+            return text
+
         basepath = self.config["base_path"]
         relativepath = self.config["relative_path"]
         absolute = bool(self.config["absolute"])
-        tags = re.compile(RE_TAG_HTML % "|".join(self.config["tags"].split()))
+        inventory = (
+            self.markdown.link_inventory if self.config["link_inventory"] else None
+        )
+        tags = util.compile_re(RE_TAG_HTML % "|".join(self.config["tags"].split()))
         if not absolute and basepath and relativepath:
-            text = tags.sub(lambda m: repl(m, basepath, relativepath), text)
+            text = tags.sub(lambda m: repl(m, basepath, relativepath, inventory), text)
         elif absolute and basepath:
-            text = tags.sub(lambda m: repl(m, basepath), text)
+            text = tags.sub(lambda m: repl(m, basepath, inventory=inventory), text)
         return text
 
 
@@ -177,17 +196,36 @@ class PathConverterExtension(Extension):
                 "img script a link",
                 "tags to convert src and/or href in - Default: 'img scripts a link'",
             ],
+            "link_inventory": [
+                False,
+                "If 'True', converted paths are recorded in 'Markdown.link_inventory' - Default: False",
+            ],
         }
 
         super().__init__(*args, **kwargs)
 
+        self.unconfigured = []
+
     def extendMarkdown(self, md, md_globals):
         """Add PathConverterPostprocessor to Markdown instance."""
 
         rel_path = PathConverterPostprocessor(md)
         rel_path.config = self.getConfigs()
+        if rel_path.config["link_inventory"]:
+            util.get_link_inventory(md)
         md.postprocessors.add("path-converter", rel_path, "_end")
+        md.treeprocessors.add(
+            "path-converter", util.ActivityTreeprocessor(md, rel_path), "_end"
+        )
         md.registerExtension(self)
+        self.unconfigured.append(md)
+
+    def reset(self):
+        """Check for links after all other tree processors."""
+
+        unconfigured, self.unconfigured = self.unconfigured, []
+        for md in unconfigured:
+            md.treeprocessors.link("path-converter", "_end")
 
 
 def makeExtension(*args, **kwargs):
@@ -28,6 +28,9 @@ import re
 
 from markdown import Extension
 from markdown.postprocessors import Postprocessor
+from markdown.util import etree
+
+from . import util
 
 RE_TAG_HTML = re.compile(
     r"""(?x)
@@ -69,15 +72,46 @@ def repl(m, attributes, strip_comments):
 class PlainHtmlPostprocessor(Postprocessor):
     """Post processor to strip out unwanted content."""
 
-    def run(self, text):
-        """Strip out ids and classes for a simplified HTML output."""
+    active = True
+
+    def get_attributes(self):
+        """Get the patterns of the attributes to strip."""
 
         attr_str = self.config.get("strip_attributes", "id class style").strip()
         attributes = [re.escape(a) for a in attr_str.split(" ")] if attr_str else []
         if self.config.get("strip_js_on_attributes", True):
             attributes.append(r"on[\w]+")
+        return attributes
+
+    def check(self, root):
+        """Check if the document has any attributes or comments to strip."""
+
+        attributes = self.get_attributes()
+        strip_comments = self.config.get("strip_comments", True)
+        patterns = []
+        if attributes:
+            re_name = util.compile_re(r"(?:%s)$" % "|".join(attributes))
+            for el in root.iter():
+                if any(re_name.match(name) for name in el.attrib):
+                    return True
+            patterns.append(r"\s(?:%s)\s*=" % "|".join(attributes))
+        if strip_comments:
+            if any(el.tag is etree.Comment for el in root.iter()):
+                return True
+            patterns.append(r"<!--")
+        return bool(patterns) and util.has_stashed(
+            self.markdown, util.compile_re("|".join(patterns))
+        )
+
+    def run(self, text):
+        """Strip out ids and classes for a simplified HTML output."""
+
+        if not self.active:
+            return text
+
+        attributes = self.get_attributes()
         if len(attributes):
-            re_attributes = re.compile(
+            re_attributes = util.compile_re(
                 TAG_BAD_ATTR % "|".join(attributes), re.DOTALL | re.UNICODE
             )
         else:
@@ -111,13 +145,26 @@ class PlainHtmlExtension(Extension):
         }
         super().__init__(*args, **kwargs)
 
+        self.unconfigured = []
+
     def extendMarkdown(self, md, md_globals):
         """Strip unwanted attributes to give a plain HTML."""
 
         plainhtml = PlainHtmlPostprocessor(md)
         plainhtml.config = self.getConfigs()
         md.postprocessors.add("plain-html", plainhtml, "_end")
+        md.treeprocessors.add(
+            "plain-html", util.ActivityTreeprocessor(md, plainhtml), "_end"
+        )
         md.registerExtension(self)
+        self.unconfigured.append(md)
+
+    def reset(self):
+        """Check for attributes after all other tree processors."""
+
+        unconfigured, self.unconfigured = self.unconfigured, []
+        for md in unconfigured:
+            md.treeprocessors.link("plain-html", "_end")
 
 
 def makeExtension(*args, **kwargs):
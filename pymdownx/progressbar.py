@@ -106,7 +106,7 @@ DEALINGS IN THE SOFTWARE.
 from markdown import Extension
 from markdown import util as md_util
 from markdown.extensions.attr_list import AttrListTreeprocessor
-from markdown.inlinepatterns import Pattern, dequote
+from markdown.inlinepatterns import dequote
 
 from . import util
 
@@ -121,6 +121,8 @@ RE_PROGRESS = r"""(?x)
 (?P<attr_list>\{\:?([^\}]*)\})?                                     # Optional attr list
 """
 
+RE_PROGRESS_OPEN = r"\[="
+
 CLASS_100PLUS = "progress-100plus"
 CLASS_80PLUS = "progress-80plus"
 CLASS_60PLUS = "progress-60plus"
@@ -142,13 +144,13 @@ class ProgressBarTreeProcessor(AttrListTreeprocessor):
                 elem.tail = elem.tail[m.end() :]
 
 
-class ProgressBarPattern(Pattern):
+class ProgressBarPattern(util.InlineProcessor):
     """Pattern handler for the progress bars."""
 
     def __init__(self, pattern):
         """Intialize."""
 
-        Pattern.__init__(self, pattern)
+        util.InlineProcessor.__init__(self, pattern, opener=RE_PROGRESS_OPEN)
 
     def create_tag(self, width, label, add_classes, alist):
         """Create the tag."""
@@ -172,19 +174,19 @@ class ProgressBarPattern(Pattern):
                 ProgressBarTreeProcessor(self.markdown).run(el)
         return el
 
-    def handleMatch(self, m):
+    def handle_match(self, m, data):
         """Handle the match."""
 
         label = ""
         level_class = self.config.get("level_class", False)
         add_classes = []
         alist = None
-        if m.group(5):
+        if m.group(4):
             label = dequote(self.unescape(m.group("title").strip()))
         if m.group("attr_list"):
             alist = m.group("attr_list")
         if m.group("percent"):
-            value = float(m.group(2))
+            value = float(m.group(1))
         else:
             try:
                 num = float(m.group("frac_num"))
@@ -218,7 +220,11 @@ class ProgressBarPattern(Pattern):
             else:
                 add_classes.append(CLASS_0PLUS)
 
-        return self.create_tag("%.2f" % value, label, add_classes, alist)
+        return (
+            self.create_tag("%.2f" % value, label, add_classes, alist),
+            m.start(0),
+            m.end(0),
+        )
 
 
 class ProgressBarExtension(Extension):
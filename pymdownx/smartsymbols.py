@@ -41,10 +41,11 @@ DEALINGS IN THE SOFTWARE.
 """
 
 from markdown import Extension
-from markdown.inlinepatterns import HtmlPattern
 from markdown.odict import OrderedDict
 from markdown.treeprocessors import InlineProcessor
 
+from . import util
+
 RE_TRADE = ("smart-trademark", r"\(tm\)", r"&trade;")
 RE_COPY = ("smart-copyright", r"\(c\)", r"&copy;")
 RE_REG = ("smart-registered", r"\(r\)", r"&reg;")
@@ -109,7 +110,7 @@ FRAC = {
 ARR = {"-->": "&rarr;", "<--": "&larr;", "<-->": "&harr;"}
 
 
-class SmartSymbolsPattern(HtmlPattern):
+class SmartSymbolsPattern(util.InlineProcessor):
     """Smart symbols patterns handler."""
 
     def __init__(self, pattern, replace, md):
@@ -119,12 +120,16 @@ class SmartSymbolsPattern(HtmlPattern):
         self.replace = replace
         self.md = md
 
-    def handleMatch(self, m):
+    def handle_match(self, m, data):
         """Replace symbol."""
 
-        return self.md.htmlStash.store(
-            m.expand(self.replace(m) if callable(self.replace) else self.replace),
-            safe=True,
+        return (
+            self.md.htmlStash.store(
+                m.expand(self.replace(m) if callable(self.replace) else self.replace),
+                safe=True,
+            ),
+            m.start(0),
+            m.end(0),
         )
 
 
@@ -167,6 +172,7 @@ class SmartSymbolsExtension(Extension):
         inline_processor = InlineProcessor(md)
         inline_processor.inlinePatterns = self.patterns
         md.treeprocessors.add("smart-symbols", inline_processor, "_end")
+        util.get_placeholders(md)
         if "smarty" in md.treeprocessors.keys():
             md.treeprocessors.link("smarty", "_end")
 
@@ -28,10 +28,11 @@ import os
 import re
 
 from markdown import Extension
-from markdown.preprocessors import Preprocessor
 
+from . import util
 
-class SnippetPreprocessor(Preprocessor):
+
+class SnippetPreprocessor(util.LinePreprocessor):
     """Handle snippets in Markdown content."""
 
     RE_ALL_SNIPPETS = re.compile(
@@ -58,12 +59,31 @@ class SnippetPreprocessor(Preprocessor):
         self.base_path = config.get("base_path")
         self.encoding = config.get("encoding")
         self.tab_length = md.tab_length
-        super().__init__()
+        super().__init__(md)
+
+    def within_budget(self, snippet, depth):
+        """Check that including the snippet keeps the document within its budget."""
 
-    def parse_snippets(self, lines, file_name=None):
+        budget = util.get_budget(self.markdown)
+        if budget is None:
+            return True
+        return budget.within(
+            "snippets", "max_snippet_depth", depth, snippet
+        ) and budget.spend(
+            "snippets", "max_snippet_bytes", os.path.getsize(snippet), snippet
+        )
+
+    def parse_snippets(self, lines, file_name=None, seen=None, depth=1):
         """Parse snippets snippet."""
 
-        new_lines = []
+        return list(self.iter_snippets(lines, file_name, seen, depth))
+
+    def iter_snippets(self, lines, file_name=None, seen=None, depth=1):
+        """Yield the lines with snippets included."""
+
+        if seen is None:
+            seen = set()
+
         inline = False
         block = False
         for line in lines:
@@ -83,7 +103,7 @@ class SnippetPreprocessor(Preprocessor):
             elif not block:
                 # Not in snippet, and we didn't find an inline,
                 # so just a normal line
-                new_lines.append(line)
+                yield line
                 continue
 
             if block and not inline:
@@ -104,7 +124,7 @@ class SnippetPreprocessor(Preprocessor):
                     # Block path handling
                     if not path:
                         # Empty path line, insert a blank line
-                        new_lines.append("")
+                        yield ""
                         continue
                 if path.startswith("; "):
                     # path stats with '#', consider it commented out.
@@ -113,34 +133,38 @@ class SnippetPreprocessor(Preprocessor):
 
                 snippet = os.path.join(self.base_path, path)
                 if snippet and os.path.exists(snippet):
-                    if snippet in self.seen:
+                    if snippet in seen:
                         # This is in the stack and we don't want an infinite loop!
                         continue
+                    if not self.within_budget(snippet, depth):
+                        # Leave the snippet out.
+                        continue
                     if file_name:
                         # Track this file.
-                        self.seen.add(file_name)
+                        seen.add(file_name)
+                    # A snippet that fails to read is left out as a whole.
+                    nested = []
                     try:
                         with codecs.open(snippet, "r", encoding=self.encoding) as f:
-                            new_lines.extend(
-                                [
-                                    space + l2
-                                    for l2 in self.parse_snippets(
-                                        [l.rstrip("\r\n") for l in f], snippet
-                                    )
-                                ]
-                            )
+                            nested = [
+                                space + l2
+                                for l2 in self.iter_snippets(
+                                    [l.rstrip("\r\n") for l in f],
+                                    snippet,
+                                    seen,
+                                    depth + 1,
+                                )
+                            ]
                     except Exception:  # pragma: no cover
-                        pass
+                        nested = []
                     if file_name:
-                        self.seen.remove(file_name)
-
-        return new_lines
+                        seen.remove(file_name)
+                    yield from nested
 
-    def run(self, lines):
+    def iter_lines(self, lines):
         """Process snippets."""
 
-        self.seen = set()
-        return self.parse_snippets(lines)
+        return self.iter_snippets(lines)
 
 
 class SnippetExtension(Extension):
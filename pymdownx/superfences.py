@@ -28,15 +28,18 @@ All changes Copyright 2008-2014 The Python Markdown Project
 License: [BSD](http://www.opensource.org/licenses/bsd-license.php)
 """
 
+import hashlib
+import os
 import re
+import tempfile
 import warnings
 
 from markdown import util as md_util
 from markdown.blockprocessors import CodeBlockProcessor
 from markdown.extensions import Extension
-from markdown.preprocessors import Preprocessor
 
 from . import highlight as hl
+from . import util
 from .util import PymdownxDeprecationWarning
 
 NESTED_FENCE_START = r"""(?x)
@@ -90,9 +93,10 @@ class CodeStash:
     """
     Stash code for later retrieval.
 
-    Store original fenced code here in case we were
+    Store where the original fenced code is in case we were
     too greedy and need to restore in an indented code
-    block.
+    block.  The lines of the block are kept as they were
+    read, and only joined on request.
     """
 
     def __init__(self):
@@ -106,20 +110,23 @@ class CodeStash:
         return len(self.stash)
 
     def get(self, key, default=None):
-        """Get the code from the key."""
+        """Get the code and indent level from the key."""
 
-        code = self.stash.get(key, default)
-        return code
+        entry = self.stash.get(key)
+        if entry is None:
+            return default
+        lines, indent_level = entry
+        return "\n".join(lines), indent_level
 
     def remove(self, key):
         """Remove the stashed code."""
 
         del self.stash[key]
 
-    def store(self, key, code, indent_level):
-        """Store the code in the stash."""
+    def store(self, key, lines, indent_level):
+        """Store the lines of the code in the stash."""
 
-        self.stash[key] = (code, indent_level)
+        self.stash[key] = (lines, indent_level)
 
     def clear_stash(self):
         """Clear the stash."""
@@ -127,6 +134,40 @@ class CodeStash:
         self.stash = {}
 
 
+class FenceState:
+    """
+    Per document state used while searching for fenced blocks.
+
+    A new state is created for every conversion so that a preprocessor
+    never holds on to data from the document it is currently processing.
+    """
+
+    def __init__(self, disabled_indented=False):
+        """Initialize."""
+
+        self.stack = []
+        self.source = []
+        self.disabled_indented = disabled_indented
+        self.clear()
+
+    def clear(self):
+        """Reset the current fence."""
+
+        self.ws = None
+        self.ws_len = 0
+        self.fence = None
+        self.lang = None
+        self.hl_lines = None
+        self.linestart = None
+        self.linestep = None
+        self.linespecial = None
+        self.quote_level = 0
+        self.code = []
+        self.empty_lines = 0
+        self.whitespace = None
+        self.fence_end = None
+
+
 def fence_code_format(source, language, css_class):
     """Format source as code blocks."""
 
@@ -171,6 +212,33 @@ class SuperFencesCodeExtension(Extension):
                 "if nothing is set. - "
                 "Default: ''",
             ],
+            "max_lines": [
+                0,
+                "Fences with more lines are oversized; 0 means no limit - Default: 0",
+            ],
+            "max_bytes": [
+                0,
+                "Fences with more bytes (UTF-8) are oversized; 0 means no limit - Default: 0",
+            ],
+            "oversized": [
+                "truncate",
+                "What to do with the part of an oversized fence that doesn't fit on the page: "
+                "'truncate' to return it in 'Markdown.superfences_fragments' or "
+                "'file' to write the whole fence to 'oversized_dir' - Default: 'truncate'",
+            ],
+            "oversized_dir": [
+                "",
+                "Directory that oversized fences are written to in 'file' mode - Default: ''",
+            ],
+            "oversized_url": [
+                "",
+                "URL of 'oversized_dir' that pages link to in 'file' mode - Default: ''",
+            ],
+            "code_index": [
+                False,
+                "Collect the plain text and identifiers of code fences in "
+                "'Markdown.superfences_index' - Default: False",
+            ],
         }
         super().__init__(*args, **kwargs)
 
@@ -192,10 +260,18 @@ class SuperFencesCodeExtension(Extension):
         md.registerExtension(self)
         config = self.getConfigs()
 
-        # Default fenced blocks
-        self.superfences.insert(
-            0, {"name": "superfences", "test": lambda language: True, "formatter": None}
-        )
+        if config["oversized"] not in ("truncate", "file"):
+            raise ValueError(
+                "'oversized' must be 'truncate' or 'file', not %r" % config["oversized"]
+            )
+        if config["oversized"] == "file" and not config["oversized_dir"]:
+            raise ValueError("'oversized_dir' must be set when 'oversized' is 'file'")
+
+        # Default fenced blocks.  The list is rebuilt for every Markdown instance
+        # so an extension object can be shared between instances.
+        self.superfences = [
+            {"name": "superfences", "test": lambda language: True, "formatter": None}
+        ]
 
         if config.get("use_codehilite_settings"):  # pragma: no coverage
             warnings.warn(
@@ -217,12 +293,11 @@ class SuperFencesCodeExtension(Extension):
                     name, lambda s, l, c=class_name, f=fence_format: f(s, l, c)
                 )
 
-        self.markdown = md
-        self.patch_fenced_rule()
-        for entry in self.superfences:
-            entry["stash"] = CodeStash()
+        # Fences are put back from the HTML stash with the other placeholders.
+        util.get_placeholders(md)
+        self.patch_fenced_rule(md)
 
-    def patch_fenced_rule(self):
+    def patch_fenced_rule(self, md):
         """
         Patch Python Markdown with our own fenced block extension.
 
@@ -231,33 +306,30 @@ class SuperFencesCodeExtension(Extension):
         """
 
         config = self.getConfigs()
-        fenced = SuperFencesBlockPreprocessor(self.markdown)
-        indented_code = SuperFencesCodeBlockProcessor(self)
+        stash = CodeStash()
+        fenced = SuperFencesBlockPreprocessor(md)
+        indented_code = SuperFencesCodeBlockProcessor(md.parser)
         fenced.config = config
-        fenced.extension = self
+        fenced.superfences = self.superfences
+        fenced.stash = stash
         indented_code.config = config
-        indented_code.markdown = self.markdown
-        indented_code.extension = self
-        self.superfences[0]["formatter"] = fenced.highlight
-        self.markdown.parser.blockprocessors["code"] = indented_code
-        self.markdown.preprocessors.add(
-            "fenced_code_block", fenced, ">normalize_whitespace"
-        )
-
-    def reset(self):
-        """Clear the stash."""
-
-        for entry in self.superfences:
-            entry["stash"].clear_stash()
+        indented_code.markdown = md
+        indented_code.stash = stash
+        md.parser.blockprocessors["code"] = indented_code
+        md.preprocessors.add("fenced_code_block", fenced, ">normalize_whitespace")
 
 
-class SuperFencesBlockPreprocessor(Preprocessor):
+class SuperFencesBlockPreprocessor(util.LinePreprocessor):
     """
     Preprocessor to find fenced code blocks.
 
     Because this is done as a preprocessor, it might be too greedy.
     We will stash the blocks code and restore if we mistakenly processed
     text from an indented code block.
+
+    All state for the document being processed lives in a `FenceState`
+    object that is created on each run, so the preprocessor itself only
+    holds configuration.
     """
 
     fence_start = re.compile(NESTED_FENCE_START)
@@ -271,16 +343,15 @@ class SuperFencesBlockPreprocessor(Preprocessor):
         self.checked_hl_settings = False
         self.codehilite_conf = {}
 
-    def rebuild_block(self, lines):
+    def rebuild_block(self, state):
         """Deindent the fenced block lines."""
 
-        return "\n".join([line[self.ws_len :] for line in lines])
+        return "\n".join([line[state.ws_len :] for line in state.code])
 
     def get_hl_settings(self):
         """Check for code hilite extension to get its config."""
 
         if not self.checked_hl_settings:
-            self.checked_hl_settings = True
             self.highlight_code = self.config["highlight_code"]
 
             config = hl.get_hl_settings(self.markdown)
@@ -293,83 +364,85 @@ class SuperFencesBlockPreprocessor(Preprocessor):
             self.use_pygments = config["use_pygments"]
             self.noclasses = config["noclasses"]
             self.linenums = config["linenums"]
+            self.compact = config.get("compact", False)
+            self.lexer_snapshot = config.get("lexer_snapshot", "")
+            self.checked_hl_settings = True
 
-    def clear(self):
-        """Reset the class variables."""
-
-        self.ws = None
-        self.ws_len = 0
-        self.fence = None
-        self.lang = None
-        self.hl_lines = None
-        self.linestart = None
-        self.linestep = None
-        self.linespecial = None
-        self.quote_level = 0
-        self.code = []
-        self.empty_lines = 0
-        self.whitespace = None
-        self.fence_end = None
-
-    def eval(self, m, start, end):
+    def eval(self, state, m, start, end):
         """Evaluate a normal fence."""
 
         if m.group(0).strip() == "":
             # Empty line is okay
-            self.empty_lines += 1
-            self.code.append(m.group(0))
-        elif len(m.group(1)) != self.ws_len and m.group(2) != "":
+            state.empty_lines += 1
+            state.code.append(m.group(0))
+        elif len(m.group(1)) != state.ws_len and m.group(2) != "":
             # Not indented enough
-            self.clear()
-        elif self.fence_end.match(m.group(0)) is not None and not m.group(2).startswith(
-            " "
-        ):
+            state.clear()
+        elif state.fence_end.match(m.group(0)) is not None and not m.group(
+            2
+        ).startswith(" "):
             # End of fence
-            self.process_nested_block(m, start, end)
+            self.process_nested_block(state, m, start, end)
         else:
             # Content line
-            self.empty_lines = 0
-            self.code.append(m.group(0))
+            state.empty_lines = 0
+            state.code.append(m.group(0))
 
-    def eval_quoted(self, m, quote_level, start, end):
+    def eval_quoted(self, state, m, quote_level, start, end):
         """Evaluate fence inside a blockquote."""
 
-        if quote_level > self.quote_level:
+        if quote_level > state.quote_level:
             # Quote level exceeds the starting quote level
-            self.clear()
-        elif quote_level <= self.quote_level:
+            state.clear()
+        elif quote_level <= state.quote_level:
             if m.group(2) == "":
                 # Empty line is okay
-                self.code.append(m.group(0))
-                self.empty_lines += 1
-            elif len(m.group(1)) < self.ws_len:
+                state.code.append(m.group(0))
+                state.empty_lines += 1
+            elif len(m.group(1)) < state.ws_len:
                 # Not indented enough
-                self.clear()
-            elif self.empty_lines and quote_level < self.quote_level:
+                state.clear()
+            elif state.empty_lines and quote_level < state.quote_level:
                 # Quote levels don't match and we are signified
                 # the end of the block with an empty line
-                self.clear()
-            elif self.fence_end.match(m.group(0)) is not None:
+                state.clear()
+            elif state.fence_end.match(m.group(0)) is not None:
                 # End of fence
-                self.process_nested_block(m, start, end)
+                self.process_nested_block(state, m, start, end)
             else:
                 # Content line
-                self.empty_lines = 0
-                self.code.append(m.group(0))
+                state.empty_lines = 0
+                state.code.append(m.group(0))
 
-    def process_nested_block(self, m, start, end):
+    def process_nested_block(self, state, m, start, end):
         """Process the contents of the nested block."""
 
-        self.last = m.group(0)
         code = None
-        for entry in reversed(self.extension.superfences):
-            if entry["test"](self.lang):
-                code = entry["formatter"](self.rebuild_block(self.code), self.lang)
+        for entry in reversed(self.superfences):
+            if entry["test"](state.lang):
+                source = self.rebuild_block(state)
+                if entry["formatter"] is None:
+                    index = (
+                        self.markdown.superfences_index
+                        if self.config["code_index"]
+                        else None
+                    )
+                    keep = self.get_oversized(source)
+                    if keep is None:
+                        code = self.highlight(source, state.lang, state, index=index)
+                    else:
+                        code = self.highlight_oversized(source, state.lang, state, keep)
+                        if index is not None:
+                            index.append(
+                                self.get_highlighter().get_index(source, state.lang)
+                            )
+                else:
+                    code = entry["formatter"](source, state.lang)
                 break
 
         if code is not None:
-            self._store("\n".join(self.code) + "\n", code, start, end, entry)
-        self.clear()
+            self._store(state, code, start, end)
+        state.clear()
 
     def parse_hl_lines(self, hl_lines):
         """Parse the lines to highlight."""
@@ -393,30 +466,55 @@ class SuperFencesBlockPreprocessor(Preprocessor):
 
         return int(linespecial) if linespecial else -1
 
-    def search_nested(self, lines):
+    def search_nested(self, lines, state):
         """Search for nested fenced blocks."""
 
+        return list(self.iter_nested(lines, state))
+
+    def iter_nested(self, lines, state):
+        """
+        Yield the lines with nested fenced blocks replaced by placeholders.
+
+        The lines of a possible block are held back until it is closed or
+        turns out not to be a block.  The expressions for the ends and indents
+        of this document's fences are compiled here rather than in the process
+        wide registry, which would otherwise keep one for every fence ever seen.
+        """
+
+        patterns = {}
+
+        def compile_fence_re(pattern):
+            """Compile an expression once per document."""
+
+            compiled = patterns.get(pattern)
+            if compiled is None:
+                compiled = patterns[pattern] = re.compile(pattern)
+            return compiled
+
         count = 0
         for line in lines:
-            if self.fence is None:
+            if state.fence is None:
                 # Found the start of a fenced block.
                 m = self.fence_start.match(line)
-                if m is not None:
+                if m is None:
+                    yield line
+                else:
                     start = count
-                    self.first = m.group(0)
-                    self.ws = m.group("ws") if m.group("ws") else ""
-                    self.ws_len = len(self.ws)
-                    self.quote_level = self.ws.count(">")
-                    self.empty_lines = 0
-                    self.fence = m.group("fence")
-                    self.lang = m.group("lang")
-                    self.hl_lines = m.group("hl_lines")
-                    self.linestart = m.group("linestart")
-                    self.linestep = m.group("linestep")
-                    self.linespecial = m.group("linespecial")
-                    self.fence_end = re.compile(NESTED_FENCE_END % self.fence)
-                    self.whitespace = re.compile(WS % self.ws_len)
+                    state.source = [line]
+                    state.ws = m.group("ws") if m.group("ws") else ""
+                    state.ws_len = len(state.ws)
+                    state.quote_level = state.ws.count(">")
+                    state.empty_lines = 0
+                    state.fence = m.group("fence")
+                    state.lang = m.group("lang")
+                    state.hl_lines = m.group("hl_lines")
+                    state.linestart = m.group("linestart")
+                    state.linestep = m.group("linestep")
+                    state.linespecial = m.group("linespecial")
+                    state.fence_end = compile_fence_re(NESTED_FENCE_END % state.fence)
+                    state.whitespace = compile_fence_re(WS % state.ws_len)
             else:
+                state.source.append(line)
                 # Evaluate lines
                 # - Determine if it is the ending line or content line
                 # - If is a content line, make sure it is all indentend
@@ -425,57 +523,156 @@ class SuperFencesBlockPreprocessor(Preprocessor):
                 # - When content lines are inside blockquotes, make sure
                 #   the nested block quote levels make sense according to
                 #   blockquote rules.
-                m = self.whitespace.match(line)
+                m = state.whitespace.match(line)
                 if m:
                     end = count + 1
                     quote_level = m.group(1).count(">")
 
-                    if self.quote_level:
+                    if state.quote_level:
                         # Handle blockquotes
-                        self.eval_quoted(m, quote_level, start, end)
+                        self.eval_quoted(state, m, quote_level, start, end)
                     elif quote_level == 0:
                         # Handle all other cases
-                        self.eval(m, start, end)
+                        self.eval(state, m, start, end)
                     else:
                         # Looks like we got a blockquote line
                         # when not in a blockquote.
-                        self.clear()
+                        state.clear()
                 else:  # pragma: no cover
                     # I am 99.9999% sure we will never hit this line.
                     # But I am too chicken to pull it out :).
-                    self.clear()
+                    state.clear()
+
+                if state.fence is None:
+                    # The block is done: replace it, or give its lines back.
+                    if state.stack:
+                        yield state.stack.pop()[0]
+                    else:
+                        yield from state.source
+                    state.source = []
             count += 1
 
-        # Now that we are done iterating the lines,
-        # let's replace the original content with the
-        # fenced blocks.
-        while len(self.stack):
-            fenced, start, end = self.stack.pop()
-            lines = lines[:start] + [fenced] + lines[end:]
-        return lines
+        # A block that is never closed is left as it is.
+        yield from state.source
+
+    def get_oversized(self, source):
+        """Return how many lines of an oversized fence fit on the page, or `None` if it all fits."""
+
+        max_lines = self.config["max_lines"]
+        max_bytes = self.config["max_bytes"]
+        if not max_lines and not max_bytes:
+            return None
+
+        lines = source.split("\n")
+        keep = min(max_lines, len(lines)) if max_lines else len(lines)
+        if max_bytes and len(source.encode("utf-8")) > max_bytes:
+            size = 0
+            for index, line in enumerate(lines[:keep]):
+                size += len(line.encode("utf-8")) + 1
+                if size > max_bytes:
+                    keep = max(index, 1)
+                    break
+        return keep if keep < len(lines) else None
+
+    def highlight_oversized(self, src, language, state, keep):
+        """
+        Highlight the first `keep` lines of an oversized fence for the page.
+
+        In `truncate` mode the rest is highlighted on its own and returned in
+        `superfences_fragments`.  In `file` mode the whole fence is written to a
+        file that the page links to.  Both are named by a hash of the fence, its
+        options, and the highlight settings.
+        """
+
+        lines = src.split("\n")
+        settings = (
+            language,
+            state.hl_lines,
+            state.linestart,
+            state.linestep,
+            state.linespecial,
+            self.highlight_code,
+            self.css_class,
+            self.guess_lang,
+            self.pygments_style,
+            self.use_pygments,
+            self.noclasses,
+            self.linenums,
+            self.extend_pygments_lang,
+            self.compact,
+        )
+        key = hashlib.sha1((f"{settings!r}\n{src}").encode("utf-8")).hexdigest()[:16]
+        code = self.highlight("\n".join(lines[:keep]), language, state)
+        more = len(lines) - keep
+        more = f"{more} more line{'' if more == 1 else 's'}"
+
+        if self.config["oversized"] == "file":
+            path = os.path.join(self.config["oversized_dir"], key + ".html")
+            if not os.path.exists(path):
+                # Write to a temporary file first so no one reads a partial file.
+                fd, temp = tempfile.mkstemp(
+                    suffix=".tmp", dir=self.config["oversized_dir"]
+                )
+                try:
+                    with open(fd, "w", encoding="utf-8") as f:
+                        f.write(self.highlight(src, language, state))
+                    os.replace(temp, path)
+                except BaseException:
+                    os.remove(temp)
+                    raise
+            url = self.config["oversized_url"].rstrip("/")
+            link = f'<a href="{_escape(url + "/" if url else "")}{key}.html">{more}</a>'
+            return f'{code}\n<div class="{self.css_class}-more">{link}</div>'
+
+        self.markdown.superfences_fragments[key] = self.highlight(
+            "\n".join(lines[keep:]), language, state, keep
+        )
+        return (
+            f'{code}\n<div class="{self.css_class}-more" data-superfences-fragment="{key}">'
+            f"{more}</div>"
+        )
 
-    def highlight(self, src, language):
+    def get_highlighter(self):
+        """Get a highlighter with the current highlight settings."""
+
+        return hl.Highlight(
+            guess_lang=self.guess_lang,
+            pygments_style=self.pygments_style,
+            use_pygments=self.use_pygments and self.highlight_code,
+            noclasses=self.noclasses,
+            linenums=self.linenums,
+            extend_pygments_lang=self.extend_pygments_lang,
+            compact=self.compact,
+            lexer_snapshot=self.lexer_snapshot,
+        )
+
+    def highlight(self, src, language, state, offset=0, index=None):
         """
         Syntax highlight the code block.
 
         If config is not empty, then the codehlite extension
         is enabled, so we call into it to highlight the code.
+        `offset` is the number of lines of the fence that come before `src`.
+        If `index` is a list, the code's plain text and identifiers are added to it.
         """
 
-        if self.highlight_code:
-            linestep = self.parse_line_step(self.linestep)
-            linestart = self.parse_line_start(self.linestart)
-            linespecial = self.parse_line_special(self.linespecial)
-            hl_lines = self.parse_hl_lines(self.hl_lines)
-
-            el = hl.Highlight(
-                guess_lang=self.guess_lang,
-                pygments_style=self.pygments_style,
-                use_pygments=self.use_pygments,
-                noclasses=self.noclasses,
-                linenums=self.linenums,
-                extend_pygments_lang=self.extend_pygments_lang,
-            ).highlight(
+        budget = util.get_budget(self.markdown)
+        if self.highlight_code and (
+            budget is None
+            or budget.within(
+                "superfences", "max_fence_bytes", len(src.encode("utf-8")), language
+            )
+        ):
+            linestep = self.parse_line_step(state.linestep)
+            linestart = self.parse_line_start(state.linestart)
+            linespecial = self.parse_line_special(state.linespecial)
+            hl_lines = self.parse_hl_lines(state.hl_lines)
+            if offset:
+                if linestart >= 0 or self.linenums:
+                    linestart = max(linestart, 1) + offset
+                hl_lines = [line - offset for line in hl_lines if line > offset]
+
+            el = self.get_highlighter().highlight(
                 src,
                 language,
                 self.css_class,
@@ -483,41 +680,106 @@ class SuperFencesBlockPreprocessor(Preprocessor):
                 linestart=linestart,
                 linestep=linestep,
                 linespecial=linespecial,
+                index=index,
             )
         else:
             # Format as a code block.
             el = self.CODE_WRAP % ("", "", _escape(src))
+            if index is not None:
+                index.append(self.get_highlighter().get_index(src, language))
         return el
 
-    def _store(self, source, code, start, end, obj):
+    def _store(self, state, code, start, end):
         """
-        Store the fenced blocks in the stack to be replaced when done iterating.
+        Store the fenced block in the stack to replace its lines when it is done.
 
-        Store the original text in case we need to restore if we are too greedy.
+        Store where the original text is in case we need to restore if we are too greedy.
         """
-        # Save the fenced blocks to add once we are done iterating the lines
+        # Save the fenced block to add in place of its lines
         placeholder = self.markdown.htmlStash.store(code, safe=True)
-        self.stack.append((f"{self.ws}{placeholder}", start, end))
-        if not self.disabled_indented:
+        state.stack.append((f"{state.ws}{placeholder}", start, end))
+        if not state.disabled_indented:
             # If an indented block consumes this placeholder,
             # we can restore the original source
-            obj["stash"].store(
-                placeholder[1:-1],
-                f"{self.first}\n{source}{self.last}",
-                self.ws_len,
-            )
+            self.stash.store(placeholder[1:-1], state.source, state.ws_len)
 
-    def run(self, lines):
+    def iter_lines(self, lines):
         """Search for fenced blocks."""
 
         self.get_hl_settings()
-        self.clear()
-        self.stack = []
-        self.disabled_indented = self.config.get("disable_indented_code_blocks", False)
+        self.stash.clear_stash()
+        self.markdown.superfences_fragments = {}
+        self.markdown.superfences_index = []
+        state = FenceState(self.config.get("disable_indented_code_blocks", False))
+
+        yield from self.iter_nested(lines, state)
+
+
+class FencedBlockScanner(SuperFencesBlockPreprocessor):
+    """
+    Find fenced blocks exactly like the preprocessor, but record them instead of rendering them.
+
+    This is what `iter_fenced_blocks` uses; it needs no Markdown instance.
+    """
+
+    def __init__(self):
+        """Initialize."""
+
+        super().__init__(None)
+        self.blocks = []
 
-        lines = self.search_nested(lines)
+    def process_nested_block(self, state, m, start, end):
+        """Record the block."""
 
-        return lines
+        options = {}
+        if state.hl_lines:
+            options["hl_lines"] = self.parse_hl_lines(state.hl_lines)
+        for name in ("linestart", "linestep", "linespecial"):
+            value = getattr(state, name)
+            if value:
+                options[name] = int(value)
+
+        self.blocks.append(
+            {
+                "lang": state.lang or "",
+                "options": options,
+                "source": self.rebuild_block(state),
+                "start": start,
+                "end": end,
+                "indent": state.ws,
+            }
+        )
+        state.clear()
+
+    def scan(self, lines):
+        """Yield the blocks found in the lines, each as soon as it is closed."""
+
+        self.blocks = []
+        for _ in self.iter_nested(lines, FenceState(True)):
+            if self.blocks:
+                yield from self.blocks
+                self.blocks = []
+        yield from self.blocks
+
+
+def iter_fenced_blocks(text, tab_length=4):
+    """
+    Yield every fenced block in Markdown text without rendering it.
+
+    Blocks are found the same way SuperFences finds them, nested blocks in
+    lists and blockquotes included.  Each block is a dictionary with `lang`,
+    `options` (`hl_lines`, `linestart`, `linestep`, and `linespecial` when
+    given), the dedented `source`, the `start` and `end` line indexes of the
+    block (`end` is exclusive), and the `indent` that precedes every line.
+
+    Like the preprocessor, a fence inside an indented code block is found as
+    well, as only the block parser can tell it apart.
+    """
+
+    # Normalize the text like Python Markdown does before preprocessors see it.
+    text = text.replace("\r\n", "\n").replace("\r", "\n").expandtabs(tab_length)
+    lines = [line if line.strip(" ") else "" for line in text.split("\n")]
+    yield from FencedBlockScanner().scan(lines)
 
 
 class SuperFencesCodeBlockProcessor(CodeBlockProcessor):
@@ -532,9 +794,11 @@ class SuperFencesCodeBlockProcessor(CodeBlockProcessor):
     )
 
     def test(self, parent, block):
-        """Test method that is one day to be deprecated."""
+        """Only indented blocks can be code blocks."""
 
-        return True
+        return not self.config.get(
+            "disable_indented_code_blocks", False
+        ) and block.startswith(" " * self.tab_length)
 
     def reindent(self, text, pos, level):
         """Reindent the code to where it is supposed to be."""
@@ -554,16 +818,12 @@ class SuperFencesCodeBlockProcessor(CodeBlockProcessor):
             if m:
                 key = m.group(2)
                 indent_level = len(m.group(1))
-                original = None
-                for entry in self.extension.superfences:
-                    stash = entry["stash"]
-                    original, pos = stash.get(key)
-                    if original is not None:
-                        code = self.reindent(original, pos, indent_level)
-                        new_block.append(code)
-                        stash.remove(key)
-                        break
-                if original is None:  # pragma: no cover
+                original, pos = self.stash.get(key, (None, None))
+                if original is not None:
+                    code = self.reindent(original, pos, indent_level)
+                    new_block.append(code)
+                    self.stash.remove(key)
+                else:  # pragma: no cover
                     # Too much work to test this. This is just a fall back in case
                     # we find a placeholder, and we went to revert it and it wasn't in our stash.
                     # Most likely this would be caused by someone else. We just want to put it
@@ -29,6 +29,8 @@ import re
 from markdown import Extension
 from markdown.treeprocessors import Treeprocessor
 
+from . import util
+
 RE_CHECKBOX = re.compile(r"^(?P<checkbox> *\[(?P<state>(?:x|X| ){1})\] +)(?P<line>.*)")
 
 
@@ -47,64 +49,110 @@ def get_checkbox(state, custom_checkbox=False):
     )
 
 
+def get_task_text(container, line):
+    """Get the first line of a task's text, including inline elements."""
+
+    parts = [line]
+    for child in container:
+        if child.tag in ("ul", "ol", "p", "div"):
+            break
+        parts.extend(child.itertext())
+        parts.append(child.tail or "")
+    return "".join(parts).split("\n", 1)[0].strip()
+
+
+def get_task_stats(tasks):
+    """
+    Get task statistics.
+
+    Each task is a dictionary with `checked` and `text`, the first line of the
+    task's text, which serves as a hint to find the task in the source.
+    """
+
+    checked = sum(1 for task in tasks if task["checked"])
+    return {
+        "total": len(tasks),
+        "checked": checked,
+        "unchecked": len(tasks) - checked,
+        "tasks": tasks,
+    }
+
+
 class TasklistTreeprocessor(Treeprocessor):
     """Tasklist Treeprocessor that finds lists with checkboxes."""
 
     def inline(self, li):
         """Search for checkbox directly in li tag."""
 
-        found = False
         m = RE_CHECKBOX.match(li.text)
         if m is not None:
             li.text = self.markdown.htmlStash.store(
                 get_checkbox(m.group("state"), self.custom_checkbox), safe=True
             ) + m.group("line")
-            found = True
-        return found
+        return m
 
     def sub_paragraph(self, li):
         """Search for checkbox in sub-paragraph."""
 
-        found = False
+        m = None
         if len(li):
-            first = list(li)[0]
+            first = li[0]
             if first.tag == "p" and first.text is not None:
                 m = RE_CHECKBOX.match(first.text)
                 if m is not None:
                     first.text = self.markdown.htmlStash.store(
                         get_checkbox(m.group("state"), self.custom_checkbox), safe=True
                     ) + m.group("line")
-                    found = True
-        return found
+        return m
+
+    def get_task(self, li):
+        """Mark a list item that starts with a checkbox as a task and return the task."""
+
+        if li.text is None or li.text == "":
+            m = self.sub_paragraph(li)
+            container = li[0] if m is not None else None
+        else:
+            m = self.inline(li)
+            container = li
+        if m is None:
+            return None
+
+        c = li.attrib.get("class", "")
+        classes = [] if c == "" else c.split()
+        classes.append("task-list-item")
+        li.attrib["class"] = " ".join(classes)
+        return {
+            "checked": m.group("state") != " ",
+            "text": get_task_text(container, m.group("line")),
+        }
 
-    def run(self, root):
-        """Find list items that start with [ ] or [x] or [X]."""
+    def find_tasks(self, parent, tasks):
+        """Find the tasks under `parent` and add them to `tasks` in document order."""
 
-        self.custom_checkbox = bool(self.config["custom_checkbox"])
-        parent_map = {c: p for p in root.iter() for c in p}
-        task_items = []
-        lilinks = root.iter("li")
-        for li in lilinks:
-            if li.text is None or li.text == "":
-                if not self.sub_paragraph(li):
-                    continue
-            elif not self.inline(li):
-                continue
-
-            # Checkbox found
-            c = li.attrib.get("class", "")
-            classes = [] if c == "" else c.split()
-            classes.append("task-list-item")
-            li.attrib["class"] = " ".join(classes)
-            task_items.append(li)
+        is_list = parent.tag in ("ul", "ol")
+        found = False
+        for child in parent:
+            if is_list and child.tag == "li":
+                task = self.get_task(child)
+                if task is not None:
+                    tasks.append(task)
+                    found = True
+            self.find_tasks(child, tasks)
 
-        for li in task_items:
-            parent = parent_map[li]
+        if found:
             c = parent.attrib.get("class", "")
             classes = [] if c == "" else c.split()
             if "task-list" not in classes:
                 classes.append("task-list")
             parent.attrib["class"] = " ".join(classes)
+
+    def run(self, root):
+        """Find list items that start with [ ] or [x] or [X]."""
+
+        self.custom_checkbox = bool(self.config["custom_checkbox"])
+        tasks = []
+        self.find_tasks(root, tasks)
+        self.markdown.task_stats = get_task_stats(tasks)
         return root
 
 
@@ -131,6 +179,8 @@ class TasklistExtension(Extension):
         tasklist = TasklistTreeprocessor(md)
         tasklist.config = self.getConfigs()
         md.treeprocessors.add("task-list", tasklist, ">inline")
+        md.task_stats = get_task_stats([])
+        util.get_placeholders(md)
         md.registerExtension(self)
 
 
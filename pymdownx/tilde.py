@@ -26,26 +26,35 @@ DEALINGS IN THE SOFTWARE.
 """
 
 from markdown import Extension
-from markdown.inlinepatterns import (DoubleTagPattern, SimpleTagPattern,
-                                     SimpleTextPattern)
-
 from . import util
 
-RE_SMART_CONTENT = r"((?:[^~]|~(?=[^\W_]|~|\s)|(?<=\s)~+?(?=\s))+?~*?)"
+# Each character of the content can only be matched one way, and the content
+# stops at a barrier, so a failed match can't backtrack and later openers
+# before the same barrier can be skipped (see `util.InlineProcessor`).
+RE_SMART_CONTENT = r"((?:[^~]|~(?=[^\W_]|~|\s))+?)"
+RE_SMART_BARRIER = r"~(?![^\W_]|~|\s)"
 RE_CONTENT = r"((?:[^~]|(?<!~)~(?=[^\W_]|~))+?)"
-RE_SMART_DEL = (
-    r"(?:(?<=_)|(?<![\w~]))(~{2})(?![\s~])%s(?<!\s)\2(?:(?=_)|(?![\w~]))"
-    % RE_SMART_CONTENT
+RE_BARRIER = r"(?<=~)~|~(?![^\W_]|~)"
+RE_SMART_DEL_OPEN = r"(?:(?<=_)|(?<![\w~]))(~{2})(?![\s~])"
+RE_SMART_DEL = r"%s%s(?<!\s)\1(?:(?=_)|(?![\w~]))" % (
+    RE_SMART_DEL_OPEN,
+    RE_SMART_CONTENT,
 )
-RE_DEL = r"(~{2})(?!\s)%s(?<!\s)\2" % RE_CONTENT
+RE_DEL_OPEN = r"(~{2})(?!\s)"
+RE_DEL = r"%s%s(?<!\s)\1" % (RE_DEL_OPEN, RE_CONTENT)
 
-RE_SUB_DEL = r"(~{3})(?!\s)([^~]+?)(?<!\s)\2"
-RE_SMART_SUB_DEL = r"(~{3})(?!\s)%s(?<!\s)\2" % RE_SMART_CONTENT
+RE_SUB_DEL = r"(~{3})(?!\s)([^~]+?)(?<!\s)\1"
+RE_SMART_SUB_DEL = r"(~{3})(?!\s)%s(?<!\s)\1" % RE_SMART_CONTENT
 RE_SUB_DEL2 = r"(~{3})(?!\s)([^~]+?)(?<!\s)~{2}([^~ ]+?)~"
+RE_SUB_DEL_OPEN = r"(~{3})(?!\s)"
 RE_SMART_SUB_DEL2 = (
     r"(~{3})(?!\s)%s(?<!\s)~{2}(?:(?=_)|(?![\w~]))([^~ ]+?)~" % RE_SMART_CONTENT
 )
-RE_SUB = r"(~)([^~ ]+?|~)\2"
+RE_SUB_OPEN = r"~"
+RE_SUB = r"(~)([^~ ]+?|~)\1"
+# What the content of a match can't hold (see `util.InlineProcessor`).
+RE_SUB_DEL_FENCE = r"~"
+RE_SUB_FENCE = r"[~ ]"
 
 RE_NOT_TILDE = r"((^| )(~)( |$))"
 
@@ -83,32 +92,64 @@ class DeleteSubExtension(Extension):
         util.escape_chars(md, escape_chars)
 
         delete_rule = RE_SMART_DEL if smart else RE_DEL
+        delete_skip = (
+            (RE_SMART_DEL_OPEN, RE_SMART_BARRIER, RE_SMART_BARRIER)
+            if smart
+            else (RE_DEL_OPEN, RE_BARRIER, RE_BARRIER)
+        )
         sub_del_rule = RE_SMART_SUB_DEL if smart else RE_SUB_DEL
         sub_del2_rule = RE_SMART_SUB_DEL2 if smart else RE_SUB_DEL2
+        sub_del_skip = (
+            (RE_SUB_DEL_OPEN, RE_SMART_BARRIER, RE_SMART_BARRIER)
+            if smart
+            else (RE_SUB_DEL_OPEN, None, RE_SUB_DEL_FENCE)
+        )
+        sub_del2_skip = (
+            (RE_SUB_DEL_OPEN, RE_SMART_BARRIER, RE_SMART_BARRIER, 1)
+            if smart
+            else (RE_SUB_DEL_OPEN, None, RE_SUB_DEL_FENCE, 2)
+        )
         sub_rule = RE_SUB
+        sub_skip = (RE_SUB_OPEN, None, RE_SUB_FENCE)
 
         if delete:
             md.inlinePatterns.add(
-                "del", SimpleTagPattern(delete_rule, "del"), "<not_strong"
+                "del",
+                util.SimpleTagInlineProcessor(delete_rule, "del", *delete_skip),
+                "<not_strong",
+            )
+            md.inlinePatterns.add(
+                "not_tilde", util.SimpleTextInlineProcessor(RE_NOT_TILDE), "<del"
             )
-            md.inlinePatterns.add("not_tilde", SimpleTextPattern(RE_NOT_TILDE), "<del")
             if subscript:
                 md.inlinePatterns.add(
-                    "sub_del", DoubleTagPattern(sub_del_rule, "sub,del"), "<del"
+                    "sub_del",
+                    util.DoubleTagInlineProcessor(
+                        sub_del_rule, "sub,del", *sub_del_skip
+                    ),
+                    "<del",
                 )
                 md.inlinePatterns.add(
-                    "sub_del2", DoubleTagPattern(sub_del2_rule, "sub,del"), "<del"
+                    "sub_del2",
+                    util.DoubleTagInlineProcessor(
+                        sub_del2_rule, "sub,del", *sub_del2_skip
+                    ),
+                    "<del",
                 )
                 md.inlinePatterns.add(
                     "sub",
-                    SimpleTagPattern(sub_rule, "sub"),
+                    util.SimpleTagInlineProcessor(sub_rule, "sub", *sub_skip),
                     ">del" if smart else "<del",
                 )
         elif subscript:
             md.inlinePatterns.add(
-                "sub", SimpleTagPattern(sub_rule, "sub"), "<not_strong"
+                "sub",
+                util.SimpleTagInlineProcessor(sub_rule, "sub", *sub_skip),
+                "<not_strong",
+            )
+            md.inlinePatterns.add(
+                "not_tilde", util.SimpleTextInlineProcessor(RE_NOT_TILDE), "<sub"
             )
-            md.inlinePatterns.add("not_tilde", SimpleTextPattern(RE_NOT_TILDE), "<sub")
 
 
 def makeExtension(*args, **kwargs):
@@ -6,9 +6,18 @@ MIT license.
 Copyright (c) 2017 Isaac Muse <isaacmuse@gmail.com>
 """
 
+import bisect
 import copy
 import re
 import sys
+import threading
+import time
+
+from markdown import inlinepatterns, odict
+from markdown import util as md_util
+from markdown.postprocessors import RawHtmlPostprocessor, UnescapePostprocessor
+from markdown.preprocessors import Preprocessor
+from markdown.treeprocessors import Treeprocessor
 
 PY3 = sys.version_info >= (3, 0)
 PY34 = sys.version_info >= (3, 4)
@@ -17,7 +26,22 @@ if PY3:
     uchr = chr  # noqa
     from html.parser import HTMLParser  # noqa
     from urllib.parse import quote, urlparse, urlunparse  # noqa
-    from urllib.request import pathname2url, url2pathname  # noqa
+
+    # `urllib.request` pulls in `http.client` and `email`, which makes up a good
+    # share of our import time, so only import it when a path is converted.
+    def pathname2url(path):
+        """Convert a file system path to a URL path."""
+
+        from urllib.request import pathname2url as _pathname2url
+
+        return _pathname2url(path)
+
+    def url2pathname(path):
+        """Convert a URL path to a file system path."""
+
+        from urllib.request import url2pathname as _url2pathname
+
+        return _url2pathname(path)
 
     if PY34:
         import html  # noqa
@@ -34,6 +58,7 @@ else:
 
     html_unescape = HTMLParser().unescape  # noqa
 
+RE_GLOBAL_FLAGS = re.compile(r"^\(\?[aiLmsux]+\)")
 RE_WIN_DRIVE_LETTER = re.compile(r"^[A-Za-z]$")
 RE_WIN_DRIVE_PATH = re.compile(r"^[A-Za-z]:(?:\\.*)?$")
 RE_URL = re.compile("(http|ftp)s?|data|mailto|tel|news")
@@ -107,6 +132,405 @@ else:
         return uchr(value)
 
 
+class RegexRegistry:
+    """
+    Process wide registry of compiled regular expressions.
+
+    Each `(pattern, flags)` pair is compiled once per process, no matter how
+    many Markdown instances are configured.  Python's own `re` cache is small
+    and shared with everything else in the process, so we can't count on it.
+    """
+
+    def __init__(self):
+        """Initialize."""
+
+        self.lock = threading.Lock()
+        self.compiled = {}
+        self.compiles = {}
+        self.hits = 0
+
+    def __len__(self):
+        """Number of compiled patterns."""
+
+        return len(self.compiled)
+
+    def compile(self, pattern, flags=0):
+        """Get the compiled pattern, compiling it if it hasn't been seen before."""
+
+        key = (pattern, flags)
+        compiled = self.compiled.get(key)
+        if compiled is None:
+            with self.lock:
+                compiled = self.compiled.get(key)
+                if compiled is None:
+                    compiled = re.compile(pattern, flags)
+                    self.compiled[key] = compiled
+                    self.compiles[key] = self.compiles.get(key, 0) + 1
+                    return compiled
+        self.hits += 1
+        return compiled
+
+    def stats(self):
+        """Return the number of patterns, compiles, and cache hits."""
+
+        return {
+            "patterns": len(self.compiled),
+            "compiles": sum(self.compiles.values()),
+            "hits": self.hits,
+        }
+
+    def clear(self):
+        """Clear the registry."""
+
+        with self.lock:
+            self.compiled = {}
+            self.compiles = {}
+            self.hits = 0
+
+
+REGEX = RegexRegistry()
+
+
+def compile_re(pattern, flags=0):
+    """Compile a regular expression through the process wide registry."""
+
+    return REGEX.compile(pattern, flags)
+
+
+def compile_legacy_pattern(pattern):
+    """
+    Compile an inline pattern the way Python Markdown's legacy `Pattern` does.
+
+    The pattern is wrapped in `^(.*?)PATTERN(.*)$`.  Global flags like `(?x)`
+    are moved to the front of the wrapped pattern as newer versions of Python
+    no longer allow them anywhere else.  Verbose patterns get a trailing
+    newline so a comment on the last line can't swallow the wrapper.
+    """
+
+    m = RE_GLOBAL_FLAGS.match(pattern)
+    flags = ""
+    if m:
+        flags = m.group(0)
+        pattern = pattern[m.end() :]
+        if "x" in flags:
+            pattern += "\n"
+    return compile_re(r"%s^(.*?)%s(.*)$" % (flags, pattern), re.DOTALL | re.UNICODE)
+
+
+class Pattern(inlinepatterns.Pattern):
+    """Legacy inline pattern that is compiled through the regex registry."""
+
+    def __init__(self, pattern, markdown_instance=None):
+        """Initialize."""
+
+        self.pattern = pattern
+        self.compiled_re = compile_legacy_pattern(pattern)
+        self.safe_mode = False
+        if markdown_instance:
+            self.markdown = markdown_instance
+
+
+class InlineMatch:
+    """
+    Match handed to Python Markdown's inline handling by `InlineProcessor`.
+
+    Python Markdown only looks at the text before the match (group 1), the
+    text after the match (the last group), and where the text after the
+    match starts.
+    """
+
+    def __init__(self, data, before, after, node):
+        """Initialize."""
+
+        self.string = data
+        self.before = before
+        self.after = after
+        self.node = node
+
+    def group(self, index=0):
+        """Get a group."""
+
+        if index == 0:
+            return self.string
+        return self.groups()[index - 1]
+
+    def groups(self):
+        """Get the text before and after the match."""
+
+        return (self.before, self.after)
+
+    def span(self, index=0):
+        """Get the span of a group."""
+
+        size = len(self.string)
+        if index == 1:
+            return (0, len(self.before))
+        elif index == 2:
+            return (size - len(self.after), size)
+        return (0, size)
+
+
+class InlineProcessor(Pattern):
+    """
+    Position based inline processor.
+
+    Unlike the legacy `Pattern`, the expression is not wrapped in
+    `^(.*?)PATTERN(.*)$` and is searched for instead.  Subclasses implement
+    `handle_match(m, data)` and return `(el, start, end)`; if `el` is `None`
+    the search continues after the match.  Subclasses that don't use a regular
+    expression can pass `None` as the pattern and override `search` instead.
+
+    After a replacement, the search picks up where it left off instead of
+    starting over like the legacy `Pattern`, so a text node is scanned once no
+    matter how many matches it has.  Only the last `margin` characters before
+    the placeholder are searched again, as an expression can look at the
+    characters around a match.  A match that failed before can also succeed
+    once part of it is a placeholder (`**a* b*`), so processors whose matches
+    can hold a placeholder must give an `opener`: failed openers are searched
+    again after a replacement, unless a `fence` is between them and the
+    placeholder.  A fence is something a match can't hold before its closer;
+    patterns with delimiters in the middle (`***strong,em*strong**`) give how
+    many fences those delimiters can hold as `inner`.  Processors without an
+    `opener` are taken to never match a placeholder.  The tails of a match's
+    children are searched by the same processor before the text around the
+    match, so where the last `depth` searches left off is kept.
+
+    Patterns of the form opener, content, closer can give the `opener` and a
+    `barrier`, an expression for where the content can't continue.  The content
+    must be made of single characters that are allowed or not based only on
+    their surroundings, the closer must be found the same way wherever the match
+    started, and the opener must always be the same length.  When a match fails
+    at an opener, any later opener that ends before the next barrier would fail
+    for the same reason, so it is skipped instead of being scanned again.  This
+    keeps a text full of openers that are never closed from taking quadratic time.
+    A `fence` given with a `barrier` must also be a barrier.
+    """
+
+    margin = 8
+    depth = 16
+
+    def __init__(
+        self, pattern, md=None, opener=None, barrier=None, fence=None, inner=0
+    ):
+        """Initialize."""
+
+        self.pattern = pattern
+        if pattern is not None:
+            self.compiled_re = compile_re(pattern, re.DOTALL | re.UNICODE)
+        self.opener = compile_re(opener, re.DOTALL | re.UNICODE) if opener else None
+        self.barrier = compile_re(barrier, re.DOTALL | re.UNICODE) if barrier else None
+        self.fence = compile_re(fence, re.DOTALL | re.UNICODE) if fence else None
+        self.inner = inner
+        self.safe_mode = False
+        self.pending = []
+        self.reset()
+        if md:
+            self.markdown = md
+
+    def getCompiledRegExp(self):
+        """Return the object Python Markdown calls `match` on."""
+
+        return self
+
+    def reset(self):
+        """Forget what earlier searches found."""
+
+        # Failed openers (`starts`, and the furthest any of them ends in `ends`),
+        # spans of matches that weren't handled, and the fences up to `fenced`.
+        self.starts = []
+        self.ends = []
+        self.skips = []
+        self.fences = []
+        self.fenced = 0
+
+    def get_start(self, data):
+        """Get where to start searching."""
+
+        # The tails of a match's children are searched before the text around
+        # the match, so look past the searches made for them.
+        for index in range(len(self.pending) - 1, -1, -1):
+            before, after, state = self.pending[index]
+            start = len(before)
+            end = len(data) - len(after)
+            if (
+                end > start
+                and data.startswith(before)
+                and data.endswith(after)
+                and md_util.INLINE_PLACEHOLDER_RE.fullmatch(data, start, end)
+            ):
+                del self.pending[index:]
+                self.starts, self.ends, self.skips, self.fences, self.fenced = state
+                return self.resume(start)
+        self.reset()
+        return 0
+
+    def resume(self, start):
+        """Get where to pick up the search after a replacement at `start`."""
+
+        limit = max(start - self.margin, 0)
+        del self.fences[bisect.bisect_left(self.fences, limit) :]
+        self.fenced = min(self.fenced, limit)
+        pos = limit
+
+        # The earliest failed opener with no more than `inner` fences after it.
+        count = len(self.starts)
+        index = bisect.bisect_left(self.starts, limit)
+        if len(self.fences) > self.inner:
+            fence = self.fences[-self.inner - 1]
+            index = min(index, bisect.bisect_right(self.ends, fence, 0, count))
+        else:
+            index = 0
+        if index < count:
+            pos = min(pos, self.starts[index])
+
+        # Don't start inside a match that wasn't handled, as it is skipped.
+        index = bisect.bisect_right(self.skips, (pos,)) - 1
+        if index >= 0 and self.skips[index][1] > pos:
+            pos = self.skips[index][0]
+
+        index = bisect.bisect_left(self.starts, pos)
+        del self.starts[index:]
+        del self.ends[index:]
+        del self.skips[bisect.bisect_left(self.skips, (pos,)) :]
+        return pos
+
+    def failed(self, start, end):
+        """Record an opener that failed."""
+
+        if self.opener is not None:
+            self.starts.append(start)
+            self.ends.append(max(end, self.ends[-1]) if self.ends else end)
+
+    def find(self, data, pos):
+        """Find the next match of the expression from `pos`."""
+
+        if self.opener is None:
+            return self.compiled_re.search(data, pos)
+
+        while True:
+            opener = self.opener.search(data, pos)
+            if opener is None:
+                return None
+            m = self.compiled_re.match(data, opener.start(0))
+            if m is not None:
+                return m
+            self.failed(opener.start(0), opener.end(0))
+            if self.barrier is None:
+                pos = opener.start(0) + 1
+                continue
+            barrier = self.barrier.search(data, opener.end(0))
+            end = barrier.start(0) if barrier is not None else len(data)
+            pos = max(opener.start(0) + 1, end - len(opener.group(0)) + 1)
+
+    def search(self, data, pos):
+        """Search for the next match that is handled and return `(el, start, end)`."""
+
+        while True:
+            m = self.find(data, pos)
+            if m is None:
+                return None
+            el, start, end = self.handle_match(m, data)
+            if el is not None:
+                return el, start, end
+            pos = max(m.end(0), m.start(0) + 1)
+            self.failed(m.start(0), pos)
+            self.skips.append((m.start(0), pos))
+
+    def match(self, data):
+        """Search for the next match and return it as an `InlineMatch`."""
+
+        found = self.search(data, self.get_start(data))
+        if found is None:
+            return None
+
+        el, start, end = found
+        if self.fence is not None:
+            for fence in self.fence.finditer(data, self.fenced, start):
+                self.fences.append(fence.start(0))
+            self.fenced = max(self.fenced, start)
+        before, after = data[:start], data[end:]
+        state = (self.starts, self.ends, self.skips, self.fences, self.fenced)
+        self.pending.append((before, after, state))
+        del self.pending[: -self.depth]
+        return InlineMatch(data, before, after, el)
+
+    def handle_match(self, m, data):
+        """Return the element and the span it replaces."""
+
+        return None, None, None
+
+    def handleMatch(self, m):
+        """Return the element found by `match`."""
+
+        return m.node
+
+
+class SimpleTextInlineProcessor(InlineProcessor):
+    """Return a simple text of group(1) of a pattern."""
+
+    def handle_match(self, m, data):
+        """Return string content of group(1) of a matching pattern."""
+
+        return m.group(1), m.start(0), m.end(0)
+
+
+class LinkInlineProcessor(InlineProcessor, inlinepatterns.LinkPattern):
+    """Base class for link inline processors; provides `sanitize_url`."""
+
+
+class SimpleTagInlineProcessor(InlineProcessor):
+    """Return element of type `tag` with a text attribute of group(2) of a pattern."""
+
+    def __init__(self, pattern, tag, opener=None, barrier=None, fence=None, inner=0):
+        """Initialize."""
+
+        InlineProcessor.__init__(
+            self,
+            pattern,
+            opener=opener,
+            barrier=barrier,
+            fence=fence,
+            inner=inner,
+        )
+        self.tag = tag
+
+    def handle_match(self, m, data):
+        """Return an element with the text of group(2)."""
+
+        el = md_util.etree.Element(self.tag)
+        el.text = m.group(2)
+        return el, m.start(0), m.end(0)
+
+
+class DoubleTagInlineProcessor(SimpleTagInlineProcessor):
+    """
+    Return a element of type `tag1` with a child of type `tag2`.
+
+    The child's text is group(2) of a pattern and its tail is group(3),
+    if the pattern has one.
+    """
+
+    def handle_match(self, m, data):
+        """Return the nested elements."""
+
+        tag1, tag2 = self.tag.split(",")
+        el1 = md_util.etree.Element(tag1)
+        el2 = md_util.etree.SubElement(el1, tag2)
+        el2.text = m.group(2)
+        if len(m.groups()) == 3:
+            el2.tail = m.group(3)
+        return el1, m.start(0), m.end(0)
+
+
+class SubstituteTagInlineProcessor(SimpleTagInlineProcessor):
+    """Return an element of type `tag` with no children."""
+
+    def handle_match(self, m, data):
+        """Return an empty element."""
+
+        return md_util.etree.Element(self.tag), m.start(0), m.end(0)
+
+
 def get_arg_count(fn):
     """Get argument count of function."""
 
@@ -192,5 +616,466 @@ def parse_url(url):
     return (scheme, netloc, path, params, query, fragment, is_url, is_absolute)
 
 
+class LinkInventory:
+    """
+    Links created or rewritten while converting a document.
+
+    Set `source` to the page that is about to be converted so the links
+    can be traced back to it.  Links are cleared at the start of every
+    conversion, `source` is left alone.
+    """
+
+    def __init__(self):
+        """Initialize."""
+
+        self.source = None
+        self.links = []
+
+    def __iter__(self):
+        """Iterate the links."""
+
+        return iter(self.links)
+
+    def __len__(self):
+        """Number of links."""
+
+        return len(self.links)
+
+    def clear(self):
+        """Clear the links."""
+
+        self.links = []
+
+    def add(self, url, extension, original=None, repo=None):
+        """
+        Record a link.
+
+        `original` is the target as it was written if the extension rewrote it,
+        and `repo` is `(provider, user_repo, link_type, value)` for repository links.
+        """
+
+        is_url, is_absolute = parse_url(url)[6:]
+        provider, user_repo, link_type, value = repo if repo else (None,) * 4
+        self.links.append(
+            {
+                "url": url,
+                "original": url if original is None else original,
+                "source": self.source,
+                "extension": extension,
+                "absolute": is_url or is_absolute,
+                "local": not is_url,
+                "provider": provider,
+                "repo": user_repo,
+                "type": link_type,
+                "value": value,
+            }
+        )
+
+
+class LinkInventoryPreprocessor(Preprocessor):
+    """Clear the link inventory before a conversion."""
+
+    def run(self, lines):
+        """Clear the links."""
+
+        self.markdown.link_inventory.clear()
+        return lines
+
+
+def get_link_inventory(md):
+    """Get the link inventory of a Markdown instance, creating it if needed."""
+
+    if "link-inventory" not in md.preprocessors:
+        md.link_inventory = LinkInventory()
+        md.preprocessors.add("link-inventory", LinkInventoryPreprocessor(md), "_begin")
+    return md.link_inventory
+
+
+class Budget:
+    """
+    Resource limits for one document, and a report of the limits it went over.
+
+    A limit of `0` means no limit.  `timeout` is in seconds and is counted
+    from the start of the conversion.  Extensions that go over a limit
+    fall back to plain output, and each limit that was hit is reported
+    once per extension with a count of how often.
+    """
+
+    def __init__(self, limits):
+        """Initialize."""
+
+        self.limits = limits
+        self.report = []
+        self.totals = {}
+        self.start = time.monotonic()
+
+    def reset(self):
+        """Start a new document."""
+
+        self.report = []
+        self.totals = {}
+        self.start = time.monotonic()
+
+    def expired(self):
+        """Check if the document has run out of time."""
+
+        timeout = self.limits.get("timeout", 0)
+        return bool(timeout) and time.monotonic() - self.start > timeout
+
+    def exceeded(self, extension, limit, detail=""):
+        """Report that `extension` went over `limit`."""
+
+        for entry in self.report:
+            if entry["extension"] == extension and entry["limit"] == limit:
+                entry["count"] += 1
+                return
+        self.report.append(
+            {"extension": extension, "limit": limit, "detail": detail, "count": 1}
+        )
+
+    def within(self, extension, limit=None, value=0, detail=""):
+        """
+        Check that `value` is within `limit` and that there is time left.
+
+        Without a `limit`, only the time is checked.
+        """
+
+        if self.expired():
+            self.exceeded(extension, "timeout", detail)
+            return False
+        maximum = self.limits.get(limit, 0) if limit else 0
+        if maximum and value > maximum:
+            self.exceeded(extension, limit, detail)
+            return False
+        return True
+
+    def spend(self, extension, limit, amount=1, detail=""):
+        """Add `amount` to the document's total for `limit` if the total stays within it."""
+
+        total = self.totals.get(limit, 0) + amount
+        if not self.within(extension, limit, total, detail):
+            return False
+        self.totals[limit] = total
+        return True
+
+
+class BudgetPreprocessor(Preprocessor):
+    """Reset the budget before a conversion."""
+
+    def run(self, lines):
+        """Reset the budget."""
+
+        self.markdown.budget.reset()
+        return lines
+
+
+def get_budget(md):
+    """Get the budget of a Markdown instance, or `None` if there is no budget."""
+
+    return getattr(md, "budget", None)
+
+
+class LinePreprocessor(Preprocessor):
+    """
+    Preprocessor that yields the lines it processes one at a time.
+
+    Subclasses override `iter_lines`.  If the Markdown instance has fused
+    lines, neighboring line preprocessors run as one pass over the lines.
+    """
+
+    def iter_lines(self, lines):
+        """
+        Yield the processed lines.
+
+        `lines` can be any iterable, and may be an iterator that is read as the
+        lines are yielded.  By default the lines are passed through as they are.
+        """
+
+        return lines
+
+    def run(self, lines):
+        """Process the lines."""
+
+        fused = get_fused_lines(self.markdown)
+        if fused is not None:
+            return fused.run(self, lines)
+        return list(self.iter_lines(lines))
+
+
+class FusedLines:
+    """
+    Run neighboring line preprocessors as one pass over the lines.
+
+    Each preprocessor reads the lines the one registered before it yields, so
+    the lines are only collected in a list once at the end.  The preprocessors
+    after the first are skipped when their turn comes, as their work is done.
+    """
+
+    def __init__(self, md):
+        """Initialize."""
+
+        self.markdown = md
+        self.skip = set()
+
+    def run(self, preprocessor, lines):
+        """Run `preprocessor` and the line preprocessors right after it."""
+
+        if preprocessor in self.skip:
+            self.skip.discard(preprocessor)
+            return lines
+
+        preprocessors = list(self.markdown.preprocessors.values())
+        if preprocessor not in preprocessors:
+            return list(preprocessor.iter_lines(lines))
+        stages = [preprocessor]
+        for p in preprocessors[preprocessors.index(preprocessor) + 1 :]:
+            if not isinstance(p, LinePreprocessor):
+                break
+            stages.append(p)
+
+        self.skip = set(stages[1:])
+        for stage in stages:
+            lines = stage.iter_lines(lines)
+        return list(lines)
+
+
+def get_fused_lines(md):
+    """Get the fused lines of a Markdown instance, or `None` if lines are not fused."""
+
+    return getattr(md, "fused_lines", None)
+
+
+class Placeholders:
+    """
+    Placeholders left in the output, restored in one pass.
+
+    Each kind of placeholder is added with an expression that finds it and a
+    function that takes the match and returns the text to put back.  Kinds are
+    ordered like Markdown's processors, and text put back for one kind is only
+    searched for the kinds after it, the same as if each kind had its own pass.
+    Expressions can't use global inline flags, and group names must be unique
+    across kinds.
+
+    A kind can also have an `active` function that tells if the current document
+    has any of its placeholders, or `active=False` to only search for it after it
+    is marked with `use`.  Kinds without either are always searched for.  Marks
+    last until the placeholders are restored.
+    """
+
+    def __init__(self):
+        """Initialize."""
+
+        self.kinds = odict.OrderedDict()
+        self.used = set()
+
+    def add(self, name, pattern, restore, location="_end", active=None):
+        """Add a kind of placeholder at `location`, or replace the kind with the same name."""
+
+        kind = (compile_re(pattern), restore, active)
+        if name in self.kinds:
+            self.kinds[name] = kind
+        else:
+            self.kinds.add(name, kind, location)
+
+    def use(self, name):
+        """Mark a kind as used by the current document."""
+
+        self.used.add(name)
+
+    def is_active(self, name, default=True):
+        """Check if the current document has placeholders of a kind, `default` if it can't tell."""
+
+        active = self.kinds[name][2]
+        if name in self.used:
+            return True
+        if active is None:
+            return default
+        return bool(active) and active()
+
+    def active(self):
+        """Get the kinds that the current document has placeholders for."""
+
+        return [kind for name, kind in self.kinds.items() if self.is_active(name)]
+
+    def hidden(self):
+        """
+        Check if the document has placeholders, besides stashed HTML, that can hide markup.
+
+        Kinds that are always searched for are left out, as they are expected to
+        put back plain text.
+        """
+
+        return any(
+            name != "raw_html" and self.is_active(name, False) for name in self.kinds
+        )
+
+    def restore(self, text, kinds=None):
+        """Restore the placeholders of `kinds`, or of all kinds, in order."""
+
+        if kinds is None:
+            kinds = list(self.kinds.values())
+        if not kinds:
+            return text
+        pattern = compile_re(
+            "|".join(
+                "(?P<_kind%d>%s)" % (index, kind[0].pattern)
+                for index, kind in enumerate(kinds)
+            )
+        )
+
+        def restore(m):
+            """Restore one placeholder and the placeholders of later kinds in it."""
+
+            index = int(m.lastgroup[5:])
+            expression, fn = kinds[index][:2]
+            content = fn(expression.match(m.string, m.start(0)))
+            if content is None:
+                return m.group(0)
+            return self.restore(content, kinds[index + 1 :])
+
+        return pattern.sub(restore, text)
+
+
+class RestoredUnescapePostprocessor(UnescapePostprocessor):
+    """Python Markdown's `unescape` pass, when `PlaceholderPostprocessor` restores escapes instead."""
+
+    def run(self, text):
+        """Leave the text as is, as escaped characters have already been restored."""
+
+        return text
+
+
+class PlaceholderPostprocessor(RawHtmlPostprocessor):
+    """
+    Restore all placeholders in one pass.
+
+    Takes the place of Python Markdown's `raw_html` and `unescape` passes,
+    which become the first and last kinds.  The `unescape` pass is left in
+    place, so extensions can still be positioned relative to it, but does
+    nothing.
+    """
+
+    RAW_HTML = r"(<p>)?%s(</p>)?" % (md_util.HTML_PLACEHOLDER % r"([0-9]+)")
+    UNESCAPE = r"%s([0-9]+)%s" % (md_util.STX, md_util.ETX)
+
+    def __init__(self, md):
+        """Initialize."""
+
+        super().__init__(md)
+        self.placeholders = Placeholders()
+        self.placeholders.add(
+            "raw_html",
+            self.RAW_HTML,
+            self.raw_html,
+            active=lambda: self.markdown.htmlStash.html_counter > 0,
+        )
+        if "unescape" in md.postprocessors:
+            md.postprocessors["unescape"] = RestoredUnescapePostprocessor(md)
+            self.placeholders.add("unescape", self.UNESCAPE, self.unescape)
+
+    def raw_html(self, m):
+        """Restore stashed HTML, without the paragraph around it if it is a block."""
+
+        stash = self.markdown.htmlStash
+        index = int(m.group(2))
+        if index >= stash.html_counter:
+            return None
+        html, safe = stash.rawHtmlBlocks[index]
+        safe_mode = self.markdown.safeMode
+        if safe_mode and not safe:
+            if str(safe_mode).lower() == "escape":
+                html = self.escape(html)
+            elif str(safe_mode).lower() == "remove":
+                html = ""
+            else:
+                html = self.markdown.html_replacement_text
+        if (
+            m.group(1)
+            and m.group(3)
+            and self.isblocklevel(html)
+            and (safe or not safe_mode)
+        ):
+            return html + "\n"
+        return (m.group(1) or "") + html + (m.group(3) or "")
+
+    def unescape(self, m):
+        """Restore an escaped character."""
+
+        return md_util.int2str(int(m.group(1)))
+
+    def run(self, text):
+        """Restore the placeholders the document has, if any."""
+
+        kinds = self.placeholders.active()
+        self.placeholders.used.clear()
+        if (
+            self.markdown.safeMode
+            and kinds
+            and kinds[0] is self.placeholders.kinds["raw_html"]
+        ):
+            # HTML that safe mode removes can leave the placeholders around it
+            # on their own in a paragraph, so it gets a pass of its own first.
+            text = self.placeholders.restore(text, kinds[:1])
+            kinds = kinds[1:]
+        return self.placeholders.restore(text, kinds)
+
+
+def get_placeholders(md):
+    """Get the placeholders of a Markdown instance, taking over its restore passes if needed."""
+
+    post = md.postprocessors["raw_html"]
+    if not isinstance(post, PlaceholderPostprocessor):
+        post = md.postprocessors["raw_html"] = PlaceholderPostprocessor(md)
+    return post.placeholders
+
+
+class ActivityTreeprocessor(Treeprocessor):
+    """
+    Tell a postprocessor if the document has anything for it to do.
+
+    The postprocessor's `check` is called with the finished tree, and the result
+    is set as its `active` so it can skip its pass over the output.  This has to
+    run after the other tree processors, so extensions link it to the end again
+    when they are reset.
+    """
+
+    def __init__(self, md, post):
+        """Initialize."""
+
+        super().__init__(md)
+        self.post = post
+
+    def run(self, root):
+        """Check the tree."""
+
+        self.post.active = self.post.check(root)
+
+
+def has_links(root, tags):
+    """Check if the tree has an element of one of `tags` with a `src` or `href`."""
+
+    for tag in tags:
+        for el in root.iter(tag):
+            if "src" in el.attrib or "href" in el.attrib:
+                return True
+    return False
+
+
+def has_stashed(md, pattern):
+    """
+    Check if HTML put back after the tree is serialized can match `pattern`.
+
+    Besides the HTML stash, placeholders like escapes and critic marks can hide
+    markup, so a document with them always counts.
+    """
+
+    stash = md.htmlStash
+    for index in range(stash.html_counter):
+        if pattern.search(stash.rawHtmlBlocks[index][0]):
+            return True
+    post = md.postprocessors["raw_html"] if "raw_html" in md.postprocessors else None
+    return isinstance(post, PlaceholderPostprocessor) and post.placeholders.hidden()
+
+
 class PymdownxDeprecationWarning(UserWarning):
     """Deprecation warning for Pymdownx that is not hidden."""
@@ -0,0 +1,382 @@
+"""Test performance budgets."""
+
+import codecs
+import math
+import os
+import subprocess
+import sys
+import time
+import unittest
+
+import markdown
+import pytest
+from pymdownx import highlight
+
+from . import test_syntax
+
+CURRENT_DIR = os.path.abspath(os.path.dirname(__file__))
+ROOT_DIR = os.path.dirname(CURRENT_DIR)
+
+
+def import_times(code):
+    """
+    Run code in a fresh interpreter with `-X importtime`.
+
+    Return a dictionary of imported module names and their self time in microseconds.
+    """
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT_DIR,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_time, _, name = line[len("import time:") :].split("|")
+        if self_time.strip().isdigit():
+            times[name.strip()] = int(self_time)
+    return times
+
+
+class TestImportTime(unittest.TestCase):
+    """Test that loading extensions stays cheap until a feature is actually used."""
+
+    # Budget for all imports (including Python Markdown) in seconds.
+    # It is deliberately generous; the module checks below are what catch regressions.
+    BUDGET = 0.5
+
+    EXTENSIONS = ["pymdownx.extra", "pymdownx.github"]
+
+    def convert(self, source):
+        """Return the code to import and run Markdown with our extensions."""
+
+        return "import markdown; markdown.Markdown(extensions={!r}).convert({!r})".format(
+            self.EXTENSIONS, source
+        )
+
+    def test_plain_document(self):
+        """Test that a plain document does not load Pygments or emoji databases."""
+
+        times = import_times(self.convert("Some *plain* text."))
+
+        self.assertNotIn("pygments", times)
+        self.assertNotIn("markdown.extensions.codehilite", times)
+        self.assertNotIn("urllib.request", times)
+        for name in times:
+            self.assertFalse(name.endswith("_db") and name != "pymdownx.keymap_db", name)
+        self.assertLess(sum(times.values()) / 1000000.0, self.BUDGET)
+
+    def test_features_load_on_use(self):
+        """Test that the deferred imports happen when the features are used."""
+
+        times = import_times(self.convert(":smile:\n\n```python\nimport os\n```\n"))
+
+        self.assertIn("pygments", times)
+        self.assertIn("pymdownx.gemoji_db", times)
+
+
+class TestInlineScaling(unittest.TestCase):
+    """Test that inline processing scales linearly on one large paragraph."""
+
+    EXTENSIONS = [
+        "pymdownx.arithmatex",
+        "pymdownx.betterem",
+        "pymdownx.caret",
+        "pymdownx.emoji",
+        "pymdownx.escapeall",
+        "pymdownx.inlinehilite",
+        "pymdownx.keys",
+        "pymdownx.magiclink",
+        "pymdownx.mark",
+        "pymdownx.progressbar",
+        "pymdownx.smartsymbols",
+        "pymdownx.tilde",
+    ]
+
+    UNIT = ("Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 144) + (
+        ":smile: https://example.com/path (tm) 1/2 \\* `code` ++ctrl+a++ "
+        "~~del~~ H~2~O ^^ins^^ x^2^ ==mark== **strong** *em* $x$ [== 50%] "
+    )
+
+    def convert(self, size):
+        """Convert one paragraph of about `size` characters and return how long it took."""
+
+        source = self.UNIT * (size // len(self.UNIT))
+        md = markdown.Markdown(extensions=self.EXTENSIONS)
+        start = time.perf_counter()
+        md.convert(source)
+        return time.perf_counter() - start
+
+    def test_one_megabyte_paragraph(self):
+        """Test that four times the text takes about four times as long, not sixteen."""
+
+        small = self.convert(2 ** 18)
+        large = self.convert(2 ** 20)
+        self.assertLess(large / small, 8.0)
+
+
+class TestBlockPrefilter(unittest.TestCase):
+    """Test that block processors reject prose before running their expressions."""
+
+    EXTENSIONS = ["pymdownx.arithmatex", "pymdownx.details", "pymdownx.superfences"]
+
+    BLOCKS = [
+        ("Lorem ipsum dolor sit amet, consectetur adipiscing elit %d. " % i) * 30
+        for i in range(500)
+    ]
+
+    def time(self, fn):
+        """Return how long it takes to call `fn` on every block."""
+
+        start = time.perf_counter()
+        for block in self.BLOCKS:
+            fn(block)
+        return time.perf_counter() - start
+
+    def test_prose_blocks(self):
+        """Test that testing prose blocks is cheaper than matching them."""
+
+        md = markdown.Markdown(extensions=self.EXTENSIONS)
+        processors = md.parser.blockprocessors
+        parent = markdown.util.etree.Element("div")
+
+        prefiltered = matched = 0
+        for name, regex in (
+            ("details", processors["details"].START.search),
+            ("arithmatex-block", processors["arithmatex-block"].pattern.match),
+            ("code", lambda block: True),
+        ):
+            processor = processors[name]
+            prefiltered += self.time(lambda block: processor.test(parent, block))
+            matched += self.time(regex)
+        self.assertLess(prefiltered, matched / 2)
+
+
+class TestManyFences(unittest.TestCase):
+    """Test that finding fences scales linearly with the number of fences."""
+
+    def convert(self, count):
+        """Run the line preprocessors over `count` fences and return the best time."""
+
+        md = markdown.Markdown(
+            extensions=[
+                "pymdownx.critic",
+                "pymdownx.fusedlines",
+                "pymdownx.superfences",
+            ],
+            extension_configs={"pymdownx.superfences": {"highlight_code": False}},
+        )
+        lines = ("Text.\n\n```\ncode\n```\n\n" * count).split("\n")
+        best = None
+        for _ in range(3):
+            md.reset()
+            start = time.perf_counter()
+            md.preprocessors["critic"].run(lines)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    def test_many_fences(self):
+        """Test that four times the fences take about four times as long, not sixteen."""
+
+        small = self.convert(2000)
+        large = self.convert(8000)
+        self.assertLess(large / small, 8.0)
+
+
+class TestCompactHighlight(unittest.TestCase):
+    """Test that compact highlighting makes less markup without taking longer."""
+
+    SOURCE = os.path.join(ROOT_DIR, "pymdownx", "superfences.py")
+
+    def highlight(self, **options):
+        """Highlight the source and return the best time of three and the output."""
+
+        with codecs.open(self.SOURCE, "r", encoding="utf-8") as f:
+            source = f.read()
+        highlighter = highlight.Highlight(guess_lang=False, **options)
+        best = None
+        for _ in range(3):
+            start = time.perf_counter()
+            html = highlighter.highlight(source, "python")
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, html
+
+    def test_compact_output(self):
+        """Test that compact output has fewer bytes and takes no longer to serialize."""
+
+        for noclasses in (False, True):
+            normal_time, normal = self.highlight(noclasses=noclasses)
+            compact_time, compact = self.highlight(noclasses=noclasses, compact=True)
+            self.assertLess(
+                len(compact.encode("utf-8")), len(normal.encode("utf-8")), noclasses
+            )
+            self.assertLess(compact_time, normal_time * 1.5, noclasses)
+
+
+class TestAdversarialInput(unittest.TestCase):
+    """Test that runs of delimiters and openers that are never closed scale linearly."""
+
+    CASES = [
+        ("pymdownx.betterem", ["*", "_", "**a ", "__a ", "***a ", "___a "]),
+        (("pymdownx.betterem", {"smart_enable": "none"}), ["_a", "**a ", "__a "]),
+        ("pymdownx.caret", ["^", "^^a ", "^^^a "]),
+        ("pymdownx.tilde", ["~", "~~a ", "~~~a "]),
+        ("pymdownx.mark", ["=", "==a ", "===a "]),
+        ("pymdownx.critic", ["{++a", "{--a~>", "{~~a~>", "{>>a", "{==a"]),
+        ("pymdownx.magiclink", ["a.", "a@", "www.", "http://a."]),
+    ]
+
+    def convert(self, extension, unit, size):
+        """Convert `unit` repeated to about `size` characters and return the best time."""
+
+        if isinstance(extension, tuple):
+            extension, config = extension
+        else:
+            config = {}
+        md = markdown.Markdown(
+            extensions=[extension], extension_configs={extension: config}
+        )
+        source = unit * (size // len(unit))
+        best = None
+        for _ in range(3):
+            start = time.perf_counter()
+            md.convert(source)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    def test_unclosed_delimiters(self):
+        """Test that four times the input takes about four times as long, not sixteen."""
+
+        for extension, units in self.CASES:
+            for unit in units:
+                small = self.convert(extension, unit, 2 ** 12)
+                large = self.convert(extension, unit, 2 ** 14)
+                self.assertLess(large / small, 8.0, "%r: %r" % (extension, unit))
+
+
+# Syntax tests that grow faster than linearly because of Python Markdown itself.
+# Repeating a document repeats its header ids, and the table of contents counts
+# up from `_1` for every duplicate.
+SCALING_KNOWN = {
+    "slugs/gfm (encoded).txt": "toc: duplicate ids",
+    "slugs/gfm.txt": "toc: duplicate ids",
+    "slugs/uslugify (cased-encoded).txt": "toc: duplicate ids",
+    "slugs/uslugify (cased).txt": "toc: duplicate ids",
+    "slugs/uslugify (encoded).txt": "toc: duplicate ids",
+    "slugs/uslugify.txt": "toc: duplicate ids",
+}
+
+
+def scaling_params():
+    """Gather the syntax tests to render at growing sizes."""
+
+    base = os.path.join(CURRENT_DIR, "extensions")
+    for cfg, testfile in test_syntax.gather_test_params():
+        if not testfile.endswith(".txt"):
+            continue
+        name = os.path.relpath(testfile, base).replace(os.sep, "/")
+        marks = ()
+        if name in SCALING_KNOWN:
+            marks = pytest.mark.xfail(reason=SCALING_KNOWN[name], strict=False)
+        yield pytest.param(cfg, testfile, id=name, marks=marks)
+
+
+def growth(sizes, times):
+    """Return the exponent `k` of the least squares fit of `times` to `c * sizes ** k`."""
+
+    xs = [math.log(size) for size in sizes]
+    ys = [math.log(t) for t in times]
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / sum(
+        (x - mean_x) ** 2 for x in xs
+    )
+
+
+class FixtureScaling:
+    """Render one syntax test replicated to growing sizes."""
+
+    # Characters of source in the smallest document.  Small tests are repeated
+    # up to it; larger ones are cut at the first line after it.
+    SIZE = 2048
+
+    MULTIPLES = (1, 2, 4, 8)
+
+    # Linear growth fits an exponent near 1 and quadratic growth one near 2.
+    LIMIT = 1.5
+
+    def __init__(self, cfg, testfile):
+        """Initialize."""
+
+        extensions = []
+        extension_configs = {}
+        for k, v in cfg["extensions"].items():
+            extensions.append(k)
+            if v:
+                extension_configs[k] = v
+        self.md = markdown.Markdown(
+            extensions=extensions, extension_configs=extension_configs
+        )
+
+        with codecs.open(testfile, "r", encoding="utf-8") as f:
+            source = f.read()
+        unit = []
+        length = 0
+        for line in source.splitlines(True):
+            unit.append(line)
+            length += len(line)
+            if length >= self.SIZE:
+                break
+        self.unit = "".join(unit).rstrip("\n")
+        self.copies = max(1, -(-self.SIZE // len(self.unit)))
+
+    def time(self, text):
+        """Return the best time of three conversions of `text`."""
+
+        best = None
+        for _ in range(3):
+            self.md.reset()
+            start = time.perf_counter()
+            self.md.convert(text)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    def growth(self):
+        """Return the growth exponent of the conversion time."""
+
+        # Load lexers, emoji indexes, and such before timing anything.
+        self.md.convert(self.unit)
+        sizes = []
+        times = []
+        for multiple in self.MULTIPLES:
+            text = "\n\n".join([self.unit] * (self.copies * multiple))
+            sizes.append(len(text))
+            times.append(self.time(text))
+        return growth(sizes, times)
+
+
+@pytest.mark.parametrize("cfg, testfile", list(scaling_params()))
+def test_fixture_scaling(cfg, testfile):
+    """Test that each syntax test takes about linear time as it is repeated."""
+
+    scaling = FixtureScaling(cfg, testfile)
+    k = scaling.growth()
+    if k >= scaling.LIMIT:
+        # Measure again before failing so a busy machine doesn't fail the test.
+        k = min(k, scaling.growth())
+    assert k < FixtureScaling.LIMIT, "grew as size ** %.2f" % k
+
+
+def run():
+    """Run pytest."""
+
+    pytest.main(["tests/test_performance.py", "-p", "no:pytest_cov"])
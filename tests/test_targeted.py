@@ -1,9 +1,30 @@
 """Test uniprops."""
 
+import codecs
+import glob
+import os
+import re
+import sys
+import tempfile
+import threading
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 
+import markdown
 import pytest
-from pymdownx import util
+from pymdownx import (
+    arithmatex,
+    critic,
+    details,
+    highlight,
+    magiclink,
+    snippets,
+    superfences,
+    tasklist,
+    util,
+)
+
+CURRENT_DIR = os.path.abspath(os.path.dirname(__file__))
 
 
 class TestUrlParse(unittest.TestCase):
@@ -167,6 +188,1032 @@ class TestUrlParse(unittest.TestCase):
         self.assertEqual(is_absolute, False)
 
 
+class TestThreadSafety(unittest.TestCase):
+    """Test that extension objects can be shared by Markdown instances in different threads."""
+
+    FIXTURES = ("superfences", "critic", "arithmatex", "details", "tasklist", "snippets")
+
+    def setUp(self):
+        """Setup shared extensions and sources."""
+
+        self.extensions = [
+            superfences.SuperFencesCodeExtension(),
+            arithmatex.ArithmatexExtension(),
+            details.DetailsExtension(),
+            tasklist.TasklistExtension(),
+            snippets.SnippetExtension(
+                base_path=os.path.join(CURRENT_DIR, "extensions", "_snippets")
+            ),
+            critic.CriticExtension(),
+        ]
+        self.sources = []
+        for name in self.FIXTURES:
+            pattern = os.path.join(CURRENT_DIR, "extensions", name, "*.txt")
+            for file_name in sorted(glob.glob(pattern)):
+                with codecs.open(file_name, "r", encoding="utf-8") as f:
+                    self.sources.append(f.read())
+        self.local = threading.local()
+
+    def convert(self, source):
+        """Convert with a Markdown instance owned by the current thread."""
+
+        md = getattr(self.local, "md", None)
+        if md is None:
+            md = self.local.md = markdown.Markdown(extensions=self.extensions)
+        html = md.convert(source)
+        md.reset()
+        return html
+
+    def test_parallel_matches_serial(self):
+        """Test that parallel rendering gives the same output as serial rendering."""
+
+        serial = [self.convert(source) for source in self.sources]
+
+        jobs = self.sources * 20
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            parallel = list(executor.map(self.convert, jobs))
+
+        self.assertEqual(parallel, serial * 20)
+
+
+class TestRegexRegistry(unittest.TestCase):
+    """Test the process wide regular expression registry."""
+
+    EXTENSIONS = ["pymdownx.github", "pymdownx.extra", "pymdownx.superfences"]
+
+    def test_compile_once(self):
+        """Test that configuring more Markdown instances compiles nothing new."""
+
+        markdown.Markdown(extensions=self.EXTENSIONS).convert("```\ncode\n```\n")
+        compiles = util.REGEX.stats()["compiles"]
+
+        for _ in range(5):
+            markdown.Markdown(extensions=self.EXTENSIONS).convert("```\ncode\n```\n")
+
+        stats = util.REGEX.stats()
+        self.assertEqual(stats["compiles"], compiles)
+        self.assertEqual(stats["patterns"], compiles)
+
+    def test_fences(self):
+        """Test that the expressions for each document's fences aren't registered."""
+
+        md = markdown.Markdown(extensions=["pymdownx.superfences"])
+        md.convert("```\ncode\n```\n")
+        patterns = len(util.REGEX)
+        for size in range(4, 20):
+            md.reset()
+            md.convert("%s\ncode\n%s\n\n> %s\n> code\n> %s\n" % (("`" * size,) * 4))
+        self.assertEqual(len(util.REGEX), patterns)
+
+    def test_global_flags(self):
+        """Test that leading global flags are moved to the front of legacy patterns."""
+
+        pattern = util.compile_legacy_pattern(r"(?x)a  b  # comment")
+        self.assertTrue(pattern.pattern.startswith("(?x)^(.*?)"))
+        m = pattern.match("xxabyy")
+        self.assertEqual(m.group(1), "xx")
+        self.assertEqual(m.group(2), "yy")
+        self.assertIs(pattern, util.compile_legacy_pattern(r"(?x)a  b  # comment"))
+
+
+class TestEmojiScanner(unittest.TestCase):
+    """Test that emoji shortnames are found in one pass over the text."""
+
+    def test_resume(self):
+        """Test that searching resumes after the last replacement."""
+
+        md = markdown.Markdown(extensions=["pymdownx.emoji"])
+        pattern = md.inlinePatterns["emoji"]
+        data = "the time is 12:30:45 :smile: and :+1:"
+
+        m = pattern.match(data)
+        self.assertEqual(m.group(1), "the time is 12")
+        self.assertEqual(m.groups()[-1], "45 :smile: and :+1:")
+
+        data = m.group(1) + markdown.util.INLINE_PLACEHOLDER % "0000" + m.groups()[-1]
+        self.assertEqual(pattern.get_start(data), len(m.group(1)) - pattern.margin)
+
+        m = pattern.match("unrelated :smile:")
+        self.assertEqual(pattern.get_start("other :smile:"), 0)
+
+    def test_colons(self):
+        """Test text with a lot of colons that aren't emoji."""
+
+        self.assertEqual(
+            markdown.markdown(
+                "12:30:45 :not_emoji: a:b:c :+1:",
+                extensions=["pymdownx.emoji"],
+                extension_configs={"pymdownx.emoji": {"alt": "short"}},
+            ),
+            '<p>12:30:45 :not_emoji: a<img alt=":b:" class="emojione" '
+            'src="https://cdn.jsdelivr.net/emojione/assets/3.0/png/64/1f171.png" title=":b:" />c '
+            '<img alt=":+1:" class="emojione" '
+            'src="https://cdn.jsdelivr.net/emojione/assets/3.0/png/64/1f44d.png" title=":+1:" /></p>',
+        )
+
+    def test_same_as_rescan(self):
+        """Test that resuming gives the same output as searching from the start."""
+
+        md = markdown.Markdown(extensions=["pymdownx.emoji", "pymdownx.betterem"])
+        rescan = markdown.Markdown(extensions=["pymdownx.emoji", "pymdownx.betterem"])
+        # A margin longer than any text searches from the start every time.
+        rescan.inlinePatterns["emoji"].margin = 10 ** 6
+
+        for source in (
+            ":smile::smile:",
+            ":a:smile:b:",
+            ":::smile:::+1:::",
+            "`:`smile:`:`",
+            ":smile:`x`:+1:",
+            "*:smile:* :+1: **:a:b:**",
+            "\\:smile:\\:+1:",
+        ):
+            md.reset()
+            rescan.reset()
+            self.assertEqual(md.convert(source), rescan.convert(source), source)
+
+
+class TestEmojiUnicode(unittest.TestCase):
+    """Test converting literal Unicode emoji."""
+
+    def test_text_presentation(self):
+        """Test that characters shown as text by default need variation selector 16."""
+
+        md = markdown.Markdown(
+            extensions=["pymdownx.emoji"],
+            extension_configs={
+                "pymdownx.emoji": {"parse_unicode": True, "alt": "short"}
+            },
+        )
+        for char, name in (("\u2122", ":tm:"), ("\u2764", ":heart:")):
+            self.assertEqual(md.convert(char), "<p>%s</p>" % char)
+            self.assertIn('alt="%s"' % name, md.convert(char + "\ufe0f"))
+
+        # Characters shown as emoji by default don't need it.
+        self.assertIn('alt=":watch:"', md.convert("\u231a"))
+
+
+class TestMagiclinkScanner(unittest.TestCase):
+    """Test that URLs and emails are found in one scan."""
+
+    def test_overlap(self):
+        """Test that a URL wins over an email that overlaps it."""
+
+        md = markdown.Markdown(extensions=["pymdownx.magiclink"])
+        self.assertEqual(
+            md.convert("see me@www.example.com and http://example.com/a@b.com"),
+            '<p>see me@<a href="http://www.example.com">www.example.com</a> and '
+            '<a href="http://example.com/a@b.com">http://example.com/a@b.com</a></p>',
+        )
+
+    def test_no_anchor(self):
+        """Test that text without an anchor is left alone."""
+
+        md = markdown.Markdown(extensions=["pymdownx.magiclink"])
+        pattern = md.inlinePatterns["magic-link"]
+        self.assertIsNone(pattern.search("example.com and me at example dot com", 0))
+
+
+class TestMagiclinkShortener(unittest.TestCase):
+    """Test shortening repository links."""
+
+    def test_case(self):
+        """Test that the scheme and host of a repository link are not case sensitive."""
+
+        md = markdown.Markdown(
+            extensions=["pymdownx.magiclink"],
+            extension_configs={"pymdownx.magiclink": {"repo_url_shortener": True}},
+        )
+        for url in (
+            "HTTPS://GitHub.com/user/repo/issues/1",
+            "https://WWW.GITHUB.COM/user/repo/issues/1",
+        ):
+            md.reset()
+            self.assertEqual(
+                md.convert(url), '<p><a href="%s">user/repo#1</a></p>' % url
+            )
+        self.assertEqual(
+            magiclink.get_repo_link("https://GitLab.com/user/repo/merge_requests/2"),
+            ("gitlab", "user/repo", "pull", "2"),
+        )
+
+
+class TestLinkInventory(unittest.TestCase):
+    """Test the link inventory."""
+
+    def test_inventory(self):
+        """Test that MagicLink and PathConverter record their links."""
+
+        md = markdown.Markdown(
+            extensions=["pymdownx.magiclink", "pymdownx.pathconverter"],
+            extension_configs={
+                "pymdownx.magiclink": {"link_inventory": True},
+                "pymdownx.pathconverter": {
+                    "link_inventory": True,
+                    "base_path": "/docs/src",
+                    "relative_path": "/docs/site",
+                },
+            },
+        )
+        md.link_inventory.source = "page.md"
+        md.convert(
+            "https://github.com/user/repo/commit/6a09fde5 me@example.com [file](img/a.png)"
+        )
+
+        links = list(md.link_inventory)
+        self.assertEqual(
+            [(link["extension"], link["url"], link["local"]) for link in links],
+            [
+                ("magiclink", "https://github.com/user/repo/commit/6a09fde5", False),
+                ("magiclink", "mailto:me@example.com", False),
+                ("pathconverter", "../src/img/a.png", True),
+            ],
+        )
+        self.assertEqual(
+            (
+                links[0]["provider"],
+                links[0]["repo"],
+                links[0]["type"],
+                links[0]["value"],
+            ),
+            ("github", "user/repo", "commit", "6a09fde5"),
+        )
+        self.assertEqual(links[2]["original"], "img/a.png")
+        self.assertTrue(all(link["source"] == "page.md" for link in links))
+
+        md.convert("no links")
+        self.assertEqual(len(md.link_inventory), 0)
+
+
+class TestTaskStats(unittest.TestCase):
+    """Test tasklist statistics."""
+
+    def test_stats(self):
+        """Test that tasks are counted per document."""
+
+        md = markdown.Markdown(extensions=["pymdownx.tasklist"])
+        md.convert("- [x] done *now*\n- [ ] todo\n    1. [X] nested\n- plain")
+        self.assertEqual(
+            md.task_stats,
+            {
+                "total": 3,
+                "checked": 2,
+                "unchecked": 1,
+                "tasks": [
+                    {"checked": True, "text": "done now"},
+                    {"checked": False, "text": "todo"},
+                    {"checked": True, "text": "nested"},
+                ],
+            },
+        )
+
+        # A list nested in the middle of another comes before the items after it.
+        md.reset()
+        md.convert(
+            "- [ ] one\n- [ ] two\n    - [x] two a\n    - [x] two b\n- [ ] three"
+        )
+        self.assertEqual(
+            [task["text"] for task in md.task_stats["tasks"]],
+            ["one", "two", "two a", "two b", "three"],
+        )
+
+        md.reset()
+        md.convert("no tasks")
+        self.assertEqual(md.task_stats["total"], 0)
+
+
+class TestDetailsFragments(unittest.TestCase):
+    """Test deferred rendering of collapsed details."""
+
+    SOURCE = (
+        '??? faq "Question"\n'
+        "    Answer *one*.\n\n"
+        "    More answer.\n\n"
+        '    ??? "Nested"\n'
+        "        Inner.\n\n"
+        '???+ note "Open"\n'
+        "    Stays.\n"
+    )
+
+    def test_fragments(self):
+        """Test that collapsed bodies are moved to fragments and cached."""
+
+        md = markdown.Markdown(
+            extensions=["pymdownx.details"],
+            extension_configs={"pymdownx.details": {"defer_collapsed": True}},
+        )
+        html = md.convert(self.SOURCE)
+        fragments = md.details_fragments
+        self.assertEqual(len(fragments), 2)
+        key = html.split('data-details-fragment="')[1].split('"')[0]
+        self.assertEqual(
+            html,
+            '<details class="faq" data-details-fragment="%s"><summary>Question</summary></details>'
+            '<details class="note" open="open"><summary>Open</summary><p>Stays.</p></details>'
+            % key,
+        )
+        self.assertTrue(
+            fragments[key].startswith("<p>Answer <em>one</em>.</p><p>More answer.</p>")
+        )
+
+        # The second conversion is served from the cache, nested fragments included.
+        md.reset()
+        self.assertEqual(md.convert(self.SOURCE), html)
+        self.assertEqual(md.details_fragments, fragments)
+
+    def test_context(self):
+        """Test that a body isn't served from the cache when its references change."""
+
+        md = markdown.Markdown(
+            extensions=["pymdownx.details", "markdown.extensions.footnotes"],
+            extension_configs={"pymdownx.details": {"defer_collapsed": True}},
+        )
+        for url in ("http://one", "http://two"):
+            md.reset()
+            md.convert('??? "Links"\n    [a][r]\n\n[r]: %s\n' % url)
+            self.assertEqual(
+                list(md.details_fragments.values()),
+                ['<p><a href="%s">a</a></p>' % url],
+            )
+
+        # References to footnotes are numbered as they are found, so they aren't cached.
+        cache = md.treeprocessors["details-fragments"].fragments.cache
+        size = len(cache)
+        md.reset()
+        md.convert('??? "A"\n    x[^1]\n\n??? "B"\n    x[^1]\n\n[^1]: Note.\n')
+        self.assertEqual(len(md.details_fragments), 2)
+        self.assertIn('id="fnref2:1"', "".join(md.details_fragments.values()))
+        self.assertEqual(len(cache), size)
+
+    def test_toc(self):
+        """Test that headings in a body are in the table of contents of every conversion."""
+
+        md = markdown.Markdown(
+            extensions=["pymdownx.details", "markdown.extensions.toc"],
+            extension_configs={"pymdownx.details": {"defer_collapsed": True}},
+        )
+        source = '# Title\n\n??? "More"\n    ## Title\n\n    Text.\n\n??? "Plain"\n    Text.\n'
+        for _ in range(2):
+            md.reset()
+            md.convert(source)
+            self.assertIn('href="#title_1"', md.toc)
+            self.assertIn('id="title_1"', "".join(md.details_fragments.values()))
+
+        # Only the body without headings is cached.
+        cache = md.treeprocessors["details-fragments"].fragments.cache
+        self.assertEqual(list(cache.values()), ["<p>Text.</p>"])
+
+    def test_cache_size(self):
+        """Test that the least recently used fragments are dropped."""
+
+        md = markdown.Markdown(
+            extensions=["pymdownx.details"],
+            extension_configs={
+                "pymdownx.details": {"defer_collapsed": True, "cache_size": 3}
+            },
+        )
+        fragments = md.treeprocessors["details-fragments"].fragments
+        html = md.convert(self.SOURCE)
+        keys = set(md.details_fragments)
+        for source in ('??? "A"\n    a\n', '??? "B"\n    b\n'):
+            md.reset()
+            md.convert(source)
+        self.assertEqual(len(fragments.cache), 3)
+
+        # The outer body is still cached, but the one nested in it isn't.
+        self.assertEqual(len(keys & set(fragments.cache)), 1)
+        md.reset()
+        self.assertEqual(md.convert(self.SOURCE), html)
+        self.assertEqual(len(md.details_fragments), 2)
+        self.assertIn("Inner.", "".join(md.details_fragments.values()))
+
+    def test_order(self):
+        """Test that fragments are extracted after other postprocessors, whatever the order."""
+
+        for extensions in (
+            ["pymdownx.details", "pymdownx.pathconverter"],
+            ["pymdownx.pathconverter", "pymdownx.details"],
+        ):
+            md = markdown.Markdown(
+                extensions=extensions,
+                extension_configs={
+                    "pymdownx.details": {"defer_collapsed": True},
+                    "pymdownx.pathconverter": {
+                        "base_path": "/project/src",
+                        "relative_path": "/project/docs",
+                    },
+                },
+            )
+            md.convert('??? "Image"\n    ![a](img/a.png)\n')
+            self.assertEqual(
+                list(md.details_fragments.values()),
+                ['<p><img alt="a" src="../src/img/a.png" /></p>'],
+            )
+
+
+class TestOversizedFences(unittest.TestCase):
+    """Test oversized fences."""
+
+    SOURCE = "```\n" + "\n".join("line %d" % i for i in range(10)) + "\n```\n"
+
+    def convert(self, **config):
+        """Convert the source and return the Markdown instance and output."""
+
+        config["highlight_code"] = False
+        md = markdown.Markdown(
+            extensions=["pymdownx.superfences"],
+            extension_configs={"pymdownx.superfences": config},
+        )
+        return md, md.convert(self.SOURCE)
+
+    def test_truncate(self):
+        """Test that the rest of an oversized fence is returned as a fragment."""
+
+        md, html = self.convert(max_lines=3)
+        key = list(md.superfences_fragments)[0]
+        self.assertEqual(
+            html,
+            "<pre><code>line 0\nline 1\nline 2</code></pre>\n"
+            '<div class="highlight-more" data-superfences-fragment="%s">7 more lines</div>'
+            % key,
+        )
+        self.assertTrue(
+            md.superfences_fragments[key].endswith("line 8\nline 9</code></pre>")
+        )
+
+        md, html = self.convert(max_bytes=1000)
+        self.assertEqual(md.superfences_fragments, {})
+
+    def test_file(self):
+        """Test that an oversized fence is written to a file."""
+
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp, tempfile.TemporaryDirectory() as work:
+            os.chdir(work)
+            try:
+                md, html = self.convert(
+                    max_bytes=14,
+                    oversized="file",
+                    oversized_dir=tmp,
+                    oversized_url="code",
+                )
+            finally:
+                os.chdir(cwd)
+            # Only the finished file is left in the directory.
+            (name,) = os.listdir(tmp)
+            self.assertIn('<a href="code/%s">8 more lines</a>' % name, html)
+            with open(os.path.join(tmp, name), encoding="utf-8") as f:
+                self.assertIn("line 9", f.read())
+            self.assertEqual(os.listdir(work), [])
+
+    def test_key(self):
+        """Test that the fence options and highlight settings are part of the name."""
+
+        keys = set()
+        for source, config in (
+            (self.SOURCE, {}),
+            (self.SOURCE.replace("```\n", '``` hl_lines="2"\n', 1), {}),
+            (self.SOURCE, {"css_class": "code"}),
+            (self.SOURCE, {"highlight_code": False}),
+        ):
+            config["max_lines"] = 3
+            md = markdown.Markdown(
+                extensions=["pymdownx.superfences"],
+                extension_configs={"pymdownx.superfences": config},
+            )
+            md.convert(source)
+            keys.update(md.superfences_fragments)
+        self.assertEqual(len(keys), 4)
+
+    def test_file_no_dir(self):
+        """Test that file mode needs a directory to write to."""
+
+        with self.assertRaises(ValueError):
+            self.convert(max_bytes=14, oversized="file")
+
+    def test_unknown_mode(self):
+        """Test that an unknown mode is rejected."""
+
+        with self.assertRaises(ValueError):
+            self.convert(max_bytes=14, oversized="files")
+
+
+class TestFencedBlockExtraction(unittest.TestCase):
+    """Test finding fenced blocks without rendering."""
+
+    def test_blocks(self):
+        """Test that top level and nested blocks are found."""
+
+        source = (
+            'Text\n\n```python hl_lines="1" linenums="3"\nprint(1)\n```\n\n'
+            "- item\n\n\t~~~js\n\tvar x;\n\t~~~\n\n"
+            "> quote\n> ```\n> q\n>\n> ```\n"
+        )
+        self.assertEqual(
+            list(superfences.iter_fenced_blocks(source)),
+            [
+                {
+                    "lang": "python",
+                    "options": {"hl_lines": [1], "linestart": 3},
+                    "source": "print(1)",
+                    "start": 2,
+                    "end": 5,
+                    "indent": "",
+                },
+                {
+                    "lang": "js",
+                    "options": {},
+                    "source": "var x;",
+                    "start": 8,
+                    "end": 11,
+                    "indent": "    ",
+                },
+                {
+                    "lang": "",
+                    "options": {},
+                    "source": "q\n",
+                    "start": 13,
+                    "end": 17,
+                    "indent": "> ",
+                },
+            ],
+        )
+
+    def test_lazy(self):
+        """Test that each block is yielded as soon as it is closed."""
+
+        lines = iter(["```", "a", "```", "", "```", "b", "```"])
+        blocks = superfences.FencedBlockScanner().scan(lines)
+        self.assertEqual(next(blocks)["source"], "a")
+        self.assertEqual(list(lines), ["", "```", "b", "```"])
+
+
+class TestCodeStash(unittest.TestCase):
+    """Test the SuperFences code stash."""
+
+    def test_lines(self):
+        """Test that the original code is rebuilt from the stored lines."""
+
+        lines = ["```python", "x = 1", "", "```"]
+        stash = superfences.CodeStash()
+        stash.store("0", lines, 4)
+        self.assertEqual(stash.get("0"), ("```python\nx = 1\n\n```", 4))
+        self.assertIsNone(stash.get("1"))
+
+    def test_revert(self):
+        """Test that a fence in an indented code block is restored."""
+
+        self.assertEqual(
+            markdown.markdown(
+                "Text\n\n    code\n    ```python\n    x = 1\n    ```\n",
+                extensions=["pymdownx.superfences"],
+            ),
+            "<p>Text</p>\n<pre><code>code\n```python\nx = 1\n```\n</code></pre>",
+        )
+
+
+class TestHighlightTreeprocessor(unittest.TestCase):
+    """Test highlighting of indented code blocks."""
+
+    def convert(self, source, **config):
+        """Convert with highlighting for a JavaScript highlighter."""
+
+        config["use_pygments"] = False
+        return markdown.markdown(
+            source,
+            extensions=["pymdownx.highlight"],
+            extension_configs={"pymdownx.highlight": config},
+        )
+
+    def test_shebang(self):
+        """Test that a shebang names the language."""
+
+        self.assertEqual(
+            self.convert("    #!/usr/bin/env python3\n    print(1)\n"),
+            '<pre class="highlight"><code class="language-python3">'
+            "#!/usr/bin/env python3\nprint(1)\n\n</code></pre>",
+        )
+        self.assertEqual(
+            self.convert("    print(1)\n"),
+            '<pre class="highlight"><code>print(1)\n\n</code></pre>',
+        )
+
+    def test_max_size(self):
+        """Test that blocks over the size limit are left alone."""
+
+        self.assertEqual(
+            self.convert(
+                "    print(1)\n\nText\n\n    #!/bin/sh\n    echo big\n", max_size=10
+            ),
+            '<pre class="highlight"><code>print(1)\n</code></pre>\n\n'
+            "<p>Text</p>\n"
+            "<pre><code>#!/bin/sh\necho big\n</code></pre>",
+        )
+
+
+class TestCompactHighlight(unittest.TestCase):
+    """Test compact Pygments output."""
+
+    SOURCE = "def main(a, b):\n    return a  +  b  # add\n"
+
+    def strip(self, html):
+        """Get the text of highlighted code."""
+
+        return re.sub(r"<[^>]+>", "", html)
+
+    def test_compact_classes(self):
+        """Test that whitespace is not wrapped and the text is unchanged."""
+
+        normal = highlight.Highlight(guess_lang=False).highlight(self.SOURCE, "python")
+        compact = highlight.Highlight(guess_lang=False, compact=True).highlight(
+            self.SOURCE, "python"
+        )
+        self.assertNotIn('<span class="w">', compact)
+        self.assertLess(len(compact), len(normal))
+        self.assertEqual(self.strip(compact), self.strip(normal))
+
+    def styles(self, html):
+        """Get the inline style of each character of highlighted code that isn't whitespace."""
+
+        stack = [""]
+        styles = []
+        for m in re.finditer(r'<(/?)span(?: style="([^"]*)")?>|<[^>]+>|([^<]+)', html):
+            if m.group(3):
+                styles.extend((stack[-1], c) for c in m.group(3) if not c.isspace())
+            elif m.group(1):
+                stack.pop()
+            elif m.group(0).startswith("<span"):
+                stack.append(m.group(2) or "")
+        return styles
+
+    def test_compact_noclasses(self):
+        """Test that tokens with the same inline style are merged and keep it."""
+
+        normal = highlight.Highlight(guess_lang=False, noclasses=True).highlight(
+            self.SOURCE, "python"
+        )
+        compact = highlight.Highlight(
+            guess_lang=False, noclasses=True, compact=True
+        ).highlight(self.SOURCE, "python")
+        self.assertIn("style=", compact)
+        self.assertNotIn("<span class=", compact)
+        self.assertLess(compact.count("<span"), normal.count("<span"))
+        self.assertEqual(self.strip(compact), self.strip(normal))
+        self.assertEqual(self.styles(compact), self.styles(normal))
+
+    def test_token_class(self):
+        """Test that token classes are the ones Pygments gives them."""
+
+        from pygments.formatters import HtmlFormatter
+        from pygments.token import STANDARD_TYPES, Token
+
+        formatter = HtmlFormatter()
+        for ttype in (Token.Name.Function, Token.Text, Token.Name.Function.Magic, Token.Custom):
+            self.assertEqual(
+                highlight.get_token_class(ttype, STANDARD_TYPES),
+                formatter._get_css_class(ttype),
+            )
+
+
+class TestCodeIndex(unittest.TestCase):
+    """Test collecting the plain text of fences while highlighting them."""
+
+    SOURCE = "```python\ndef main(a):\n    return a + 1\n```\n\n```\nplain\n```\n"
+
+    def convert(self, **config):
+        """Convert and return the code index."""
+
+        md = markdown.Markdown(
+            extensions=["pymdownx.superfences", "pymdownx.highlight"],
+            extension_configs={
+                "pymdownx.superfences": {"code_index": True},
+                "pymdownx.highlight": config,
+            },
+        )
+        md.convert(self.SOURCE)
+        return md.superfences_index
+
+    def test_pygments(self):
+        """Test that identifiers come from the lexer."""
+
+        self.assertEqual(
+            self.convert(),
+            [
+                {
+                    "language": "python",
+                    "text": "def main(a):\n    return a + 1\n",
+                    "identifiers": ["main", "a"],
+                },
+                {"language": "", "text": "plain\n", "identifiers": []},
+            ],
+        )
+
+    def test_no_pygments(self):
+        """Test that words are used as identifiers when code isn't lexed."""
+
+        self.assertEqual(
+            self.convert(use_pygments=False)[0],
+            {
+                "language": "python",
+                "text": "def main(a):\n    return a + 1",
+                "identifiers": ["def", "main", "a", "return"],
+            },
+        )
+
+    def test_highlight_index(self):
+        """Test that the index matches the highlighted text."""
+
+        index = []
+        html = highlight.Highlight(guess_lang=False).highlight(
+            "x = 1\n", "python", index=index
+        )
+        self.assertEqual(re.sub(r"<[^>]+>", "", html).strip(), index[0]["text"].strip())
+        self.assertEqual(index[0]["identifiers"], ["x"])
+
+
+class TestLexerSnapshot(unittest.TestCase):
+    """Test looking up lexers in a snapshot of aliases."""
+
+    def setUp(self):
+        """Save a snapshot."""
+
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, "lexers.json")
+        self.snapshot = highlight.build_lexer_snapshot(self.path)
+
+    def tearDown(self):
+        """Remove the snapshot."""
+
+        self.tempdir.cleanup()
+
+    def test_snapshot(self):
+        """Test that the snapshot finds the same lexers as Pygments."""
+
+        self.assertEqual(self.snapshot["py"], ["pygments.lexers.python", "PythonLexer"])
+        self.assertEqual(highlight.load_lexer_snapshot(self.path), self.snapshot)
+
+        hl = highlight.Highlight(guess_lang=False, lexer_snapshot=self.path)
+        self.assertEqual(hl.get_lexer("", "Python").__class__.__name__, "PythonLexer")
+        self.assertEqual(hl.get_lexer("", "nosuch").__class__.__name__, "TextLexer")
+        self.assertEqual(
+            hl.highlight("x = 1", "python"),
+            highlight.Highlight(guess_lang=False).highlight("x = 1", "python"),
+        )
+
+    def test_warm_up(self):
+        """Test that warming up imports the lexers."""
+
+        highlight.warm_up(["yaml"], lexer_snapshot=self.path)
+        self.assertIn("pygments.lexers.data", sys.modules)
+
+
+class TestBudget(unittest.TestCase):
+    """Test per-document budgets."""
+
+    def setUp(self):
+        """Create snippets and an image."""
+
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.base = self.tempdir.name
+        for name, content in (("a.md", 'A\n\n--8<-- "b.md"\n'), ("b.md", "B\n")):
+            with open(os.path.join(self.base, name), "w") as f:
+                f.write(content)
+        with open(os.path.join(self.base, "a.png"), "wb") as f:
+            f.write(b"0123456789")
+
+    def tearDown(self):
+        """Remove the files."""
+
+        self.tempdir.cleanup()
+
+    def markdown(self, **budget):
+        """Get a Markdown instance with a budget."""
+
+        return markdown.Markdown(
+            extensions=[
+                "pymdownx.budget",
+                "pymdownx.snippets",
+                "pymdownx.emoji",
+                "pymdownx.keys",
+                "pymdownx.superfences",
+                "pymdownx.b64",
+            ],
+            extension_configs={
+                "pymdownx.budget": budget,
+                "pymdownx.snippets": {"base_path": self.base},
+                "pymdownx.b64": {"base_path": self.base},
+            },
+        )
+
+    def test_limits(self):
+        """Test that extensions fall back to plain output over their limits."""
+
+        md = self.markdown(
+            max_snippet_depth=1, max_emoji=1, max_keys=1, max_fence_bytes=5
+        )
+        html = md.convert(
+            '--8<-- "a.md"\n\n:smile: :smile:\n\n++ctrl+a++ ++ctrl+b++\n\n'
+            "```\nx = 1\n```\n\n```\nx = 10\n```\n"
+        )
+        self.assertIn("<p>A</p>", html)
+        self.assertNotIn("<p>B</p>", html)
+        self.assertIn("/> :smile:</p>", html)
+        self.assertIn("</span> ++ctrl+b++</p>", html)
+        self.assertIn('<div class="highlight"><pre><span></span>x = 1', html)
+        self.assertIn("<pre><code>x = 10</code></pre>", html)
+        self.assertEqual(
+            sorted((entry["extension"], entry["limit"]) for entry in md.budget.report),
+            [
+                ("emoji", "max_emoji"),
+                ("keys", "max_keys"),
+                ("snippets", "max_snippet_depth"),
+                ("superfences", "max_fence_bytes"),
+            ],
+        )
+
+        # The budget starts over for each document.
+        md.convert(":smile:")
+        self.assertEqual(md.budget.report, [])
+
+    def test_bytes(self):
+        """Test that byte limits are counted across the document."""
+
+        md = self.markdown(max_snippet_bytes=10, max_b64_bytes=15)
+        html = md.convert('--8<-- "b.md"\n\n--8<-- "a.md"\n\n![](a.png) ![](a.png)')
+        self.assertIn("<p>B</p>", html)
+        self.assertNotIn("<p>A</p>", html)
+        self.assertEqual(html.count("data:image/png;base64"), 1)
+        self.assertEqual(html.count('src="a.png"'), 1)
+        self.assertEqual(
+            [(entry["limit"], entry["count"]) for entry in md.budget.report],
+            [("max_snippet_bytes", 1), ("max_b64_bytes", 1)],
+        )
+
+    def test_timeout(self):
+        """Test that extensions fall back to plain output when time is up."""
+
+        md = self.markdown(timeout=1e-9)
+        self.assertEqual(md.convert(":smile: ++ctrl+a++"), "<p>:smile: ++ctrl+a++</p>")
+        self.assertEqual(
+            sorted((entry["extension"], entry["limit"]) for entry in md.budget.report),
+            [("emoji", "timeout"), ("keys", "timeout")],
+        )
+
+
+class TestPlaceholders(unittest.TestCase):
+    """Test restoring placeholders in one pass."""
+
+    def test_order(self):
+        """Test that text put back for one kind is only searched for later kinds."""
+
+        placeholders = util.Placeholders()
+        placeholders.add("b", r"<b(\d)>", lambda m: "<a%s>" % m.group(1))
+        placeholders.add("a", r"<a(\d)>", lambda m: "[%s]" % m.group(1), "<b")
+        placeholders.add("b", r"<b(\d)>", lambda m: "<a%s><c>" % m.group(1))
+        placeholders.add("c", r"<c>", lambda m: None)
+
+        self.assertEqual(list(placeholders.kinds.keys()), ["a", "b", "c"])
+        self.assertEqual(placeholders.restore("<a1><b2>"), "[1]<a2><c>")
+
+    def test_extensions(self):
+        """Test that stashed HTML, critic marks, and escapes share one pass."""
+
+        md = markdown.Markdown(
+            extensions=["pymdownx.critic", "pymdownx.escapeall", "pymdownx.superfences"]
+        )
+
+        # The `unescape` pass stays, so extensions can still be positioned after it.
+        self.assertEqual(
+            list(md.postprocessors.keys()), ["raw_html", "amp_substitute", "unescape"]
+        )
+        self.assertEqual(md.postprocessors["unescape"].run("\x0242\x03"), "\x0242\x03")
+        self.assertEqual(
+            list(util.get_placeholders(md).kinds.keys()),
+            ["raw_html", "critic", "unescape"],
+        )
+        self.assertEqual(
+            md.convert(
+                "<div>{++a++}</div>\n\n\\* {--b--} \\&\n\n```\n\\*\n```\n"
+            ),
+            '<div><ins class="critic">a</ins></div>\n\n'
+            '<p>* <del class="critic">b</del> &</p>\n'
+            '<div class="highlight"><pre><span></span>\\*\n</pre></div>',
+        )
+
+
+class TestInactivePostprocessors(unittest.TestCase):
+    """Test that postprocessors skip documents with nothing for them."""
+
+    def markdown(self, *extensions):
+        """Get a Markdown instance with B64 and PlainHtml."""
+
+        return markdown.Markdown(
+            extensions=list(extensions) + ["pymdownx.b64", "pymdownx.plainhtml"],
+            extension_configs={
+                "pymdownx.b64": {"base_path": os.path.join(CURRENT_DIR, "extensions")}
+            },
+        )
+
+    def test_plain(self):
+        """Test that a plain document leaves the postprocessors inactive."""
+
+        md = self.markdown("pymdownx.critic", "pymdownx.escapeall")
+
+        self.assertEqual(md.convert("Some *text*."), "<p>Some <em>text</em>.</p>")
+        self.assertFalse(md.postprocessors["b64"].active)
+        self.assertFalse(md.postprocessors["plain-html"].active)
+
+    def test_active(self):
+        """Test that tags in the tree, the HTML stash, and escapes are still seen."""
+
+        md = self.markdown("pymdownx.escapeall")
+        for source in (
+            "![a](_assets/bg.png)",
+            '<img src="_assets/bg.png" id="a">',
+            '\\<img src="_assets/bg.png" id="a"\\>',
+        ):
+            md.reset()
+            html = md.convert(source)
+            self.assertTrue(md.postprocessors["b64"].active)
+            self.assertIn('src="data:image/png;base64,', html)
+            self.assertNotIn("id=", html)
+
+    def test_critic(self):
+        """Test that markup put back by critic is still stripped."""
+
+        md = self.markdown("pymdownx.critic")
+
+        self.assertEqual(md.convert("{++a++}"), "<p><ins>a</ins></p>")
+        self.assertTrue(md.postprocessors["plain-html"].active)
+
+    def test_other_escapes(self):
+        """Test that escapes EscapeAll didn't make are still put back."""
+
+        md = self.markdown("pymdownx.arithmatex", "pymdownx.escapeall")
+
+        self.assertEqual(md.convert("\\\\$a$"), "<p>\\<span>\\(a\\)</span></p>")
+
+
+class TestFusedLines(unittest.TestCase):
+    """Test running line preprocessors as one pass."""
+
+    SOURCE = (
+        "{++Added++} text.\n\n"
+        '--8<-- "a.txt"\n\n'
+        "```py\nx = {--1--}\n```\n\n"
+        "- item\n\n    ```\n    code\n    ```\n\n"
+        "{~~one~>two~~}\n"
+    )
+
+    def markdown(self, *extensions):
+        """Get a Markdown instance with Critic, Snippets, and SuperFences."""
+
+        return markdown.Markdown(
+            extensions=list(extensions)
+            + ["pymdownx.critic", "pymdownx.snippets", "pymdownx.superfences"],
+            extension_configs={
+                "pymdownx.snippets": {
+                    "base_path": os.path.join(CURRENT_DIR, "extensions", "_snippets")
+                }
+            },
+        )
+
+    def test_same_output(self):
+        """Test that fused and separate passes give the same output."""
+
+        md = self.markdown()
+        fused = self.markdown("pymdownx.fusedlines")
+
+        expected = md.convert(self.SOURCE)
+        self.assertEqual(fused.convert(self.SOURCE), expected)
+        fused.reset()
+        self.assertEqual(fused.convert(self.SOURCE), expected)
+
+    def test_one_pass(self):
+        """Test that the preprocessors after the first one pass the lines on."""
+
+        md = self.markdown("pymdownx.fusedlines")
+        preprocessors = [
+            md.preprocessors[name]
+            for name in ("critic", "fenced_code_block", "snippet")
+        ]
+
+        lines = preprocessors[0].run(["{++a++}", "```", "b", "```"])
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(md.fused_lines.skip, set(preprocessors[1:]))
+        for preprocessor in preprocessors[1:]:
+            self.assertIs(preprocessor.run(lines), lines)
+        self.assertEqual(md.fused_lines.skip, set())
+
+    def test_pass_through(self):
+        """Test that a line preprocessor passes the lines through by default."""
+
+        md = self.markdown("pymdownx.fusedlines")
+        md.preprocessors.add("lines", util.LinePreprocessor(md), ">critic")
+
+        self.assertEqual(md.convert(self.SOURCE), self.markdown().convert(self.SOURCE))
+
+
 def run():
     """Run pytest."""
 